@@ -0,0 +1,43 @@
+"""
+Times the MultiVector operators in G3 and G3C, and how much of each is spent
+outside the gmt kernel.
+
+Only public API that predates the operator fast paths is used, so the same
+script can be run on two revisions to compare them:
+
+    python benchmarks/operator_speed.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from clifford import Cl, conformalize
+
+
+def time_call(func, number=2000, repeat=5):
+    """ Returns the best time of one call of func, in seconds """
+    return min(timeit.repeat(func, number=number, repeat=repeat))/number
+
+
+def main():
+    print('%-4s %-4s %10s %22s' % ('', '', 'time (us)', 'overhead over gmt (us)'))
+    for name, layout in [('G3', Cl(3)[0]), ('G3C', conformalize(Cl(3)[0])[0])]:
+        a = layout.randomMV()
+        b = layout.randomMV()
+        # Operands whose grades are known, as for the results of operators
+        c = a(1) + a(3)
+        d = b(2)
+        kernel = layout.gmt_func
+        a_value = a.value
+        b_value = b.value
+        operators = [('a*b', lambda: a*b), ('c*d', lambda: c*d), ('a^b', lambda: a ^ b),
+                     ('a+b', lambda: a + b), ('2*a', lambda: 2*a)]
+        kernel_time = time_call(lambda: kernel(a_value, b_value))
+        for op_name, op in operators:
+            op_time = time_call(op)
+            print('%-4s %-4s %10.2f %22.2f' % (name, op_name, op_time*1e6, (op_time - kernel_time)*1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,13 @@ Classes
 
     MultiVector
     Layout
+    MVBatch
+    GradePacking
+    PackedMV
+    BitmapLayout
+    BitmapMV
+    LazyMV
+    TracedFunction
     Frame
 
 Functions
@@ -26,6 +33,7 @@ Functions
 
     Cl
     conformalize
+    trace_mv
     grade_obj
     bases
     randomMV
@@ -46,13 +54,20 @@ import re
 import math
 import numbers
 import itertools
+import weakref
 from warnings import warn
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 # Major library imports.
 import numpy as np
 from numpy import linalg, array,zeros
 import numba
 
+from . import caching
+
 __version__ = '1.0.0'
 
 # The blade finding regex for parsing strings of mvs
@@ -61,6 +76,9 @@ _eps = 1e-12            # float epsilon for float comparisons
 _pretty = True          # pretty-print global
 _print_precision = 5    # pretty printing precision on floats
 
+# Process-wide registry of the layouts built by Layout.interned
+_layout_registry = weakref.WeakValueDictionary()
+
 
 def get_longest_string(string_array):
     """
@@ -69,87 +87,1258 @@ def get_longest_string(string_array):
     return max(string_array,key=len)
 
 
+class _cached_property(object):
+    """
+    A property that is computed on first access and then stored on the
+    instance, replacing itself
+    """
+
+    def __init__(self, getter):
+        self.getter = getter
+        self.__doc__ = getter.__doc__
+        self.__name__ = getter.__name__
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = self.getter(obj)
+        setattr(obj, self.__name__, value)
+        return value
+
+
 def get_adjoint_function(gradeList):
     '''
     This function returns a fast jitted adjoint function
     '''
     grades = np.array(gradeList)
     signs = np.power(-1, grades*(grades-1)/2)
-    @numba.njit
+    @numba.njit(nogil=True)
     def adjoint_func(value):
         return signs * value  # elementwise multiplication
     return adjoint_func
 
 
-def get_mult_function(sparse_mult, n_dims, gradeList, grades_a=None, grades_b=None, filter_mask=None):
-    '''
-    Returns a function that implements the mult_table on two input multivectors
-    '''
-    non_zero_indices =  np.transpose(np.array(list(sparse_mult.keys())))
-    k_list = non_zero_indices[0]
-    l_list = non_zero_indices[1]
-    m_list = non_zero_indices[2]
-    mult_table_vals = np.array([sparse_mult[k, l, m] for k, l, m in np.transpose(non_zero_indices)], dtype=int)
+class SparseMultTable(Mapping):
+    """ Compact storage of a multiplication table in coordinate (COO) form.
 
-    if filter_mask is not None:
-        # We can pass the sparse filter mask directly
-        k_list = k_list[filter_mask]
-        l_list = l_list[filter_mask]
-        m_list = m_list[filter_mask]
-        mult_table_vals = mult_table_vals[filter_mask]
-
-        @numba.njit
-        def mv_mult(value, other_value):
-            output = np.zeros(n_dims)
-            for ind, k in enumerate(k_list):
-                m = m_list[ind]
-                l = l_list[ind]
-                output[l] += value[k] * mult_table_vals[ind] * other_value[m]
-            return output
+    Entry n of the table states that the product of blade k_list[n] with
+    blade m_list[n] contributes mult_table_vals[n] times blade l_list[n].
+    The blade indices are stored as int32 arrays and the signs as an int8
+    array, which is what the product kernels consume directly.
+
+    For compatibility the table also behaves as a read-only mapping from
+    (k, l, m) tuples to signs. The dictionary backing that view is only
+    built the first time it is needed.
+    """
 
-        return mv_mult
+    def __init__(self, k_list, l_list, m_list, mult_table_vals, gaDims):
+        self.k_list = np.ascontiguousarray(k_list, dtype=np.int32)
+        self.l_list = np.ascontiguousarray(l_list, dtype=np.int32)
+        self.m_list = np.ascontiguousarray(m_list, dtype=np.int32)
+        self.mult_table_vals = np.ascontiguousarray(mult_table_vals, dtype=np.int8)
+        self.gaDims = gaDims
+        self._dict = None
+
+    @classmethod
+    def from_dict(cls, sparse_mult, gaDims):
+        """ Builds a table from a dictionary mapping (k, l, m) to signs """
+        keys = np.array(list(sparse_mult.keys()), dtype=np.int32).reshape(-1, 3)
+        vals = np.array(list(sparse_mult.values()), dtype=np.int8)
+        return cls(keys[:, 0], keys[:, 1], keys[:, 2], vals, gaDims)
+
+    def filter(self, mask):
+        """ Returns a new table containing only the entries selected by mask """
+        return self.__class__(self.k_list[mask], self.l_list[mask], self.m_list[mask],
+                              self.mult_table_vals[mask], self.gaDims)
 
-    elif ((grades_a is not None) and (grades_b is not None)):
-        # We can also specify sparseness by grade
-        filter_mask = np.zeros(len(k_list), dtype=bool)
-        for i in range(len(filter_mask)):
-            if gradeList[k_list[i]] in grades_a:
-                if gradeList[m_list[i]] in grades_b:
-                    filter_mask[i] = 1
-
-        k_list = k_list[filter_mask]
-        l_list = l_list[filter_mask]
-        m_list = m_list[filter_mask]
-        mult_table_vals = mult_table_vals[filter_mask]
-
-        @numba.njit
-        def mv_mult(value, other_value):
-            output = np.zeros(n_dims)
-            for ind, k in enumerate(k_list):
-                m = m_list[ind]
+    @property
+    def nbytes(self):
+        """ Memory used by the table arrays in bytes """
+        return (self.k_list.nbytes + self.l_list.nbytes +
+                self.m_list.nbytes + self.mult_table_vals.nbytes)
+
+    def as_dict(self):
+        """ The table as a dictionary mapping (k, l, m) tuples to signs """
+        if self._dict is None:
+            keys = zip(self.k_list.tolist(), self.l_list.tolist(), self.m_list.tolist())
+            self._dict = dict(zip(keys, self.mult_table_vals.tolist()))
+        return self._dict
+
+    def __getitem__(self, key):
+        return self.as_dict()[key]
+
+    def __iter__(self):
+        return iter(self.as_dict())
+
+    def __len__(self):
+        return len(self.mult_table_vals)
+
+    def __repr__(self):
+        return "SparseMultTable(gaDims=%i, entries=%i)" % (self.gaDims, len(self))
+
+
+# Types of the arguments of the generic product kernels. Every array is
+# accepted as read-only with any layout, so the same compiled code serves
+# values passed from python as well as the constant tables captured by the
+# per-layout functions returned by get_mult_function.
+_value_array_type = numba.types.Array(numba.types.float64, 1, 'A', readonly=True)
+_index_array_type = numba.types.Array(numba.types.int32, 1, 'A', readonly=True)
+_sign_array_type = numba.types.Array(numba.types.int8, 1, 'A', readonly=True)
+_mult_kernel_signature = numba.types.float64[::1](
+    _value_array_type, _value_array_type,
+    _index_array_type, _index_array_type, _index_array_type, _sign_array_type,
+    numba.types.int64)
+_mult_into_kernel_signature = numba.types.void(
+    _value_array_type, _value_array_type,
+    _index_array_type, _index_array_type, _index_array_type, _sign_array_type,
+    numba.types.float64[::1])
+
+
+@numba.njit(_mult_into_kernel_signature, nogil=True, cache=True)
+def dense_mult_into_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, output):
+    """
+    Multiplies value by other_value using the sparse table given by the
+    k_list, l_list, m_list and mult_table_vals arrays, skipping the table
+    entries of coefficients that are zero. The result is written to output,
+    which must not share memory with value or other_value.
+    """
+    output[:] = 0.0
+    for ind, k in enumerate(k_list):
+        v_val = value[k]
+        if v_val != 0.0:
+            m = m_list[ind]
+            ov_val = other_value[m]
+            if ov_val != 0.0:
                 l = l_list[ind]
-                output[l] += value[k] * mult_table_vals[ind] * other_value[m]
-            return output
+                output[l] += v_val * mult_table_vals[ind] * ov_val
 
-        return mv_mult
 
-    # This case we specify no sparseness in advance, the algorithm checks for zeros
-    @numba.njit
-    def mv_mult(value, other_value):
-        output = np.zeros(n_dims)
+@numba.njit(_mult_into_kernel_signature, nogil=True, cache=True)
+def sparse_mult_into_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, output):
+    """
+    Multiplies value by other_value using the sparse table given by the
+    k_list, l_list, m_list and mult_table_vals arrays, which is assumed to
+    have been filtered down to the entries that can be non-zero. The result
+    is written to output, which must not share memory with value or
+    other_value.
+    """
+    output[:] = 0.0
+    for ind, k in enumerate(k_list):
+        m = m_list[ind]
+        l = l_list[ind]
+        output[l] += value[k] * mult_table_vals[ind] * other_value[m]
+
+
+@numba.njit(_mult_kernel_signature, nogil=True, cache=True)
+def dense_mult_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Multiplies value by other_value with dense_mult_into_kernel, returning
+    a new array
+    """
+    output = np.empty(n_dims)
+    dense_mult_into_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, output)
+    return output
+
+
+@numba.njit(_mult_kernel_signature, nogil=True, cache=True)
+def sparse_mult_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Multiplies value by other_value with sparse_mult_into_kernel, returning
+    a new array
+    """
+    output = np.empty(n_dims)
+    sparse_mult_into_kernel(value, other_value, k_list, l_list, m_list, mult_table_vals, output)
+    return output
+
+
+# The kernel writing to an existing array that matches each product kernel
+_mult_into_kernels = {
+    dense_mult_kernel: dense_mult_into_kernel,
+    sparse_mult_kernel: sparse_mult_into_kernel,
+}
+
+
+@numba.guvectorize([(numba.float64[:], numba.float64[:],
+                     numba.int32[:], numba.int32[:], numba.int32[:], numba.int8[:],
+                     numba.float64[:])],
+                   '(n),(n),(k),(k),(k),(k)->(n)', nopython=True, cache=True)
+def mult_gufunc(value, other_value, k_list, l_list, m_list, mult_table_vals, output):
+    """
+    Generalized ufunc version of dense_mult_kernel, broadcasting over the
+    leading dimensions of value and other_value
+    """
+    output[:] = 0.0
+    for ind, k in enumerate(k_list):
+        v_val = value[k]
+        if v_val != 0.0:
+            ov_val = other_value[m_list[ind]]
+            if ov_val != 0.0:
+                output[l_list[ind]] += v_val * mult_table_vals[ind] * ov_val
+
+
+@numba.guvectorize([(numba.float64[:], numba.float64[:], numba.float64[:])],
+                   '(n),(n)->(n)', nopython=True, cache=True)
+def scale_gufunc(value, factors, output):
+    """
+    Generalized ufunc multiplying each coefficient of value by the matching
+    entry of factors, such as the signs of a reversion or a grade mask
+    """
+    output[:] = value * factors
+
+
+@numba.guvectorize([(numba.float64[:], numba.float64[:],
+                     numba.int32[:], numba.int32[:], numba.float64[:],
+                     numba.float64[:])],
+                   '(n),(n),(k),(k),(k)->()', nopython=True, cache=True)
+def scalar_part_gufunc(value, other_value, k_list, m_list, factors, output):
+    """
+    Generalized ufunc version of scalar_part_kernel, broadcasting over the
+    leading dimensions of value and other_value
+    """
+    result = 0.0
+    for ind, k in enumerate(k_list):
+        result += factors[ind] * value[k] * other_value[m_list[ind]]
+    output[0] = result
+
+
+# The parallel kernels work on the rows of two dimensional arrays of values.
+# Like the kernels for inverses, exponentials and logarithms below they are
+# rarely needed, so they are compiled on their first call rather than when
+# clifford is imported.
+@numba.njit(parallel=True, nogil=True, cache=True)
+def parallel_mult_kernel(values, other_values, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Multiplies the rows of values by the rows of other_values as in
+    dense_mult_kernel, with the rows split between threads. Either array may
+    have a single row, which is then used for every row of the other.
+    """
+    n_values = values.shape[0]
+    n_other_values = other_values.shape[0]
+    n_rows = max(n_values, n_other_values)
+    output = np.zeros((n_rows, n_dims))
+    for row in numba.prange(n_rows):
+        if n_values == 1:
+            value = values[0]
+        else:
+            value = values[row]
+        if n_other_values == 1:
+            other_value = other_values[0]
+        else:
+            other_value = other_values[row]
         for ind, k in enumerate(k_list):
             v_val = value[k]
             if v_val != 0.0:
-                m = m_list[ind]
-                ov_val = other_value[m]
+                ov_val = other_value[m_list[ind]]
                 if ov_val != 0.0:
-                    l = l_list[ind]
-                    output[l] += v_val * mult_table_vals[ind] * ov_val
-        return output
+                    output[row, l_list[ind]] += v_val * mult_table_vals[ind] * ov_val
+    return output
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def parallel_sparse_mult_kernel(values, other_values, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Multiplies the rows of values by the rows of other_values as
+    parallel_mult_kernel does, but like sparse_mult_kernel without testing
+    the coefficients for zero, for tables holding only the entries needed
+    """
+    n_values = values.shape[0]
+    n_other_values = other_values.shape[0]
+    n_rows = max(n_values, n_other_values)
+    output = np.zeros((n_rows, n_dims))
+    for row in numba.prange(n_rows):
+        if n_values == 1:
+            value = values[0]
+        else:
+            value = values[row]
+        if n_other_values == 1:
+            other_value = other_values[0]
+        else:
+            other_value = other_values[row]
+        for ind, k in enumerate(k_list):
+            output[row, l_list[ind]] += value[k] * mult_table_vals[ind] * other_value[m_list[ind]]
+    return output
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def parallel_normalise_kernel(values, k_list, m_list, factors):
+    """
+    Divides every row X of values by sqrt(abs(<~X X>)), with the rows split
+    between threads. The scalar part of ~X X is the sum over n of
+    factors[n] * X[k_list[n]] * X[m_list[n]].
+    """
+    output = np.empty((values.shape[0], values.shape[1]))
+    for row in numba.prange(values.shape[0]):
+        mag2 = 0.0
+        for ind, k in enumerate(k_list):
+            mag2 += factors[ind] * values[row, k] * values[row, m_list[ind]]
+        output[row, :] = values[row, :] / np.sqrt(abs(mag2))
+    return output
+
+
+_factor_array_type = numba.types.Array(numba.types.float64, 1, 'A', readonly=True)
+
+
+@numba.njit(numba.types.float64(
+    _value_array_type, _value_array_type, _index_array_type, _index_array_type, _factor_array_type),
+    nogil=True, cache=True)
+def scalar_part_kernel(value, other_value, k_list, m_list, factors):
+    """
+    Returns the sum over n of factors[n] * value[k_list[n]] * other_value[m_list[n]].
+
+    With the entries of a product table that give the scalar part, as in
+    Layout._scalar_product_table, this is the scalar part of the product,
+    found in gaDims steps instead of the gaDims**2 of the full product.
+    """
+    result = 0.0
+    for ind, k in enumerate(k_list):
+        result += factors[ind] * value[k] * other_value[m_list[ind]]
+    return result
+
+
+# MVBatch uses the parallel kernels for batches of at least this many
+# multivectors, below which starting the threads costs more than it saves
+PARALLEL_BATCH_SIZE = 4096
+
+
+def grade_filter_mask(sparse_mult, gradeList, grades_a=None, grades_b=None, grades_out=None):
+    '''
+    Returns a mask selecting the entries of sparse_mult whose first operand
+    has a grade in grades_a, whose second operand has a grade in grades_b
+    and whose output has a grade in grades_out. None allows any grade.
+    '''
+    grades = np.asarray(gradeList)
+    mask = np.ones(len(sparse_mult), dtype=bool)
+    for index_list, allowed in ((sparse_mult.k_list, grades_a),
+                                (sparse_mult.m_list, grades_b),
+                                (sparse_mult.l_list, grades_out)):
+        if allowed is not None:
+            mask &= np.isin(grades[index_list], allowed)
+    return mask
+
+
+def get_mult_function(sparse_mult, n_dims, gradeList, grades_a=None, grades_b=None, filter_mask=None,
+                      skip_zeros=True):
+    '''
+    Returns a function that implements the mult_table on two input multivectors
+
+    sparse_mult is either a SparseMultTable or a dictionary mapping
+    (k, l, m) tuples to signs.
+
+    The returned function is a thin jitted wrapper binding the table arrays
+    to dense_mult_kernel or sparse_mult_kernel, which are compiled once and
+    cached on disk rather than once per layout. The coefficients are only
+    tested for zero, by dense_mult_kernel, if skip_zeros is set and the
+    table is not restricted by grade or filter_mask.
+
+    The result can be written to an existing contiguous float64 array with
+    out=, which must not share memory with the operands.
+    '''
+    if not isinstance(sparse_mult, SparseMultTable):
+        sparse_mult = SparseMultTable.from_dict(sparse_mult, n_dims)
+
+    if filter_mask is None and ((grades_a is not None) and (grades_b is not None)):
+        # We can also specify sparseness by grade
+        filter_mask = grade_filter_mask(sparse_mult, gradeList, grades_a, grades_b)
+
+    if filter_mask is not None:
+        # The table only contains the entries we need, so we can skip the
+        # zero checks
+        sparse_mult = sparse_mult.filter(filter_mask)
+        mult_kernel = sparse_mult_kernel
+    elif not skip_zeros:
+        mult_kernel = sparse_mult_kernel
+    else:
+        # This case we specify no sparseness in advance, the algorithm checks for zeros
+        mult_kernel = dense_mult_kernel
+    mult_into_kernel = _mult_into_kernels[mult_kernel]
+
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+
+    @numba.njit(nogil=True)
+    def mv_mult(value, other_value, out=None):
+        if out is None:
+            return mult_kernel(np.asarray(value, dtype=np.float64),
+                               np.asarray(other_value, dtype=np.float64),
+                               k_list, l_list, m_list, mult_table_vals, n_dims)
+        mult_into_kernel(np.asarray(value, dtype=np.float64),
+                         np.asarray(other_value, dtype=np.float64),
+                         k_list, l_list, m_list, mult_table_vals, out)
+        return out
+
+    return mv_mult
+
+
+def bind_mult_gufunc(sparse_mult):
+    '''
+    Returns a function that multiplies arrays of multivector values of shape
+    (..., n_dims) by passing the arrays of sparse_mult to mult_gufunc.
+
+    The leading dimensions broadcast as for any numpy ufunc, and the result
+    can be written to an existing array with out=.
+    '''
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+
+    def mv_mult(value, other_value, out=None):
+        return mult_gufunc(value, other_value, k_list, l_list, m_list, mult_table_vals, out=out)
+
+    return mv_mult
+
+
+def bind_scale_gufunc(factors):
+    '''
+    Returns a function that multiplies arrays of multivector values of shape
+    (..., n_dims) coefficient-wise by factors with scale_gufunc
+    '''
+    factors = np.ascontiguousarray(factors, dtype=np.float64)
+
+    def mv_scale(value, out=None):
+        return scale_gufunc(value, factors, out=out)
+
+    return mv_scale
+
+
+def _as_rows(value, shape, n_dims):
+    """
+    Returns value as a two dimensional array with one row per multivector of
+    the broadcast shape, or with a single row if value is a single multivector
+    """
+    if value.shape[:-1] == shape:
+        return value.reshape(-1, n_dims)
+    if value.size == n_dims:
+        return value.reshape(1, n_dims)
+    return np.broadcast_to(value, shape + (n_dims,)).reshape(-1, n_dims)
+
+
+def bind_parallel_mult_kernel(sparse_mult, n_dims, mult_kernel=parallel_mult_kernel):
+    '''
+    Returns a function that multiplies arrays of multivector values of shape
+    (..., n_dims) by passing the arrays of sparse_mult to mult_kernel,
+    parallel_mult_kernel or parallel_sparse_mult_kernel. The leading
+    dimensions broadcast as in bind_mult_gufunc.
+    '''
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+
+    def mv_mult(value, other_value):
+        value = np.asarray(value, dtype=np.float64)
+        other_value = np.asarray(other_value, dtype=np.float64)
+        shape = np.broadcast(value[..., 0], other_value[..., 0]).shape
+        output = mult_kernel(_as_rows(value, shape, n_dims),
+                             _as_rows(other_value, shape, n_dims),
+                             k_list, l_list, m_list, mult_table_vals, n_dims)
+        return output.reshape(shape + (n_dims,))
+
+    return mv_mult
+
+
+def bind_mult_kernel(sparse_mult, n_dims, mult_kernel=dense_mult_kernel):
+    '''
+    Returns a plain python function that multiplies two multivector values
+    by passing the arrays of sparse_mult to mult_kernel.
+
+    Unlike get_mult_function this does not compile anything, so it is what
+    the MultiVector operators use. It cannot be called from jitted code.
+
+    The result can be written to an existing contiguous float64 array with
+    out=, which may be one of the operands.
+    '''
+    mult_into_kernel = _mult_into_kernels[mult_kernel]
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+
+    def mv_mult(value, other_value, out=None):
+        value = np.asarray(value, dtype=np.float64)
+        other_value = np.asarray(other_value, dtype=np.float64)
+        if out is None:
+            return mult_kernel(value, other_value,
+                               k_list, l_list, m_list, mult_table_vals, n_dims)
+        if np.may_share_memory(out, value) or np.may_share_memory(out, other_value):
+            out[:] = mult_kernel(value, other_value,
+                                 k_list, l_list, m_list, mult_table_vals, n_dims)
+        else:
+            mult_into_kernel(value, other_value,
+                             k_list, l_list, m_list, mult_table_vals, out)
+        return out
 
     return mv_mult
 
 
+# Algebras with at most this many blades use generated, unrolled product kernels
+MAX_UNROLLED_GADIMS = 64
+
+# In algebras with at most this many blades the MultiVector operators only
+# use grade-restricted kernels when the grades of both operands are already
+# known, since finding them costs more than the smaller kernel saves
+MAX_UNMASKED_GADIMS = 8
+
+
+def generate_mult_source(sparse_mult, n_dims, cache=True, skip_zeros=True):
+    '''
+    Returns the source of a module defining mv_mult, a jitted function that
+    evaluates the product described by the SparseMultTable sparse_mult with
+    straight-line code rather than by walking the table.
+
+    The straight-line code lives in mv_mult_into, which writes the result to
+    an existing array and is compiled for float64 arrays only. All the
+    coefficients are read before the result is written, so the output array
+    may be one of the operands. mv_mult converts its arguments before calling
+    it, so other input types only compile the small wrapper again, and
+    accepts the output array as out=.
+
+    Only the coefficients that appear in the table are read, and only the
+    outputs that appear in it are computed, so grade-restricted tables give
+    correspondingly smaller kernels. As in dense_mult_kernel, the terms of
+    each coefficient of value are skipped when it is zero, unless skip_zeros
+    is False, as for operands that are dense by construction.
+    '''
+    # Group the terms by the coefficient of value, keeping the summation
+    # order of the table kernels
+    order = np.lexsort((sparse_mult.m_list, sparse_mult.k_list))
+    terms = {}
+    for ind in order.tolist():
+        val = int(sparse_mult.mult_table_vals[ind])
+        if val == 0:
+            continue
+        k = int(sparse_mult.k_list[ind])
+        l = int(sparse_mult.l_list[ind])
+        m = int(sparse_mult.m_list[ind])
+        product = 'a%i*b%i' % (k, m)
+        if abs(val) != 1:
+            product = '%i*%s' % (abs(val), product)
+        terms.setdefault(k, []).append(
+            '        o%i %s= %s' % (l, '+' if val > 0 else '-', product))
+
+    outputs = sorted(set(sparse_mult.l_list.tolist()))
+    others = sorted(set(sparse_mult.m_list.tolist()))
+    lines = [
+        '"""Generated by clifford.generate_mult_source"""',
+        'import numba',
+        'import numpy as np',
+        '',
+        '',
+        'value_type = numba.types.Array(numba.types.float64, 1, "A", readonly=True)',
+        '',
+        '',
+        '@numba.njit(numba.types.void(value_type, value_type, numba.types.float64[::1]),',
+        '            nogil=True, cache=%s)' % bool(cache),
+        'def mv_mult_into(a, b, output):',
+    ]
+    lines += ['    b%i = b[%i]' % (m, m) for m in others]
+    lines += ['    o%i = 0.0' % l for l in outputs]
+    for k in sorted(terms):
+        lines.append('    a%i = a[%i]' % (k, k))
+        if skip_zeros:
+            lines.append('    if a%i != 0.0:' % k)
+            lines += terms[k]
+        else:
+            lines += [term[4:] for term in terms[k]]
+    if len(outputs) < n_dims or not outputs:
+        lines.append('    output[:] = 0.0')
+    lines += ['    output[%i] = o%i' % (l, l) for l in outputs]
+    lines += [
+        '',
+        '',
+        '@numba.njit(numba.types.float64[::1](value_type, value_type), nogil=True, cache=%s)' % bool(cache),
+        'def mv_mult_kernel(a, b):',
+        '    output = np.empty(%i)' % n_dims,
+        '    mv_mult_into(a, b, output)',
+        '    return output',
+        '',
+        '',
+        '@numba.njit(nogil=True, cache=%s)' % bool(cache),
+        'def mv_mult(value, other_value, out=None):',
+        '    if out is None:',
+        '        return mv_mult_kernel(np.asarray(value, dtype=np.float64),',
+        '                              np.asarray(other_value, dtype=np.float64))',
+        '    mv_mult_into(np.asarray(value, dtype=np.float64),',
+        '                 np.asarray(other_value, dtype=np.float64), out)',
+        '    return out',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def get_unrolled_mult_function(sparse_mult, n_dims, gradeList=None, grades_a=None, grades_b=None, filter_mask=None,
+                               skip_zeros=True):
+    '''
+    Returns a jitted function that evaluates the product described by
+    sparse_mult with code generated by generate_mult_source.
+
+    The table can be restricted by grade or by filter_mask in the same way
+    as in get_mult_function. skip_zeros is passed to generate_mult_source.
+
+    The generated module is written to the on-disk cache, so that numba can
+    reuse its compiled code in later processes. If caching is disabled the
+    code is compiled in memory instead.
+    '''
+    if not isinstance(sparse_mult, SparseMultTable):
+        sparse_mult = SparseMultTable.from_dict(sparse_mult, n_dims)
+    if filter_mask is None and ((grades_a is not None) and (grades_b is not None)):
+        filter_mask = grade_filter_mask(sparse_mult, gradeList, grades_a, grades_b)
+    if filter_mask is not None:
+        sparse_mult = sparse_mult.filter(filter_mask)
+    module = caching.load_generated_module(generate_mult_source(sparse_mult, n_dims, skip_zeros=skip_zeros))
+    if module is not None:
+        return module.mv_mult
+    namespace = {}
+    exec(generate_mult_source(sparse_mult, n_dims, cache=False, skip_zeros=skip_zeros), namespace)
+    return namespace['mv_mult']
+
+
+def _expression_sum(terms):
+    """ Returns the source of the sum of the (factor, expression) pairs terms """
+    source = ''
+    for factor, expression in terms:
+        if factor == 1:
+            source += ' + %s' % expression
+        elif factor == -1:
+            source += ' - %s' % expression
+        elif factor < 0:
+            source += ' - %r*%s' % (-factor, expression)
+        else:
+            source += ' + %r*%s' % (factor, expression)
+    if not source:
+        return '0.0'
+    if source.startswith(' + '):
+        return source[3:]
+    return '-' + source[3:]
+
+
+def generate_expression_source(layout, nodes, input_grades, cache=True):
+    '''
+    Returns the source of a module defining mv_expression, a jitted function
+    evaluating the expression given by nodes, and the bitmask of the grades
+    of its result.
+
+    nodes are the subexpressions in evaluation order, as returned by
+    LazyMV._linearize, the last one being the result, and input_grades the
+    bitmasks of the grades of the inputs. The grades each
+    subexpression can have are found from those of the inputs, and then
+    the grades of it that the result depends on. Only those coefficients
+    are computed, each from the terms of the tables that connect it to
+    coefficients that are computed, so projections, reversions and sums
+    cost nothing and products whose result is not needed are left out.
+    mv_expression takes the values of the inputs, as float64 arrays, in
+    the order of their numbers.
+    '''
+    n_nodes = len(nodes)
+    masks = []
+    for op, args, param in nodes:
+        if op == 'input':
+            mask = input_grades[args]
+        elif op in ('gmt', 'imt', 'omt', 'lcmt'):
+            mask = layout._product_grades(op, masks[args[0]], masks[args[1]])
+        elif op == 'add':
+            mask = masks[args[0]] | masks[args[1]]
+        elif op == 'project':
+            mask = masks[args[0]] & param
+        else:
+            mask = masks[args[0]]
+        masks.append(mask)
+
+    # The grades of each subexpression that the result depends on
+    needed = [0]*n_nodes
+    needed[-1] = masks[-1]
+    all_grades = range(layout.dims + 1)
+    for ind in range(n_nodes - 1, -1, -1):
+        op, args, param = nodes[ind]
+        need = needed[ind] & masks[ind]
+        needed[ind] = need
+        if not need or op == 'input':
+            continue
+        if op in ('gmt', 'imt', 'omt', 'lcmt'):
+            pairs = layout._product_grade_pairs(op)
+            mask_a = masks[args[0]]
+            mask_b = masks[args[1]]
+            for grade_a in all_grades:
+                for grade_b in all_grades:
+                    if mask_a >> grade_a & 1 and mask_b >> grade_b & 1 and pairs[grade_a, grade_b] & need:
+                        needed[args[0]] |= 1 << grade_a
+                        needed[args[1]] |= 1 << grade_b
+        elif op == 'normal':
+            needed[args[0]] |= masks[args[0]]
+        else:
+            for arg in args:
+                needed[arg] |= need
+
+    signs = {
+        'negate': [-1]*layout.gaDims,
+        'project': [1]*layout.gaDims,
+        'reverse': layout._reverse_signs.astype(int).tolist(),
+        'involute': layout._involute_signs.astype(int).tolist(),
+        'conjugate': layout._conjugate_signs.astype(int).tolist(),
+    }
+    n_inputs = 0
+    body = []
+    # Maps the index of each computed coefficient of every subexpression
+    # to the name of a variable and the sign it is taken with
+    coefs = []
+    for ind, (op, args, param) in enumerate(nodes):
+        indices = np.flatnonzero(layout._projection_mask(needed[ind])).tolist()
+        node_coefs = {}
+        if op == 'input':
+            n_inputs = max(n_inputs, args + 1)
+            for j in indices:
+                body.append('    c%i_%i = v%i[%i]' % (ind, j, args, j))
+                node_coefs[j] = ('c%i_%i' % (ind, j), 1)
+        elif not indices:
+            pass
+        elif op in ('gmt', 'imt', 'omt', 'lcmt'):
+            table = getattr(layout, op)
+            coefs_a = coefs[args[0]]
+            coefs_b = coefs[args[1]]
+            keep = np.zeros((3, layout.gaDims), dtype=bool)
+            keep[0, list(coefs_a)] = True
+            keep[1, indices] = True
+            keep[2, list(coefs_b)] = True
+            table = table.filter(keep[0, table.k_list] & keep[1, table.l_list] & keep[2, table.m_list])
+            # As in generate_mult_source, the terms of each coefficient of
+            # the first operand are skipped when it is zero
+            groups = {}
+            for k, l, m, val in zip(table.k_list.tolist(), table.l_list.tolist(),
+                                    table.m_list.tolist(), table.mult_table_vals.tolist()):
+                name_b, sign_b = coefs_b[m]
+                groups.setdefault(k, {}).setdefault(l, []).append((val*coefs_a[k][1]*sign_b, name_b))
+            for l in indices:
+                body.append('    c%i_%i = 0.0' % (ind, l))
+                node_coefs[l] = ('c%i_%i' % (ind, l), 1)
+            for k in sorted(groups):
+                name_a = coefs_a[k][0]
+                body.append('    if %s != 0.0:' % name_a)
+                for l, summands in sorted(groups[k].items()):
+                    body.append('        c%i_%i += %s*(%s)' % (ind, l, name_a, _expression_sum(summands)))
+        elif op == 'add':
+            for j in indices:
+                summands = [(sign*coefs[arg][j][1], coefs[arg][j][0])
+                            for arg, sign in zip(args, (1, param)) if j in coefs[arg]]
+                if len(summands) == 1:
+                    node_coefs[j] = (summands[0][1], summands[0][0])
+                else:
+                    body.append('    c%i_%i = %s' % (ind, j, _expression_sum(summands)))
+                    node_coefs[j] = ('c%i_%i' % (ind, j), 1)
+        elif op == 'normal':
+            arg_coefs = coefs[args[0]]
+            k_list, m_list, factors = layout._mag2_table
+            summands = [(int(factor)*arg_coefs[k][1]*arg_coefs[m][1], '%s*%s' % (arg_coefs[k][0], arg_coefs[m][0]))
+                        for k, m, factor in zip(k_list.tolist(), m_list.tolist(), factors.tolist())
+                        if k in arg_coefs and m in arg_coefs]
+            body.append('    s%i = 1.0/np.sqrt(abs(%s))' % (ind, _expression_sum(summands)))
+            for j in indices:
+                name, sign = arg_coefs[j]
+                body.append('    c%i_%i = s%i*%s' % (ind, j, ind, name))
+                node_coefs[j] = ('c%i_%i' % (ind, j), sign)
+        else:
+            for j in indices:
+                name, sign = coefs[args[0]][j]
+                node_coefs[j] = (name, sign*signs[op][j])
+        coefs.append(node_coefs)
+
+    inputs = ', '.join('v%i' % i for i in range(n_inputs))
+    lines = [
+        '"""Generated by clifford.generate_expression_source"""',
+        'import numba',
+        'import numpy as np',
+        '',
+        '',
+        'value_type = numba.types.Array(numba.types.float64, 1, "A", readonly=True)',
+        '',
+        '',
+        '@numba.njit(numba.types.float64[::1](%s), nogil=True, cache=%s)' % (
+            ', '.join(['value_type']*n_inputs), bool(cache)),
+        'def mv_expression(%s):' % inputs,
+    ]
+    lines += body
+    lines.append('    output = np.zeros(%i)' % layout.gaDims)
+    for j, (name, sign) in sorted(coefs[-1].items()):
+        lines.append('    output[%i] = %s%s' % (j, '-' if sign < 0 else '', name))
+    lines.append('    return output')
+    return '\n'.join(lines) + '\n', needed[-1]
+
+
+# Relative size below which a term no longer changes a float64 sum
+_float_eps = np.finfo(np.float64).eps
+
+
+@numba.njit(nogil=True, cache=True)
+def right_mult_matrix_kernel(value, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Returns the matrix A such that A @ X.value == (X * value).value for any
+    X, using the sparse table given by the k_list, l_list, m_list and
+    mult_table_vals arrays
+    """
+    matrix = np.zeros((n_dims, n_dims))
+    for ind, k in enumerate(k_list):
+        v_val = value[m_list[ind]]
+        if v_val != 0.0:
+            matrix[l_list[ind], k] += mult_table_vals[ind] * v_val
+    return matrix
+
+
+@numba.njit(nogil=True, cache=True)
+def left_mult_matrix_kernel(value, k_list, l_list, m_list, mult_table_vals, n_dims):
+    """
+    Returns the matrix A such that A @ X.value == (value * X).value for any
+    X, using the sparse table given by the k_list, l_list, m_list and
+    mult_table_vals arrays
+    """
+    matrix = np.zeros((n_dims, n_dims))
+    for ind, k in enumerate(k_list):
+        v_val = value[k]
+        if v_val != 0.0:
+            matrix[l_list[ind], m_list[ind]] += mult_table_vals[ind] * v_val
+    return matrix
+
+
+@numba.njit(nogil=True, cache=True)
+def inv_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps):
+    """
+    Returns the inverse of value, using the geometric product table given by
+    the k_list, l_list, m_list and mult_table_vals arrays of an algebra of
+    n_vectors dimensions whose blades have the given grades.
+
+    The cheapest applicable method is used:
+
+    * if ~M*M is a scalar, as for versors and blades, the inverse is
+      ~M / (~M*M)
+    * if n_vectors <= 5, the closed forms of Hitzer and Sangwine,
+      "Multivector and multivector matrix inverses in real Clifford
+      algebras" (2017), which only need a few products
+    * otherwise the linear system X*M == 1 is solved
+
+    Raises ValueError if value has no inverse.
+    """
+    n_dims = value.shape[0]
+    scalar_index = 0
+    reverse = np.empty(n_dims)
+    involute = np.empty(n_dims)
+    conjugate = np.empty(n_dims)
+    for ind, g in enumerate(grades):
+        if g == 0:
+            scalar_index = ind
+        reverse[ind] = value[ind] * (1 - 2*((g*(g - 1)//2) % 2))
+        involute[ind] = value[ind] * (1 - 2*(g % 2))
+        conjugate[ind] = value[ind] * (1 - 2*((g*(g + 1)//2) % 2))
+
+    # The tolerances scale with the products they are applied to, so that
+    # scaling value does not change whether it has an inverse
+    scale = np.max(np.abs(value))
+    if scale == 0.0:
+        raise ValueError("multivector has no inverse")
+
+    # Versors and blades
+    norm = dense_mult_kernel(reverse, value, k_list, l_list, m_list, mult_table_vals, n_dims)
+    scalar = norm[scalar_index]
+    if abs(scalar) > eps*scale**2:
+        is_scalar = True
+        for ind, n_val in enumerate(norm):
+            if ind != scalar_index and abs(n_val) > eps*abs(scalar):
+                is_scalar = False
+                break
+        if is_scalar:
+            return reverse / scalar
+
+    if n_vectors <= 5:
+        # The denominator is a product of degree copies of value
+        degree = 4
+        if n_vectors <= 2:
+            degree = 2
+            numerator = conjugate
+        elif n_vectors == 3:
+            numerator = dense_mult_kernel(
+                dense_mult_kernel(conjugate, involute, k_list, l_list, m_list, mult_table_vals, n_dims),
+                reverse, k_list, l_list, m_list, mult_table_vals, n_dims)
+        elif n_vectors == 4:
+            # conj(M) m34(M conj(M)), where m34 negates grades 3 and 4
+            product = dense_mult_kernel(value, conjugate, k_list, l_list, m_list, mult_table_vals, n_dims)
+            for ind, g in enumerate(grades):
+                if g == 3 or g == 4:
+                    product[ind] = -product[ind]
+            numerator = dense_mult_kernel(conjugate, product, k_list, l_list, m_list, mult_table_vals, n_dims)
+        else:
+            # T m14(M T) with T = conj(M) inv(M) rev(M), where m14 negates
+            # grades 1 and 4
+            degree = 8
+            t = dense_mult_kernel(
+                dense_mult_kernel(conjugate, involute, k_list, l_list, m_list, mult_table_vals, n_dims),
+                reverse, k_list, l_list, m_list, mult_table_vals, n_dims)
+            product = dense_mult_kernel(value, t, k_list, l_list, m_list, mult_table_vals, n_dims)
+            for ind, g in enumerate(grades):
+                if g == 1 or g == 4:
+                    product[ind] = -product[ind]
+            numerator = dense_mult_kernel(t, product, k_list, l_list, m_list, mult_table_vals, n_dims)
+        denominator = dense_mult_kernel(value, numerator, k_list, l_list, m_list,
+                                        mult_table_vals, n_dims)[scalar_index]
+        if abs(denominator) <= eps*scale**degree:
+            raise ValueError("multivector has no inverse")
+        return numerator / denominator
+
+    matrix = right_mult_matrix_kernel(value, k_list, l_list, m_list, mult_table_vals, n_dims)
+    identity = np.zeros(n_dims)
+    identity[scalar_index] = 1.0
+    try:
+        inverse = np.linalg.solve(matrix, identity)
+    except Exception:
+        raise ValueError("multivector has no inverse")
+    # The determinant shrinks with the dimension even for well conditioned
+    # matrices, so the condition number is bounded from below instead, by
+    # |matrix| |inverse| for the 1-norm
+    matrix_norm = np.max(np.sum(np.abs(matrix), axis=0))
+    if not matrix_norm * np.sum(np.abs(inverse)) * eps < 1.0:
+        raise ValueError("multivector has no inverse")
+    return inverse
+
+
+@numba.njit(nogil=True, cache=True)
+def batch_inv_kernel(values, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps):
+    """
+    Returns the inverses of the rows of values, computed as in inv_kernel
+    """
+    output = np.empty((values.shape[0], values.shape[1]))
+    for row, value in enumerate(values):
+        output[row] = inv_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps)
+    return output
+
+
+def bind_inv_kernel(sparse_mult, gradeList, n_vectors):
+    '''
+    Returns a function that inverts a multivector value, or every multivector
+    of an array of values of shape (..., n_dims), by passing the arrays of
+    the geometric product table sparse_mult to inv_kernel or
+    batch_inv_kernel
+    '''
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+    grades = np.asarray(gradeList, dtype=np.int64)
+
+    def mv_inv(value):
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 1:
+            return inv_kernel(value, k_list, l_list, m_list, mult_table_vals,
+                              grades, n_vectors, _eps)
+        output = batch_inv_kernel(value.reshape(-1, value.shape[-1]), k_list, l_list, m_list,
+                                  mult_table_vals, grades, n_vectors, _eps)
+        return output.reshape(value.shape)
+
+    return mv_inv
+
+
+@numba.njit(nogil=True, cache=True)
+def exp_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, eps):
+    """
+    Returns the exponential of value, using the geometric product table given
+    by the k_list, l_list, m_list and mult_table_vals arrays of an algebra
+    whose blades have the given grades.
+
+    The scalar part is exponentiated separately. If the rest, B, squares to
+    a scalar, as simple bivectors do, the result has the closed form
+    cos + sin, cosh + sinh or 1 + B. Otherwise B is scaled down by a power
+    of two, exponentiated by its Taylor series and squared back up.
+    """
+    n_dims = value.shape[0]
+    scalar_index = 0
+    for ind, g in enumerate(grades):
+        if g == 0:
+            scalar_index = ind
+    scale = np.exp(value[scalar_index])
+    blade = value.copy()
+    blade[scalar_index] = 0.0
+
+    # The 1-norm bounds the 1-norm of products, |AB| <= |A||B|
+    norm = np.sum(np.abs(blade))
+    output = np.zeros(n_dims)
+    output[scalar_index] = 1.0
+    if norm == 0.0:
+        return scale * output
+
+    square = dense_mult_kernel(blade, blade, k_list, l_list, m_list, mult_table_vals, n_dims)
+    s = square[scalar_index]
+    is_scalar = True
+    for ind, s_val in enumerate(square):
+        if ind != scalar_index and abs(s_val) > eps*norm*norm:
+            is_scalar = False
+            break
+    if is_scalar:
+        if abs(s) <= eps*norm*norm:
+            output += blade
+        elif s < 0.0:
+            theta = np.sqrt(-s)
+            output[scalar_index] = np.cos(theta)
+            output += (np.sin(theta) / theta) * blade
+        else:
+            theta = np.sqrt(s)
+            output[scalar_index] = np.cosh(theta)
+            output += (np.sinh(theta) / theta) * blade
+        return scale * output
+
+    # Scaling and squaring, so that the terms of the series fall quickly
+    n_squarings = 0
+    while norm > 0.5:
+        norm /= 2.0
+        n_squarings += 1
+    blade = blade / 2.0**n_squarings
+    term = output.copy()
+    n = 1
+    while n < 30:
+        term = dense_mult_kernel(term, blade, k_list, l_list, m_list, mult_table_vals, n_dims) / n
+        output += term
+        if np.max(np.abs(term)) <= _float_eps * np.max(np.abs(output)):
+            break
+        n += 1
+    while n_squarings > 0:
+        output = dense_mult_kernel(output, output, k_list, l_list, m_list, mult_table_vals, n_dims)
+        n_squarings -= 1
+    return scale * output
+
+
+@numba.njit(nogil=True, cache=True)
+def batch_exp_kernel(values, k_list, l_list, m_list, mult_table_vals, grades, eps):
+    """
+    Returns the exponentials of the rows of values, computed as in exp_kernel
+    """
+    output = np.empty((values.shape[0], values.shape[1]))
+    for row, value in enumerate(values):
+        output[row] = exp_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, eps)
+    return output
+
+
+@numba.njit(nogil=True, cache=True)
+def _is_scalar_value(value, scalar_index, tolerance):
+    """ Returns whether every coefficient of value but the scalar one is within tolerance of 0 """
+    for ind, v_val in enumerate(value):
+        if ind != scalar_index and abs(v_val) > tolerance:
+            return False
+    return True
+
+
+@numba.njit(nogil=True, cache=True)
+def sqrt_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps):
+    """
+    Returns the principal square root of value, using the geometric product
+    table given by the k_list, l_list, m_list and mult_table_vals arrays of
+    an algebra of n_vectors dimensions whose blades have the given grades.
+
+    If M ~M is a positive scalar rho**2, as for scaled rotors, the root of
+    the rotor R = M / rho is (1 + R) S**-1/2 with S = 2 + R + ~R. S only has
+    grades 0 mod 4, and when its non-scalar part Q squares to a scalar q,
+    as it does in up to 5 dimensions, S**-1/2 has a closed form in
+    sqrt(q). Otherwise the Denman-Beavers iteration is used, which needs
+    two inverses per step.
+
+    Raises ValueError if no real square root is found.
+    """
+    n_dims = value.shape[0]
+    scalar_index = 0
+    reverse = np.empty(n_dims)
+    for ind, g in enumerate(grades):
+        if g == 0:
+            scalar_index = ind
+        reverse[ind] = value[ind] * (1 - 2*((g*(g - 1)//2) % 2))
+    norm = np.sum(np.abs(value))
+
+    rho2_value = dense_mult_kernel(value, reverse, k_list, l_list, m_list, mult_table_vals, n_dims)
+    rho2 = rho2_value[scalar_index]
+    if rho2 > eps*norm*norm and _is_scalar_value(rho2_value, scalar_index, eps*norm*norm):
+        rho = np.sqrt(rho2)
+        s = (value + reverse) / rho
+        s[scalar_index] += 2.0
+        a = s[scalar_index]
+        q_norm = np.sum(np.abs(s)) - abs(a)
+        s[scalar_index] = 0.0
+        q_square = dense_mult_kernel(s, s, k_list, l_list, m_list, mult_table_vals, n_dims)
+        if _is_scalar_value(q_square, scalar_index, eps*(q_norm*q_norm + eps)):
+            # f(a + Q) = (f(a + r) + f(a - r))/2 + Q (f(a + r) - f(a - r))/2r
+            # for f(x) = x**-1/2 and r = sqrt(Q**2)
+            r = np.sqrt(complex(q_square[scalar_index]))
+            if abs(r) <= eps*abs(a):
+                if a <= 0.0:
+                    raise ValueError("multivector has no real square root")
+                alpha = a**-0.5
+                beta = -0.5 * a**-1.5
+            else:
+                f_plus = (a + r)**-0.5
+                f_minus = (a - r)**-0.5
+                alpha = ((f_plus + f_minus) / 2).real
+                beta = ((f_plus - f_minus) / (2*r)).real
+            inv_sqrt_s = beta * s
+            inv_sqrt_s[scalar_index] = alpha
+            one_plus = value / rho
+            one_plus[scalar_index] += 1.0
+            return np.sqrt(rho) * dense_mult_kernel(one_plus, inv_sqrt_s, k_list, l_list, m_list,
+                                                    mult_table_vals, n_dims)
+
+    y = value.copy()
+    z = np.zeros(n_dims)
+    z[scalar_index] = 1.0
+    n = 0
+    while n < 100:
+        y_inv = inv_kernel(y, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps)
+        z_inv = inv_kernel(z, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps)
+        y_next = (y + z_inv) / 2
+        z = (z + y_inv) / 2
+        change = np.sum(np.abs(y_next - y))
+        y = y_next
+        # The iteration converges quadratically, so the error in y is
+        # about the square of the last change
+        if change <= np.sqrt(_float_eps)*np.sum(np.abs(y)):
+            return y
+        n += 1
+    raise ValueError("multivector has no real square root")
+
+
+@numba.njit(nogil=True, cache=True)
+def log_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps):
+    """
+    Returns the principal logarithm of value, using the geometric product
+    table given by the k_list, l_list, m_list and mult_table_vals arrays of
+    an algebra of n_vectors dimensions whose blades have the given grades.
+
+    If value is c + B where B squares to a scalar, as for simple rotors,
+    translators and boosts, the logarithm has a closed form. Otherwise, as
+    for general rotors and motors, square roots are taken with sqrt_kernel
+    until value is close to 1, the series of log(1 + X) is summed, and the
+    result is scaled back up.
+
+    Raises ValueError if value has no real logarithm.
+    """
+    n_dims = value.shape[0]
+    scalar_index = 0
+    for ind, g in enumerate(grades):
+        if g == 0:
+            scalar_index = ind
+    c = value[scalar_index]
+    blade = value.copy()
+    blade[scalar_index] = 0.0
+    norm = np.sum(np.abs(blade))
+    output = np.zeros(n_dims)
+
+    square = dense_mult_kernel(blade, blade, k_list, l_list, m_list, mult_table_vals, n_dims)
+    tolerance = eps*norm*norm
+    if _is_scalar_value(square, scalar_index, tolerance):
+        s = square[scalar_index]
+        if s < -tolerance:
+            r = np.sqrt(-s)
+            output += (np.arctan2(r, c) / r) * blade
+            output[scalar_index] = 0.5*np.log(c*c + r*r)
+            return output
+        if s > tolerance:
+            r = np.sqrt(s)
+            if c <= r:
+                raise ValueError("multivector has no real logarithm")
+            output += (np.arctanh(r / c) / r) * blade
+            output[scalar_index] = 0.5*np.log(c*c - r*r)
+            return output
+        if c <= 0.0:
+            raise ValueError("multivector has no real logarithm")
+        output += blade / c
+        output[scalar_index] = np.log(c)
+        return output
+
+    # Inverse scaling and squaring
+    x = value.copy()
+    n_roots = 0
+    while True:
+        x[scalar_index] -= 1.0
+        distance = np.sum(np.abs(x))
+        x[scalar_index] += 1.0
+        if distance <= 0.25:
+            break
+        if n_roots >= 64:
+            raise ValueError("multivector has no real logarithm")
+        x = sqrt_kernel(x, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps)
+        n_roots += 1
+
+    # log(1 + X) = X - X**2/2 + X**3/3 - ...
+    x[scalar_index] -= 1.0
+    power = x.copy()
+    output += x
+    n = 2
+    while n < 100:
+        power = dense_mult_kernel(power, x, k_list, l_list, m_list, mult_table_vals, n_dims)
+        term = ((-1.0)**(n + 1) / n) * power
+        output += term
+        if np.max(np.abs(term)) <= _float_eps * np.max(np.abs(output)):
+            break
+        n += 1
+    return 2.0**n_roots * output
+
+
+@numba.njit(nogil=True, cache=True)
+def batch_log_kernel(values, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps):
+    """
+    Returns the logarithms of the rows of values, computed as in log_kernel
+    """
+    output = np.empty((values.shape[0], values.shape[1]))
+    for row, value in enumerate(values):
+        output[row] = log_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, n_vectors, eps)
+    return output
+
+
+def bind_log_kernel(sparse_mult, gradeList, n_vectors):
+    '''
+    Returns a function that takes the logarithm of a multivector value, or of
+    every multivector of an array of values of shape (..., n_dims), by passing
+    the arrays of the geometric product table sparse_mult to log_kernel or
+    batch_log_kernel
+    '''
+    grades = np.asarray(gradeList, dtype=np.int64)
+    odd = grades % 2 == 1
+    table = (sparse_mult.k_list, sparse_mult.l_list, sparse_mult.m_list, sparse_mult.mult_table_vals)
+    # Rotors and motors stay in the even subalgebra, whose table is a
+    # quarter of the size. Beyond 5 dimensions the inverses taken by
+    # sqrt_kernel may need the whole table.
+    even_table = table
+    if n_vectors <= 5:
+        even_sparse_mult = sparse_mult.filter(~odd[sparse_mult.k_list] & ~odd[sparse_mult.m_list])
+        even_table = (even_sparse_mult.k_list, even_sparse_mult.l_list,
+                      even_sparse_mult.m_list, even_sparse_mult.mult_table_vals)
+
+    def mv_log(value):
+        value = np.asarray(value, dtype=np.float64)
+        k_list, l_list, m_list, mult_table_vals = table if value[..., odd].any() else even_table
+        if value.ndim == 1:
+            return log_kernel(value, k_list, l_list, m_list, mult_table_vals,
+                              grades, n_vectors, _eps)
+        output = batch_log_kernel(value.reshape(-1, value.shape[-1]), k_list, l_list, m_list,
+                                  mult_table_vals, grades, n_vectors, _eps)
+        return output.reshape(value.shape)
+
+    return mv_log
+
+
+def bind_exp_kernel(sparse_mult, gradeList):
+    '''
+    Returns a function that exponentiates a multivector value, or every
+    multivector of an array of values of shape (..., n_dims), by passing the
+    arrays of the geometric product table sparse_mult to exp_kernel or
+    batch_exp_kernel
+    '''
+    k_list = sparse_mult.k_list
+    l_list = sparse_mult.l_list
+    m_list = sparse_mult.m_list
+    mult_table_vals = sparse_mult.mult_table_vals
+    grades = np.asarray(gradeList, dtype=np.int64)
+
+    def mv_exp(value):
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 1:
+            return exp_kernel(value, k_list, l_list, m_list, mult_table_vals, grades, _eps)
+        output = batch_exp_kernel(value.reshape(-1, value.shape[-1]), k_list, l_list, m_list,
+                                  mult_table_vals, grades, _eps)
+        return output.reshape(value.shape)
+
+    return mv_exp
+
 
 @numba.jit
 def grade_obj_func(objin_val, gradeList, threshold):
@@ -163,11 +1352,38 @@ def grade_obj_func(objin_val, gradeList, threshold):
     return np.argmax(modal_value_count)
 
 
+@numba.njit(nogil=True, cache=True)
+def grade_bitmask(value, gradeList, threshold=0.0):
+    """
+    Returns a bitmask with bit g set if value has a coefficient of grade g
+    whose magnitude is larger than threshold
+    """
+    mask = 0
+    n = 0
+    while n < value.shape[0]:
+        if abs(value[n]) > threshold:
+            mask |= 1 << gradeList[n]
+        n += 1
+    return mask
+
+
+@numba.njit(nogil=True, cache=True)
+def batch_grade_bitmask(values, gradeList, threshold=0.0):
+    """
+    Returns a bitmask with bit g set if any row of values has a coefficient
+    of grade g whose magnitude is larger than threshold
+    """
+    mask = 0
+    for value in values:
+        mask |= grade_bitmask(value, gradeList, threshold)
+    return mask
+
+
 def grade_obj(objin, threshold=0.0000001):
     '''
     Returns the modal grade of a multivector
     '''
-    return grade_obj_func(objin.value, objin.layout.gradeList, threshold)
+    return grade_obj_func(objin.value, objin.layout._grade_array, threshold)
 
 
 def generate_blade_tup_map(bladeTupList):
@@ -181,19 +1397,17 @@ def generate_blade_tup_map(bladeTupList):
     return blade_map
 
 
-@numba.njit
+@numba.njit(cache=True)
 def count_set_bits(bitmap):
     """
     Counts the number of bits set to 1 in bitmap
     """
     bmp = bitmap
     count = 0
-    n = 1
     while bmp > 0:
-        if bmp & 1:
-            count += 1
-        bmp = bmp >> 1
-        n = n + 1
+        # Clears the lowest set bit
+        bmp &= bmp - 1
+        count += 1
     return count
 
 
@@ -203,11 +1417,13 @@ def canonical_reordering_sign_euclidean(bitmap_a, bitmap_b):
     Computes the sign for the product of bitmap_a and bitmap_b
     assuming a euclidean metric
     """
-    a = bitmap_a >> 1
+    # Each basis vector of b swaps with those of a that come after it
+    b = bitmap_b
     sum_value = 0
-    while a != 0:
-        sum_value = sum_value + count_set_bits(a & bitmap_b)
-        a = a >> 1
+    while b != 0:
+        lowest = b & -b
+        sum_value = sum_value + count_set_bits(bitmap_a & ~(2*lowest - 1))
+        b = b ^ lowest
     if (sum_value & 1) == 0:
         return 1
     else:
@@ -231,6 +1447,165 @@ def canonical_reordering_sign(bitmap_a, bitmap_b, metric):
     return output_sign
 
 
+@numba.njit(cache=True)
+def construct_tables(gradeList, linear_map_to_bitmap, bitmap_to_linear_map, signature):
+    """
+    Generates the geometric product table for all pairs of blades in a
+    single pass, using the bitmap representation of the blades described in
+    chapter 19 of Leo Dorst's book, Geometric Algebra For Computer Science.
+
+    The result blade of e_i e_j is bitmap_i ^ bitmap_j, the reordering sign
+    is the parity of the number of swaps required to bring the product into
+    canonical order and the metric sign is the product of the signature over
+    bitmap_i & bitmap_j.
+
+    Returns the (gaDims, gaDims) array of output indices and the
+    corresponding (gaDims, gaDims) array of signs.
+    """
+    n_dims = gradeList.shape[0]
+
+    # Bitmap of the basis vectors that square to -1
+    negative_bitmap = 0
+    for i, s in enumerate(signature):
+        if s < 0:
+            negative_bitmap = negative_bitmap | (1 << i)
+
+    output_indices = np.zeros((n_dims, n_dims), dtype=np.int64)
+    signs = np.zeros((n_dims, n_dims), dtype=np.int8)
+
+    for i, bitmap_a in enumerate(linear_map_to_bitmap):
+        for j, bitmap_b in enumerate(linear_map_to_bitmap):
+            # Reordering sign from the number of set bits in a
+            # that have to pass over the set bits of b
+            swaps = 0
+            a = bitmap_a >> 1
+            while a != 0:
+                swaps += count_set_bits(a & bitmap_b)
+                a = a >> 1
+            # Metric sign from the common basis vectors that square to -1
+            swaps += count_set_bits(bitmap_a & bitmap_b & negative_bitmap)
+
+            output_indices[i, j] = bitmap_to_linear_map[bitmap_a ^ bitmap_b]
+            if (swaps & 1) == 0:
+                signs[i, j] = 1
+            else:
+                signs[i, j] = -1
+
+    return output_indices, signs
+
+
+# Codes of the products evaluated by bitmap_mult_kernel
+_bitmap_products = {'gmt': 0, 'omt': 1, 'imt': 2, 'lcmt': 3}
+
+
+@numba.njit(nogil=True, cache=True)
+def bitmap_merge_kernel(bitmaps, coefs):
+    """
+    Sorts the terms given by the arrays bitmaps and coefs by bitmap, adding
+    up the coefficients of equal bitmaps.
+
+    Sums that are 0 up to the rounding error of the additions are dropped,
+    since keeping the residue of cancelling terms, as in R*X*~R, would
+    make the results of sparse multivectors dense.
+    """
+    # Gather the terms of each blade through a hash table, then sort the
+    # blades, which are usually far fewer than the terms
+    index = numba.typed.Dict.empty(numba.types.int64, numba.types.int64)
+    out_bitmaps = np.empty(bitmaps.shape[0], dtype=np.int64)
+    out_coefs = np.empty(bitmaps.shape[0])
+    scales = np.empty(bitmaps.shape[0])
+    n_blades = 0
+    for ind, bitmap in enumerate(bitmaps):
+        if bitmap in index:
+            j = index[bitmap]
+            out_coefs[j] += coefs[ind]
+            scales[j] += abs(coefs[ind])
+        else:
+            index[bitmap] = n_blades
+            out_bitmaps[n_blades] = bitmap
+            out_coefs[n_blades] = coefs[ind]
+            scales[n_blades] = abs(coefs[ind])
+            n_blades += 1
+    order = np.argsort(out_bitmaps[:n_blades])
+    bitmaps_kept = np.empty(n_blades, dtype=np.int64)
+    coefs_kept = np.empty(n_blades)
+    n = 0
+    for j in order:
+        if abs(out_coefs[j]) > 4*_float_eps*scales[j]:
+            bitmaps_kept[n] = out_bitmaps[j]
+            coefs_kept[n] = out_coefs[j]
+            n += 1
+    return bitmaps_kept[:n], coefs_kept[:n]
+
+
+@numba.njit(nogil=True, cache=True)
+def bitmap_mult_kernel(bitmaps_a, coefs_a, bitmaps_b, coefs_b, metric, product, eps):
+    """
+    Multiplies the multivector with the terms coefs_a of the blades
+    bitmaps_a by the one with the terms coefs_b of the blades bitmaps_b,
+    without a multiplication table. The sign of each term comes from
+    canonical_reordering_sign with the squares of the basis vectors in
+    metric.
+
+    product is 0 for the geometric product, 1 for the outer product, 2
+    for the inner product and 3 for the left contraction, which keep the
+    terms of the geometric product with the grades given in
+    get_product_mask.
+
+    Returns the bitmaps and coefficients of the result as from
+    bitmap_merge_kernel, without the terms smaller than eps times the
+    largest a coefficient could be, the product of the 1-norms of the
+    operands. Those are left by cancellations of terms whose rounding
+    errors come from earlier products, which the merge cannot detect.
+    """
+    n_terms = bitmaps_a.shape[0] * bitmaps_b.shape[0]
+    bitmaps = np.empty(n_terms, dtype=np.int64)
+    coefs = np.empty(n_terms)
+    n = 0
+    for i, bitmap_a in enumerate(bitmaps_a):
+        grade_a = count_set_bits(bitmap_a)
+        for j, bitmap_b in enumerate(bitmaps_b):
+            bitmap = bitmap_a ^ bitmap_b
+            if product != 0:
+                grade_b = count_set_bits(bitmap_b)
+                grade = count_set_bits(bitmap)
+                if product == 1:
+                    if grade != grade_a + grade_b:
+                        continue
+                elif product == 2:
+                    if grade_a == 0 or grade_b == 0 or grade != abs(grade_a - grade_b):
+                        continue
+                elif grade != grade_b - grade_a:
+                    continue
+            bitmaps[n] = bitmap
+            coefs[n] = coefs_a[i] * coefs_b[j] * canonical_reordering_sign(bitmap_a, bitmap_b, metric)
+            n += 1
+    bitmaps, coefs = bitmap_merge_kernel(bitmaps[:n], coefs[:n])
+    keep = np.abs(coefs) > eps * np.sum(np.abs(coefs_a)) * np.sum(np.abs(coefs_b))
+    return bitmaps[keep], coefs[keep]
+
+
+def get_product_mask(product, gradeList, sparse_mult):
+    """
+    Returns the boolean mask selecting the entries of the geometric product
+    table sparse_mult that belong to product, one of 'imt', 'omt' or 'lcmt'
+    """
+    grades = np.asarray(gradeList)
+    grade_a = grades[sparse_mult.k_list]
+    grade_v = grades[sparse_mult.l_list]
+    grade_b = grades[sparse_mult.m_list]
+    if product == 'imt':
+        # A_r . B_s = <A_r B_s>_|r-s| if r,s != 0
+        return (grade_v == np.abs(grade_a - grade_b)) & (grade_a != 0) & (grade_b != 0)
+    elif product == 'omt':
+        # A_r ^ B_s = <A_r B_s>_|r+s|
+        return grade_v == (grade_a + grade_b)
+    elif product == 'lcmt':
+        # A_r _| B_s = <A_r B_s>_(s-r) if s-r >= 0
+        return grade_v == (grade_b - grade_a)
+    raise ValueError("unknown product %r" % (product,))
+
+
 def compute_reordering_sign_and_canonical_form(blade, metric, firstIdx):
     """
     Takes a tuple blade representation and converts it to a canonical
@@ -351,8 +1726,9 @@ class Layout(object):
       lcmt -- multiplication table for the left-contraction [1]
 
 
-    [1] The multiplication tables are NumPy arrays of rank 3 with indices like
-        the tensor g_ijk discussed above.
+    [1] The multiplication tables are SparseMultTable objects holding the
+        non-zero entries of the tensor g_ijk as index and sign arrays. They
+        can also be used as dictionaries mapping (i, j, k) tuples to signs.
     """
 
     def __init__(self, sig, bladeTupList, firstIdx=0, names=None):
@@ -389,7 +1765,105 @@ class Layout(object):
 
         self._genTables()
         self.adjoint_func = get_adjoint_function(self.gradeList)
-
+        self._grade_restricted_funcs = {}
+        self._grade_array = np.array(self.gradeList, dtype=np.int64)
+        self._product_kernels = {}
+        self._product_grade_tables = {}
+        self._expression_kernels = {}
+        self._genGradeData()
+
+    def _genGradeData(self):
+        """
+        Precomputes what the grade operations need, so that they do not
+        have to go through gradeList on every call:
+
+          _scalar_index -- index of the scalar blade
+          _grade_slices -- for each grade, the slice of its blades if they
+                           are contiguous, as they are for the blade
+                           orders made by Cl, else an array of their
+                           indices, and None if there are none
+          _reverse_signs, _involute_signs, _conjugate_signs
+                        -- the signs the coefficients are scaled by in
+                           reversion, grade involution and Clifford
+                           conjugation
+        """
+        grades = self._grade_array
+        self._scalar_index = self.gradeList.index(0)
+        self._grade_slices = []
+        for g in range(self.dims + 1):
+            indices = np.flatnonzero(grades == g)
+            if len(indices) == 0:
+                self._grade_slices.append(None)
+            elif indices[-1] - indices[0] + 1 == len(indices):
+                self._grade_slices.append(slice(indices[0], indices[-1] + 1))
+            else:
+                self._grade_slices.append(indices)
+        self._reverse_signs = np.power(-1.0, grades*(grades - 1)//2)
+        self._involute_signs = np.power(-1.0, grades)
+        self._conjugate_signs = np.power(-1.0, grades*(grades + 1)//2)
+        self._projection_masks = {}
+        self._packings = {}
+
+    def _grade_slice(self, grade):
+        """ Returns the slice or indices of the blades of grade """
+        if isinstance(grade, int) and 0 <= grade <= self.dims:
+            index = self._grade_slices[grade]
+            if index is not None:
+                return index
+        if grade not in self.gradeList:
+            raise ValueError("algebra does not have grade %s" % grade)
+        raise ValueError("grade must be an integer")
+
+    def _grades_bitmask(self, grades):
+        """ Returns the bitmask of a grade or sequence of grades, checking them """
+        if isinstance(grades, int):
+            grades = (grades,)
+        mask = 0
+        for grade in grades:
+            self._grade_slice(grade)
+            mask |= 1 << grade
+        return mask
+
+    def _projection_mask(self, mask):
+        """ Returns an array of 1.0 for the blades of the grades in the bitmask mask, else 0.0 """
+        try:
+            return self._projection_masks[mask]
+        except KeyError:
+            projection = ((mask >> self._grade_array) & 1).astype(np.float64)
+            self._projection_masks[mask] = projection
+            return projection
+
+    def _grades_of(self, value, threshold):
+        """ Returns the sorted list of grades with coefficients larger than threshold in value """
+        mask = grade_bitmask(value, self._grade_array, threshold)
+        return [g for g in range(self.dims + 1) if mask >> g & 1]
+
+    @classmethod
+    def interned(cls, sig, bladeTupList, firstIdx=0, names=None):
+        """Returns the shared Layout for these arguments, constructing it if
+        it does not exist yet.
+
+        Layouts are kept in a process-wide registry keyed by the normalized
+        signature, the blade list, firstIdx and names, so repeated requests
+        for the same algebra return the same object, with the same tables
+        and kernels. Entries are weak references and disappear once no
+        multivector or user code refers to the layout.
+        """
+        if names is None or isinstance(names, str):
+            names_key = names
+        else:
+            names_key = tuple(names)
+        key = (cls,
+               tuple(int(s) for s in np.sign(sig)),
+               tuple(map(tuple, bladeTupList)),
+               firstIdx,
+               names_key)
+        layout = _layout_registry.get(key)
+        if layout is None:
+            layout = _layout_registry.setdefault(
+                key, cls(sig, bladeTupList, firstIdx=firstIdx, names=names))
+        return layout
+
     def dict_to_multivector(self, dict_in):
         """ Takes a dictionary of coefficient values and converts it into a MultiVector object """
         constructed_values = np.zeros(self.gaDims)
@@ -453,9 +1927,8 @@ class Layout(object):
         "Ensure validity of arguments."
 
         # check for uniqueness
-        for blade in self.bladeTupList:
-            if self.bladeTupList.count(blade) != 1:
-                raise ValueError("blades not unique")
+        if len(set(self.bladeTupList)) != len(self.bladeTupList):
+            raise ValueError("blades not unique")
 
         # check for right dimensionality
         if len(self.bladeTupList) != 2**self.dims:
@@ -487,60 +1960,516 @@ class Layout(object):
         return idx, output_sign
 
     def _genTables(self):
-        "Generate the multiplication tables."
+        "Generate the blade maps; the tables themselves are built on demand."
 
         self.bladeTupMap = generate_blade_tup_map(self.bladeTupList)
 
-        # sparse geometric multiplication table
-        gmt_nzs = {}
-        imt_nzs = {}
-        omt_nzs = {}
-        lcmt_nzs = {}
+        # Map between the linear index of each blade and its bitmap
+        self.linear_map_to_bitmap = np.array(
+            [compute_bitmap_representation(blade, self.firstIdx) for blade in self.bladeTupList],
+            dtype=np.int64)
+        self.bitmap_to_linear_map = np.zeros(self.gaDims, dtype=np.int64)
+        self.bitmap_to_linear_map[self.linear_map_to_bitmap] = np.arange(self.gaDims)
+
+    @_cached_property
+    def _cache_key(self):
+        """ Key of the on-disk cache entry of this layout, or None """
+        if self.dims < caching.MIN_CACHED_DIMS:
+            # Small layouts are cheaper to build than to read
+            return None
+        return caching.layout_key(self.sig, self.bladeTupList, self.firstIdx)
+
+    def _get_table(self, name):
+        """
+        Returns the SparseMultTable of the product called name, reading it
+        from the on-disk cache or constructing it
+        """
+        if self._cache_key is not None:
+            arrays = caching.read_table(self._cache_key, name)
+            if arrays is not None:
+                return SparseMultTable(gaDims=self.gaDims, **arrays)
+
+        if name == 'gmt':
+            # Evaluate every pair of blades at once
+            output_indices, signs = construct_tables(
+                np.array(self.gradeList, dtype=np.int64),
+                self.linear_map_to_bitmap,
+                self.bitmap_to_linear_map,
+                np.array(self.sig, dtype=np.int64))
+            i_list, j_list = np.indices((self.gaDims, self.gaDims))
+            table = SparseMultTable(i_list.ravel(), output_indices.ravel(), j_list.ravel(),
+                                    signs.ravel(), self.gaDims)
+        else:
+            # The other products are grade selections of the geometric product
+            table = self.gmt.filter(get_product_mask(name, self.gradeList, self.gmt))
+
+        if self._cache_key is not None:
+            caching.write_table(self._cache_key, name, table)
+        return table
+
+    # The sparse multiplication tables, built on first access
+
+    @_cached_property
+    def gmt(self):
+        """ Multiplication table of the geometric product """
+        return self._get_table('gmt')
+
+    @_cached_property
+    def imt(self):
+        """ Multiplication table of the inner product """
+        return self._get_table('imt')
+
+    @_cached_property
+    def omt(self):
+        """ Multiplication table of the outer product """
+        return self._get_table('omt')
+
+    @_cached_property
+    def lcmt(self):
+        """ Multiplication table of the left-contraction """
+        return self._get_table('lcmt')
+
+    # The functions that perform the various products, built on first access
+
+    def _get_mult_function(self, name):
+        """
+        Returns the jitted function of the product called name, unrolled for
+        small algebras
+        """
+        table = getattr(self, name)
+        if self.gaDims <= MAX_UNROLLED_GADIMS:
+            return get_unrolled_mult_function(table, self.gaDims)
+        return get_mult_function(table, self.gaDims, self.gradeList)
+
+    @_cached_property
+    def gmt_func(self):
+        return self._get_mult_function('gmt')
+
+    @_cached_property
+    def imt_func(self):
+        return self._get_mult_function('imt')
+
+    @_cached_property
+    def omt_func(self):
+        return self._get_mult_function('omt')
+
+    @_cached_property
+    def lcmt_func(self):
+        return self._get_mult_function('lcmt')
+
+    def get_grade_restricted_func(self, product, grades_a=None, grades_b=None, grades_out=None):
+        """
+        Returns a jitted function evaluating product, one of 'gmt', 'imt',
+        'omt' or 'lcmt', for a first operand with grades in grades_a and a
+        second operand with grades in grades_b. Only the outputs with grades
+        in grades_out are computed. None allows any grade.
+
+        The functions are memoized on the layout, so asking again for the
+        same restriction returns the same function.
+        """
+        if product not in ('gmt', 'imt', 'omt', 'lcmt'):
+            raise ValueError("unknown product %r" % (product,))
+
+        def normalise(grades):
+            if grades is None:
+                return None
+            return tuple(sorted(set(int(g) for g in grades)))
+        key = (product, normalise(grades_a), normalise(grades_b), normalise(grades_out))
+
+        func = self._grade_restricted_funcs.get(key)
+        if func is None:
+            table = getattr(self, product)
+            filter_mask = grade_filter_mask(table, self.gradeList, *key[1:])
+            if self.gaDims <= MAX_UNROLLED_GADIMS:
+                func = get_unrolled_mult_function(table, self.gaDims, filter_mask=filter_mask)
+            else:
+                func = get_mult_function(table, self.gaDims, self.gradeList, filter_mask=filter_mask)
+            func = self._grade_restricted_funcs.setdefault(key, func)
+        return func
+
+    @_cached_property
+    def bitmap_layout(self):
+        """
+        The BitmapLayout of the same algebra, whose multivectors store their
+        non-zero terms and are multiplied without tables
+        """
+        return BitmapLayout(self.sig, self.firstIdx)
+
+    def packing(self, grades):
+        """
+        Returns the GradePacking storing the coefficients of a grade or
+        sequence of grades, see PackedMV
+        """
+        return self._packing_of_mask(self._grades_bitmask(grades))
+
+    def _packing_of_mask(self, mask):
+        """ Returns the GradePacking of the grades in the bitmask mask """
+        try:
+            return self._packings[mask]
+        except KeyError:
+            return self._packings.setdefault(mask, GradePacking(self, mask))
+
+    def _grade_mask(self, value):
+        """ Bitmask of the grades of the non-zero coefficients of value """
+        return grade_bitmask(value, self._grade_array)
+
+    def _get_product_kernel(self, product, mask_a, mask_b):
+        """
+        Returns the kernel the MultiVector operators use to evaluate product
+        for operands containing only the grades in the bitmasks mask_a and
+        mask_b, and the bitmask of the grades the result can contain.
+
+        A grade-restricted kernel is only used when it skips at least half of
+        the table, otherwise the general one is reused rather than compiled
+        again for little gain.
+        """
+        key = (product, mask_a, mask_b)
+        try:
+            return self._product_kernels[key]
+        except KeyError:
+            pass
+
+        table = getattr(self, product)
+        grades_a = [g for g in range(self.dims + 1) if mask_a >> g & 1]
+        grades_b = [g for g in range(self.dims + 1) if mask_b >> g & 1]
+        filter_mask = grade_filter_mask(table, self.gradeList, grades_a, grades_b)
+        mask_out = 0
+        for g in np.unique(self._grade_array[table.l_list[filter_mask]]).tolist():
+            mask_out |= 1 << g
+
+        if 2*np.count_nonzero(filter_mask) > len(table):
+            kernel = getattr(self, '_%s_kernel' % product)
+        elif self.gaDims <= MAX_UNROLLED_GADIMS:
+            kernel = self.get_grade_restricted_func(product, grades_a, grades_b)
+        else:
+            kernel = bind_mult_kernel(table.filter(filter_mask), self.gaDims, sparse_mult_kernel)
+        return self._product_kernels.setdefault(key, (kernel, mask_out))
+
+    def _product_grade_pairs(self, product):
+        """
+        Returns the array whose entry [r, s] is the bitmask of the grades of
+        product of a grade r and a grade s multivector
+        """
+        try:
+            return self._product_grade_tables[product]
+        except KeyError:
+            pass
+        table = self._product_table(product)
+        grades = self._grade_array
+        pairs = np.zeros((self.dims + 1, self.dims + 1), dtype=np.int64)
+        np.bitwise_or.at(pairs, (grades[table.k_list], grades[table.m_list]),
+                         np.left_shift(1, grades[table.l_list]))
+        return self._product_grade_tables.setdefault(product, pairs)
+
+    def _product_grades(self, product, mask_a, mask_b):
+        """
+        Bitmask of the grades product can give for operands with the grades
+        in the bitmasks mask_a and mask_b
+        """
+        pairs = self._product_grade_pairs(product)
+        grades_a = [g for g in range(self.dims + 1) if mask_a >> g & 1]
+        grades_b = [g for g in range(self.dims + 1) if mask_b >> g & 1]
+        mask = 0
+        for grade_a in grades_a:
+            for grade_b in grades_b:
+                mask |= int(pairs[grade_a, grade_b])
+        return mask
+
+    def _get_expression_kernel(self, nodes, input_grades):
+        """
+        Returns the kernel evaluating the expression given by nodes for
+        inputs with the grades in the bitmasks input_grades, from
+        generate_expression_source, and the bitmask of the grades of its
+        result
+        """
+        key = (nodes, input_grades)
+        try:
+            return self._expression_kernels[key]
+        except KeyError:
+            pass
+        source, grades = generate_expression_source(self, nodes, input_grades)
+        module = caching.load_generated_module(source)
+        if module is None:
+            module = {}
+            exec(generate_expression_source(self, nodes, input_grades, cache=False)[0], module)
+            kernel = module['mv_expression']
+        else:
+            kernel = module.mv_expression
+        return self._expression_kernels.setdefault(key, (kernel, grades))
+
+    # The products used by the MultiVector operators. Small algebras use the
+    # unrolled functions, which are cached on disk, larger ones the
+    # precompiled generic kernel so that nothing is compiled per layout
+
+    def _get_mult_kernel(self, name):
+        if self.gaDims <= MAX_UNROLLED_GADIMS:
+            return getattr(self, name + '_func')
+        return bind_mult_kernel(getattr(self, name), self.gaDims)
 
-        for i in range(self.gaDims):
-            grade_list_i = self.gradeList[i]
-            blade_tup_list_i = list(self.bladeTupList[i])
-            for j in range(self.gaDims):
-                grade_list_j = self.gradeList[j]
+    @_cached_property
+    def _gmt_kernel(self):
+        return self._get_mult_kernel('gmt')
 
-                v, mul = self._gmtElement(
-                        blade_tup_list_i, list(self.bladeTupList[j]))
+    @_cached_property
+    def _imt_kernel(self):
+        return self._get_mult_kernel('imt')
 
-                gmt_nzs[tuple([i,v,j])] = mul
+    @_cached_property
+    def _omt_kernel(self):
+        return self._get_mult_kernel('omt')
 
-                grade_list_idx = self.gradeList[v]
+    @_cached_property
+    def _lcmt_kernel(self):
+        return self._get_mult_kernel('lcmt')
 
-                if (
-                        grade_list_idx == abs(
-                    grade_list_i - grade_list_j) and
-                        grade_list_i != 0 and grade_list_j != 0):
+    # Generalized ufuncs over arrays of values of shape (..., gaDims), all
+    # bound to the shared precompiled gufuncs
 
-                    # A_r . B_s = <A_r B_s>_|r-s|
-                    # if r,s != 0
-                    imt_nzs[tuple([i,v,j])] = mul
+    @_cached_property
+    def gmt_gufunc(self):
+        return bind_mult_gufunc(self.gmt)
 
-                if grade_list_idx == (
-                        grade_list_i + grade_list_j):
+    @_cached_property
+    def imt_gufunc(self):
+        return bind_mult_gufunc(self.imt)
 
-                    # A_r ^ B_s = <A_r B_s>_|r+s|
-                    omt_nzs[tuple([i,v,j])] = mul
+    @_cached_property
+    def omt_gufunc(self):
+        return bind_mult_gufunc(self.omt)
 
-                if grade_list_idx == (
-                        grade_list_j - grade_list_i):
-                    # A_r _| B_s = <A_r B_s>_(s-r) if s-r >= 0
-                    lcmt_nzs[tuple([i,v,j])] = mul
+    @_cached_property
+    def lcmt_gufunc(self):
+        return bind_mult_gufunc(self.lcmt)
 
-        # This generates the functions that will perform the various products
-        self.gmt_func = get_mult_function(gmt_nzs,self.gaDims,self.gradeList)
-        self.imt_func = get_mult_function(imt_nzs,self.gaDims,self.gradeList)
-        self.omt_func = get_mult_function(omt_nzs,self.gaDims,self.gradeList)
-        self.lcmt_func = get_mult_function(lcmt_nzs,self.gaDims,self.gradeList)
+    @_cached_property
+    def adjoint_gufunc(self):
+        return bind_scale_gufunc(self._reverse_signs)
 
-        # We store the sparse objects in the layout object
-        self.gmt = gmt_nzs
-        self.imt = imt_nzs
-        self.omt = omt_nzs
-        self.lcmt = lcmt_nzs
+    @_cached_property
+    def gradeInvol_gufunc(self):
+        return bind_scale_gufunc(self._involute_signs)
+
+    @_cached_property
+    def conjugate_gufunc(self):
+        return bind_scale_gufunc(self._conjugate_signs)
+
+    @_cached_property
+    def inv_func(self):
+        """
+        Inverts a multivector value, or every multivector of an array of
+        values of shape (..., gaDims). See MultiVector.inv.
+        """
+        return bind_inv_kernel(self.gmt, self.gradeList, self.dims)
+
+    @_cached_property
+    def exp_func(self):
+        """
+        Exponentiates a multivector value, or every multivector of an array
+        of values of shape (..., gaDims). See MultiVector.exp.
+        """
+        return bind_exp_kernel(self.gmt, self.gradeList)
+
+    @_cached_property
+    def log_func(self):
+        """
+        Takes the logarithm of a multivector value, or of every multivector
+        of an array of values of shape (..., gaDims). See MultiVector.log.
+        """
+        return bind_log_kernel(self.gmt, self.gradeList, self.dims)
+
+    def project_gufunc(self, value, grades, out=None):
+        """
+        Projects an array of values of shape (..., gaDims) onto grades,
+        a grade or a sequence of grades
+        """
+        return scale_gufunc(value, self._projection_mask(self._grades_bitmask(grades)), out=out)
+
+    # Multithreaded versions of the batched operations, which split the
+    # multivectors of arrays of shape (..., gaDims) between numba's threads
+
+    @_cached_property
+    def gmt_parallel(self):
+        return bind_parallel_mult_kernel(self.gmt, self.gaDims)
+
+    @_cached_property
+    def imt_parallel(self):
+        return bind_parallel_mult_kernel(self.imt, self.gaDims)
+
+    @_cached_property
+    def omt_parallel(self):
+        return bind_parallel_mult_kernel(self.omt, self.gaDims)
+
+    @_cached_property
+    def lcmt_parallel(self):
+        return bind_parallel_mult_kernel(self.lcmt, self.gaDims)
+
+    # The linear maps of multiplication by a fixed multivector, as matrices
+    # acting on values. Applying one to an array of values of shape
+    # (..., gaDims) is a single matrix product, evaluated by BLAS
+
+    def _product_table(self, product):
+        if product not in ('gmt', 'imt', 'omt', 'lcmt'):
+            raise ValueError("unknown product %r" % (product,))
+        return getattr(self, product)
+
+    def left_mult_matrix(self, value, product='gmt'):
+        """
+        Returns the matrix A such that A @ X.value is the value of
+        product(value, X) for any X, where product is one of 'gmt', 'imt',
+        'omt' or 'lcmt'
+        """
+        table = self._product_table(product)
+        return left_mult_matrix_kernel(
+            np.asarray(value, dtype=np.float64),
+            table.k_list, table.l_list, table.m_list, table.mult_table_vals, self.gaDims)
+
+    def right_mult_matrix(self, value, product='gmt'):
+        """
+        Returns the matrix A such that A @ X.value is the value of
+        product(X, value) for any X, where product is one of 'gmt', 'imt',
+        'omt' or 'lcmt'
+        """
+        table = self._product_table(product)
+        return right_mult_matrix_kernel(
+            np.asarray(value, dtype=np.float64),
+            table.k_list, table.l_list, table.m_list, table.mult_table_vals, self.gaDims)
+
+    def sandwich_matrix(self, value, right_value=None):
+        """
+        Returns the matrix A such that A @ X.value == (V * X * W).value for
+        any X, where V has the coefficients value and W the coefficients
+        right_value, by default those of ~V
+        """
+        value = np.asarray(value, dtype=np.float64)
+        if right_value is None:
+            right_value = value * self._reverse_signs
+        return np.dot(self.left_mult_matrix(value), self.right_mult_matrix(right_value))
+
+    def outermorphism_matrix(self, matrix):
+        """
+        Returns the matrix A such that A @ X.value is the value of f(X) for
+        any X, where f is the outermorphism of the linear map of vectors
+        with f(e_j) = sum_i matrix[i, j] e_i, the basis vectors numbered
+        from 0.
+
+        The map need not be orthogonal. The coefficient of the blade e_I in
+        f(e_J) is the minor of matrix with rows I and columns J, so A is
+        block diagonal by grade.
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.shape != (self.dims, self.dims):
+            raise ValueError("matrix must have shape (%s, %s)" % (self.dims, self.dims))
+        output = np.zeros((self.gaDims, self.gaDims))
+        output[self._scalar_index, self._scalar_index] = 1.0
+        bits = (self.linear_map_to_bitmap[:, np.newaxis] >> np.arange(self.dims)) & 1
+        for grade in range(1, self.dims + 1):
+            blades = np.flatnonzero(self._grade_array == grade)
+            # The basis vectors of each blade, in increasing order
+            vectors = np.nonzero(bits[blades])[1].reshape(len(blades), grade)
+            minors = matrix[vectors[:, np.newaxis, :, np.newaxis], vectors[np.newaxis, :, np.newaxis, :]]
+            output[np.ix_(blades, blades)] = np.linalg.det(minors)
+        return output
+
+    def apply_matrix(self, matrix, value):
+        """
+        Returns matrix @ X.value for every multivector X of the array value
+        of shape (..., gaDims), for a matrix from left_mult_matrix,
+        right_mult_matrix, sandwich_matrix or outermorphism_matrix
+        """
+        value = np.asarray(value, dtype=np.float64)
+        return np.dot(value, matrix.T)
+
+    def apply_rotor_parallel(self, rotor_value, value):
+        """
+        Computes R X ~R for the rotor with coefficients rotor_value and every
+        multivector X of the array value of shape (..., gaDims)
+        """
+        return self.apply_matrix(self.sandwich_matrix(rotor_value), value)
+
+    @_cached_property
+    def _scalar_product_table(self):
+        # The entries of the geometric product table giving the scalar part
+        # of A B, one for each blade of A
+        gmt = self.gmt
+        scalar = gmt.l_list == self._scalar_index
+        return gmt.k_list[scalar], gmt.m_list[scalar], gmt.mult_table_vals[scalar].astype(np.float64)
+
+    @_cached_property
+    def _mag2_table(self):
+        # The entries giving the scalar part of ~X X, with the signs of the
+        # reversion folded in
+        k_list, m_list, factors = self._scalar_product_table
+        return k_list, m_list, factors * self._reverse_signs[k_list]
+
+    def scalar_product_gufunc(self, value, other_value, out=None):
+        """
+        Returns <A B>_0 for the multivectors of the arrays value and
+        other_value of shape (..., gaDims), which broadcast as for any
+        numpy ufunc
+        """
+        return scalar_part_gufunc(value, other_value, *self._scalar_product_table, out=out)
+
+    def mag2_gufunc(self, value, out=None):
+        """
+        Returns <~X X>_0 for every multivector X of the array value of
+        shape (..., gaDims), as MultiVector.mag2 does
+        """
+        return scalar_part_gufunc(value, value, *self._mag2_table, out=out)
+
+    # The commutator and anticommutator products, (A B - B A)/2 and
+    # (A B + B A)/2. A pair of blades either commutes or anticommutes, so
+    # each is the geometric product restricted to the pairs of blades that
+    # anticommute, or that commute
+
+    @_cached_property
+    def _anticommuting_entries(self):
+        # e_A e_B = (-1)**(|A| |B| - |A & B|) e_B e_A
+        gmt = self.gmt
+        common = self.linear_map_to_bitmap[gmt.k_list] & self.linear_map_to_bitmap[gmt.m_list]
+        n_common = np.zeros(len(common), dtype=np.int64)
+        for i in range(self.dims):
+            n_common += (common >> i) & 1
+        grades = self._grade_array
+        return (grades[gmt.k_list]*grades[gmt.m_list] - n_common) % 2 == 1
+
+    @_cached_property
+    def commutator_table(self):
+        return self.gmt.filter(self._anticommuting_entries)
+
+    @_cached_property
+    def anticommutator_table(self):
+        return self.gmt.filter(~self._anticommuting_entries)
+
+    def _get_table_kernel(self, table):
+        if self.gaDims <= MAX_UNROLLED_GADIMS:
+            return get_unrolled_mult_function(table, self.gaDims)
+        return bind_mult_kernel(table, self.gaDims)
+
+    @_cached_property
+    def commutator_func(self):
+        return self._get_table_kernel(self.commutator_table)
+
+    @_cached_property
+    def anticommutator_func(self):
+        return self._get_table_kernel(self.anticommutator_table)
+
+    @_cached_property
+    def commutator_gufunc(self):
+        return bind_mult_gufunc(self.commutator_table)
+
+    @_cached_property
+    def anticommutator_gufunc(self):
+        return bind_mult_gufunc(self.anticommutator_table)
+
+    def normalise_parallel(self, value):
+        """
+        Divides every multivector X of the array value of shape (..., gaDims)
+        by sqrt(abs(<~X X>)), as MultiVector.normal does
+        """
+        value = np.asarray(value, dtype=np.float64)
+        k_list, m_list, factors = self._mag2_table
+        output = parallel_normalise_kernel(value.reshape(-1, self.gaDims), k_list, m_list, factors)
+        return output.reshape(value.shape)
 
     def MultiVector(self,*args,**kw):
         '''
@@ -658,6 +2587,11 @@ class Layout(object):
         return bases(layout=self, *args, **kw)
 
 
+# Scalar types recognised by the operators without the slower check against
+# numbers.Number
+_fast_scalar_types = (float, int, np.float64)
+
+
 class MultiVector(object):
     """An  element of the algebra
 
@@ -683,8 +2617,21 @@ class MultiVector(object):
 
     * M(N) : grade or subspace projection
     * M[N] : blade projection
+
+    The results of the operators remember which grades they can contain,
+    and products of such multivectors use kernels restricted to those
+    grades. The value attribute is therefore a read-only view of the
+    coefficients. Writing to them through mutable_value, assigning value or
+    assigning items forgets the grades, as does forget_grades.
+
+    MultiVector defines __slots__, so its instances cannot be given other
+    attributes. Subclasses that need them get a __dict__ as usual.
     """
 
+    # _value is the array of coefficients, and _grades the bitmask of the
+    # grades it may contain, or None if it is unknown
+    __slots__ = ('layout', '_value', '_grades')
+
     def __init__(self, layout, value=None, string=None):
         """Constructor.
 
@@ -692,19 +2639,47 @@ class MultiVector(object):
         """
 
         self.layout = layout
+        self._grades = None
 
         if value is None:
             if string is None:
-                self.value = np.zeros((self.layout.gaDims,), dtype=float)
+                self._value = np.zeros((self.layout.gaDims,), dtype=float)
             else:
-                self.value = layout.parse_multivector(string).value
+                self._value = layout.parse_multivector(string).value
         else:
-            self.value = np.array(value)
-            if self.value.shape != (self.layout.gaDims,):
+            self._value = np.array(value)
+            if self._value.shape != (self.layout.gaDims,):
                 raise ValueError(
                     "value must be a sequence of length %s" %
                     self.layout.gaDims)
 
+    @property
+    def value(self):
+        """
+        The array of coefficients, of length layout.gaDims, as a read-only
+        view. Use mutable_value to write to them in place.
+        """
+        value = self._value.view()
+        value.setflags(write=False)
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = np.asarray(value)
+        self._grades = None
+
+    @property
+    def mutable_value(self):
+        """
+        The array of coefficients, which may be written to in place. As the
+        writes may add grades, the grades the multivector was known to
+        contain are forgotten.
+        """
+        if not self._value.flags.writeable:
+            self._value = self._value.copy()
+        self._grades = None
+        return self._value
+
     def __array_wrap__(self, out_arr, context=None):
         '''
         This is a work-around needed to prevent numpy arrays from
@@ -734,30 +2709,100 @@ class MultiVector(object):
 
         _checkOther(other, coerce=1) --> newOther, isMultiVector
         """
-        if isinstance(other, numbers.Number):
+        if other.__class__ is self.__class__ and other.layout is self.layout:
+            return other, True
+
+        if other.__class__ in _fast_scalar_types or isinstance(other, numbers.Number):
             if coerce:
                 # numeric scalar
                 newOther = self._newMV()
                 newOther[()] = other
+                newOther._set_grades(1)
                 return newOther, True
             else:
                 return other, False
 
         elif (
                 isinstance(other, self.__class__) and
+                other.layout is not self.layout and
                 other.layout != self.layout):
             raise ValueError(
                 "cannot operate on MultiVectors with different Layouts")
 
+        elif isinstance(other, (PackedMV, BitmapMV)):
+            raise TypeError(
+                "cannot combine a MultiVector with a %s, convert it with "
+                "unpack() or to_mv() first" % other.__class__.__name__)
+
         return other, True
 
-    def _newMV(self, newValue=None):
+    def _newMV(self, newValue=None, grades=None):
         """Returns a new MultiVector (or derived class instance).
 
-        _newMV(self, newValue=None)
+        grades is the bitmask of the grades newValue can contain, if known.
+        newValue is used without copying it, so it must be a new array of
+        length gaDims that is not shared with anything else.
+
+        _newMV(self, newValue=None, grades=None)
         """
 
-        return self.__class__(self.layout, newValue)
+        if newValue is None:
+            newValue = np.zeros((self.layout.gaDims,), dtype=float)
+        newMV = object.__new__(self.__class__)
+        newMV.layout = self.layout
+        newMV._value = newValue
+        newMV._grades = grades
+        return newMV
+
+    @classmethod
+    def _from_value(cls, layout, value):
+        """ Wraps value, an array of length layout.gaDims, without copying or checking it """
+        obj = object.__new__(cls)
+        obj.layout = layout
+        obj._value = value
+        obj._grades = None
+        return obj
+
+    def _set_grades(self, grades):
+        """ Records that the current value only contains the grades in the bitmask grades """
+        self._grades = grades
+
+    def _known_grades(self):
+        """ Returns the recorded bitmask of grades, or None if it is unknown """
+        return self._grades
+
+    def forget_grades(self):
+        """
+        Forgets the grades this multivector is known to contain, so that
+        they are found from its coefficients when they are next needed.
+        Writing through mutable_value or assigning value already forgets
+        them.
+        """
+        self._grades = None
+
+    def _grade_mask(self):
+        """ Returns a bitmask of the grades the value can contain """
+        grades = self._known_grades()
+        if grades is None:
+            return self.layout._grade_mask(self._value)
+        return grades
+
+    def _product(self, product, a, b):
+        """ Evaluates product on a and b with a kernel restricted to their grades """
+        layout = self.layout
+        mask_a = a._known_grades()
+        mask_b = b._known_grades()
+        if mask_a is None or mask_b is None:
+            if layout.gaDims <= MAX_UNMASKED_GADIMS:
+                # Finding the grades would cost more than it saves
+                kernel = getattr(layout, '_%s_kernel' % product)
+                return self._newMV(kernel(a._value, b._value))
+            if mask_a is None:
+                mask_a = layout._grade_mask(a._value)
+            if mask_b is None:
+                mask_b = layout._grade_mask(b._value)
+        kernel, grades = layout._get_product_kernel(product, mask_a, mask_b)
+        return self._newMV(kernel(a._value, b._value), grades)
 
     # numeric special methods
     # binary
@@ -769,14 +2814,20 @@ class MultiVector(object):
         __and__(other) --> MultiVector
         """
 
+        if other.__class__ is self.__class__ and other.layout is self.layout:
+            return self._product('gmt', self, other)
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other, coerce=0)
 
         if mv:
-            newValue = self.layout.gmt_func(self.value,other.value)
+            return self._product('gmt', self, other)
         else:
-            newValue = other * self.value
+            newValue = other * self._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def __rmul__(self, other):
         """Right-hand geometric product
@@ -785,14 +2836,17 @@ class MultiVector(object):
         __rand__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other, coerce=0)
 
         if mv:
-            newValue = self.layout.gmt_func(other.value,self.value)
+            return self._product('gmt', other, self)
         else:
-            newValue = other*self.value
+            newValue = other*self._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def __xor__(self, other):
         """Outer product
@@ -801,14 +2855,20 @@ class MultiVector(object):
         __xor__(other) --> MultiVector
         """
 
+        if other.__class__ is self.__class__ and other.layout is self.layout:
+            return self._product('omt', self, other)
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other, coerce=0)
 
         if mv:
-            newValue = self.layout.omt_func(self.value,other.value)
+            return self._product('omt', self, other)
         else:
-            newValue = other*self.value
+            newValue = other*self._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def __rxor__(self, other):
         """Right-hand outer product
@@ -817,14 +2877,17 @@ class MultiVector(object):
         __rxor__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other, coerce=0)
 
         if mv:
-            newValue = self.layout.omt_func(other.value,self.value)
+            return self._product('omt', other, self)
         else:
-            newValue = other * self.value
+            newValue = other * self._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def __or__(self, other):
         """Inner product
@@ -833,15 +2896,19 @@ class MultiVector(object):
         __mul__(other) --> MultiVector
         """
 
+        if other.__class__ is self.__class__ and other.layout is self.layout:
+            return self._product('imt', self, other)
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
 
         if mv:
-            newValue = self.layout.imt_func(self.value,other.value)
+            return self._product('imt', self, other)
         else:
             return self._newMV()  # l * M = M * l = 0 for scalar l
 
-        return self._newMV(newValue)
-
     __ror__ = __or__
 
     def __add__(self, other):
@@ -851,10 +2918,13 @@ class MultiVector(object):
         __add__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
-        newValue = self.value + other.value
+        newValue = self._value + other._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._union_grades(other))
 
     __radd__ = __add__
 
@@ -865,10 +2935,13 @@ class MultiVector(object):
         __sub__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
-        newValue = self.value - other.value
+        newValue = self._value - other._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._union_grades(other))
 
     def __rsub__(self, other):
         """Right-hand subtraction
@@ -877,10 +2950,21 @@ class MultiVector(object):
         __rsub__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
-        newValue = other.value - self.value
+        newValue = other._value - self._value
+
+        return self._newMV(newValue, self._union_grades(other))
 
-        return self._newMV(newValue)
+    def _union_grades(self, other):
+        """ Bitmask of the grades of a sum of self and other, if both are known """
+        grades = self._known_grades()
+        other_grades = other._known_grades()
+        if grades is None or other_grades is None:
+            return None
+        return grades | other_grades
 
     def __truediv__(self, other):
         """Division
@@ -889,13 +2973,16 @@ class MultiVector(object):
         __div__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other, coerce=0)
 
         if mv:
             return self * other.inv()
         else:
-            newValue = self.value / other
-            return self._newMV(newValue)
+            newValue = self._value / other
+            return self._newMV(newValue, self._known_grades())
 
     def __rtruediv__(self, other):
         """Right-hand division
@@ -904,6 +2991,9 @@ class MultiVector(object):
         __rdiv__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
 
         return other * self.inv()
@@ -930,7 +3020,7 @@ class MultiVector(object):
         if other == 0:
             return 1
 
-        newMV = self._newMV(np.array(self.value))  # copy
+        newMV = self._newMV(np.array(self._value))  # copy
 
         for i in range(1, other):
             newMV = newMV * self
@@ -949,37 +3039,190 @@ class MultiVector(object):
         intMV = math.log(other) * self
         # pow(x, y) == exp(y * log(x))
 
-        newMV = self._newMV()  # null
+        return intMV.exp()
+
+    def exp(self):
+        """Exponential
+                   M
+        exp(M) --> e
+
+        Uses closed forms when M minus its scalar part squares to a scalar,
+        as for simple bivectors, and a scaled Taylor series otherwise.
+
+        exp() --> MultiVector
+        """
+
+        return self._newMV(self.layout.exp_func(self._value))
+
+    def log(self):
+        """Principal logarithm
 
-        nextTerm = self._newMV()
-        nextTerm[()] = 1  # order 0 term of exp(x) Taylor expansion
+        log(exp(B)) --> B
 
-        n = 1.
+        Uses closed forms when M minus its scalar part squares to a scalar,
+        as for simple rotors, translators and boosts. Otherwise square roots
+        are taken until M is close to 1, as for general rotors and motors,
+        and a series is summed.
 
-        while nextTerm != 0:
-            # iterate until the added term is within _eps of 0
-            newMV << nextTerm
-            nextTerm = nextTerm * intMV / n
-            n = n + 1
+        Raises ValueError if M has no real logarithm.
+
+        log() --> MultiVector
+        """
+
+        return self._newMV(self.layout.log_func(self._value))
+
+    # in-place
+    #
+    # These write the result into the value array when it is a writeable,
+    # contiguous float64 array, so other MultiVectors viewing the same array
+    # see the change, as for numpy arrays. Otherwise value is replaced.
+
+    def _inplace_value(self):
+        """ Returns whether results can be written directly into the value array """
+        value = self._value
+        return (value.dtype == np.float64 and value.flags.c_contiguous and
+                value.flags.writeable)
+
+    def _inplace_grades(self, grades):
+        """
+        Returns the grades to record after writing a result with the given
+        grades into the value array. An array whose grades are not known may
+        have been handed out and be written to later, so none are recorded.
+        """
+        if self._grades is None:
+            return None
+        return grades
+
+    def _inplace_product(self, product, other):
+        """ Replaces self with product of self and other, returning self """
+        kernel, grades = self.layout._get_product_kernel(
+            product, self._grade_mask(), other._grade_mask())
+        if self._inplace_value():
+            grades = self._inplace_grades(grades)
+            kernel(self._value, other._value, out=self._value)
         else:
-            # squeeze out that extra little bit of accuracy
-            newMV << nextTerm
+            self._value = kernel(self._value, other._value)
+        self._set_grades(grades)
+        return self
 
-        return newMV
+    def _inplace_scale(self, other):
+        """ Multiplies the value by the scalar other in place, returning self """
+        grades = self._known_grades()
+        if self._inplace_value():
+            self._value *= other
+        else:
+            self._value = other * self._value
+        self._set_grades(grades)
+        return self
 
-    def __lshift__(self, other):
+    def __iadd__(self, other):
         """In-place addition
 
-        M << N --> M + N
+        M += N
         __iadd__(other) --> MultiVector
         """
 
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
+        other, mv = self._checkOther(other)
+        grades = self._union_grades(other)
+        if self._inplace_value():
+            grades = self._inplace_grades(grades)
+            self._value += other._value
+        else:
+            self._value = self._value + other._value
+        self._set_grades(grades)
+
+        return self
+
+    def __isub__(self, other):
+        """In-place subtraction
+
+        M -= N
+        __isub__(other) --> MultiVector
+        """
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
         other, mv = self._checkOther(other)
+        grades = self._union_grades(other)
+        if self._inplace_value():
+            grades = self._inplace_grades(grades)
+            self._value -= other._value
+        else:
+            self._value = self._value - other._value
+        self._set_grades(grades)
+
+        return self
+
+    def __imul__(self, other):
+        """In-place geometric product
+
+        M *= N
+        __imul__(other) --> MultiVector
+        """
 
-        self.value = self.value + other.value
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
 
+        other, mv = self._checkOther(other, coerce=0)
+
+        if mv:
+            return self._inplace_product('gmt', other)
+        return self._inplace_scale(other)
+
+    def __ixor__(self, other):
+        """In-place outer product
+
+        M ^= N
+        __ixor__(other) --> MultiVector
+        """
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
+        other, mv = self._checkOther(other, coerce=0)
+
+        if mv:
+            return self._inplace_product('omt', other)
+        return self._inplace_scale(other)
+
+    def __itruediv__(self, other):
+        """In-place division
+
+        M /= N
+        __itruediv__(other) --> MultiVector
+        """
+
+        if isinstance(other, _foreign_mv_types):
+            return NotImplemented
+
+        other, mv = self._checkOther(other, coerce=0)
+
+        if mv:
+            return self._inplace_product('gmt', other.inv())
+        grades = self._known_grades()
+        if self._inplace_value():
+            self._value /= other
+        else:
+            self._value = self._value / other
+        self._set_grades(grades)
         return self
 
+    if sys.version_info[0] < 3:
+        __idiv__ = __itruediv__
+
+    def __lshift__(self, other):
+        """In-place addition
+
+        M << N --> M + N
+        __lshift__(other) --> MultiVector
+        """
+
+        return self.__iadd__(other)
+
     # unary
 
     def __neg__(self):
@@ -989,9 +3232,9 @@ class MultiVector(object):
         __neg__() --> MultiVector
         """
 
-        newValue = -self.value
+        newValue = -self._value
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def __pos__(self):
         """Positive (just a copy)
@@ -1000,9 +3243,9 @@ class MultiVector(object):
         __pos__(self) --> MultiVector
         """
 
-        newValue = self.value + 0  # copy
+        newValue = self._value + 0  # copy
 
-        return self._newMV(newValue)
+        return self._newMV(newValue, self._known_grades())
 
     def mag2(self):
         """Magnitude (modulus) squared
@@ -1012,8 +3255,20 @@ class MultiVector(object):
 
         Note in mixed signature spaces this may be negative
         """
-        mv_val = self.layout.gmt_func(self.layout.adjoint_func(self.value),self.value)
-        return MultiVector(self.layout, mv_val)[()]
+        value = np.asarray(self._value, dtype=np.float64)
+        return scalar_part_kernel(value, value, *self.layout._mag2_table)
+
+    def scalar_product(self, other):
+        """Scalar part of the geometric product
+
+        <M N>_0
+        scalar_product(other) --> PyFloat
+        """
+
+        other, mv = self._checkOther(other)
+        return scalar_part_kernel(np.asarray(self._value, dtype=np.float64),
+                                  np.asarray(other._value, dtype=np.float64),
+                                  *self.layout._scalar_product_table)
 
     def __abs__(self):
         """Magnitude (modulus)
@@ -1036,7 +3291,7 @@ class MultiVector(object):
         adjoint() --> MultiVector
         """
         # The multivector created by reversing all multiplications
-        return self._newMV(self.layout.adjoint_func(self.value))
+        return self._newMV(self.layout.adjoint_func(self._value), self._known_grades())
 
     __invert__ = adjoint
 
@@ -1093,14 +3348,14 @@ class MultiVector(object):
         __getitem__(key) --> PyFloat | PyInt
         """
         if isinstance(key, MultiVector):
-                return self.value[int(np.where(key.value)[0][0])]
+                return self._value[int(np.where(key.value)[0][0])]
         elif key in self.layout.bladeTupMap.keys():
-            return self.value[self.layout.bladeTupMap[key]]
+            return self._value[self.layout.bladeTupMap[key]]
         elif isinstance(key, tuple):
             sign, blade = compute_reordering_sign_and_canonical_form(key, np.array(self.layout.sig),
                                                                      self.layout.firstIdx)
-            return sign*self.value[self.layout.bladeTupMap[blade]]
-        return self.value[key]
+            return sign*self._value[self.layout.bladeTupMap[blade]]
+        return self._value[key]
 
     def __setitem__(self, key, value):
         """If key is a blade tuple (e.g. (0,1) or (1,3)), then set
@@ -1111,14 +3366,15 @@ class MultiVector(object):
         M[index] = PyFloat | PyInt
         __setitem__(key, value)
         """
+        self._grades = None
         if key in self.layout.bladeTupMap.keys():
-            self.value[self.layout.bladeTupMap[key]] = value
+            self._value[self.layout.bladeTupMap[key]] = value
         elif isinstance(key, tuple):
             sign, blade = compute_reordering_sign_and_canonical_form(key, np.array(self.layout.sig),
                                                                      self.layout.firstIdx)
-            self.value[self.layout.bladeTupMap[blade]] = sign*value
+            self._value[self.layout.bladeTupMap[blade]] = sign*value
         else:
-            self.value[key] = value
+            self._value[key] = value
 
     def __delitem__(self, key):
         """Set the selected coefficient to 0.
@@ -1129,13 +3385,13 @@ class MultiVector(object):
         """
 
         if key in self.layout.bladeTupMap.keys():
-            self.value[self.layout.bladeTupMap[key]] = 0
+            self._value[self.layout.bladeTupMap[key]] = 0
         elif isinstance(key, tuple):
             sign, blade = compute_reordering_sign_and_canonical_form(key, np.array(self.layout.sig),
                                                                      self.layout.firstIdx)
-            self.value[self.layout.bladeTupMap[blade]] = 0
+            self._value[self.layout.bladeTupMap[blade]] = 0
         else:
-            self.value[key] = 0
+            self._value[key] = 0
 
     def __getslice__(self, i, j):
         """Return a copy with only the slice non-zero.
@@ -1145,7 +3401,7 @@ class MultiVector(object):
         """
 
         newMV = self._newMV()
-        newMV.value[i:j] = self.value[i:j]
+        newMV._value[i:j] = self._value[i:j]
 
         return newMV
 
@@ -1155,8 +3411,9 @@ class MultiVector(object):
         M[i:j] = sequence
         __setslice__(i, j, sequence)
         """
+        self._grades = None
 
-        self.value[i:j] = sequence
+        self._value[i:j] = sequence
 
     def __delslice__(self, i, j):
         """Set slice to zeros.
@@ -1165,7 +3422,7 @@ class MultiVector(object):
         __delslice__(i, j)
         """
 
-        self.value[i:j] = 0
+        self._value[i:j] = 0
 
     # grade projection
     def __call__(self, other,*others):
@@ -1191,22 +3448,16 @@ class MultiVector(object):
             # we are making a grade projection
             grade = other
 
-        
-        if len(others) !=0:
-            return sum([self.__call__(k) for k in (other,)+others])
-        
-                
-        if grade not in self.layout.gradeList:
-            raise ValueError("algebra does not have grade %s" % grade)
-
-        if not isinstance(grade, int):
-            raise ValueError("grade must be an integer")
+        layout = self.layout
+        if len(others) != 0:
+            mask = layout._grades_bitmask((grade,) + others)
+            return self._newMV(self._value * layout._projection_mask(mask), mask)
 
-        mask = np.equal(grade, self.layout.gradeList)
+        index = layout._grade_slice(grade)
+        newValue = np.zeros(layout.gaDims)
+        newValue[index] = self._value[index]
 
-        newValue = np.multiply(mask, self.value)
-
-        return self._newMV(newValue)
+        return self._newMV(newValue, 1 << grade)
 
     # fundamental special methods
     def __str__(self):
@@ -1229,22 +3480,22 @@ class MultiVector(object):
 
             if self.layout.gradeList[i] == 0:
                 # scalar
-                if abs(self.value[i]) >= _eps:
-                    if self.value[i] > 0:
-                        s = '%s%s%s' % (s, seps[0], round(self.value[i], p))
+                if abs(self._value[i]) >= _eps:
+                    if self._value[i] > 0:
+                        s = '%s%s%s' % (s, seps[0], round(self._value[i], p))
                     else:
-                        s = '%s%s%s' % (s, seps[1], -round(self.value[i], p))
+                        s = '%s%s%s' % (s, seps[1], -round(self._value[i], p))
 
             else:
-                if abs(self.value[i]) >= _eps:
+                if abs(self._value[i]) >= _eps:
                     # not a scalar
-                    if self.value[i] > 0:
+                    if self._value[i] > 0:
                         s = '%s%s(%s^%s)' % (
-                            s, seps[0], round(self.value[i], p),
+                            s, seps[0], round(self._value[i], p),
                             self.layout.names[i])
                     else:
                         s = '%s%s(%s^%s)' % (
-                            s, seps[1], -round(self.value[i], p),
+                            s, seps[1], -round(self._value[i], p),
                             self.layout.names[i])
         if s:
             # non-zero
@@ -1265,7 +3516,7 @@ class MultiVector(object):
             return self.__str__()
 
         s = "MultiVector(%s, value=%s)" % (
-            repr(self.layout), list(self.value))
+            repr(self.layout), list(self._value))
         return s
 
     def __bool__(self):
@@ -1275,7 +3526,7 @@ class MultiVector(object):
         __nonzero() --> Boolean
         """
 
-        nonzeroes = np.absolute(self.value) > _eps
+        nonzeroes = np.absolute(self._value) > _eps
 
         if nonzeroes.any():
             return True
@@ -1304,26 +3555,32 @@ class MultiVector(object):
             """
 
             other, mv = self._checkOther(other)
-            print('cmp1', self.value)
-            print('cmp2', other.value)
+            print('cmp1', self._value)
+            print('cmp2', other._value)
 
-            if (np.absolute(self.value - other.value) < _eps).all():
+            if (np.absolute(self._value - other._value) < _eps).all():
                 # equal within epsilon
                 return 0
             else:
-                return cmp(tuple(self.value), tuple(other.value))
+                return cmp(tuple(self._value), tuple(other._value))
     else:
         def __eq__(self, other):
+            if isinstance(other, (PackedMV, BitmapMV)):
+                return NotImplemented
+
             other, mv = self._checkOther(other)
 
-            if (np.absolute(self.value - other.value) < _eps).all():
+            if (np.absolute(self._value - other._value) < _eps).all():
                 # equal within epsilon
                 return True
             else:
                 return False
 
         def __ne__(self, other):
-            return not self.__eq__(other)
+            equal = self.__eq__(other)
+            if equal is NotImplemented:
+                return equal
+            return not equal
 
         def __lt__(self, other):
             raise NotImplementedError
@@ -1348,10 +3605,10 @@ class MultiVector(object):
         if eps is None:
             eps = _eps
 
-        mask = np.absolute(self.value) > eps
+        mask = np.absolute(self._value) > eps
 
         # note element-wise multiplication
-        self.value = mask * self.value
+        self._value = mask * self._value
 
         return self
 
@@ -1366,7 +3623,7 @@ class MultiVector(object):
         if eps is None:
             eps = _eps
 
-        self.value = np.around(self.value, eps)
+        self._value = np.around(self._value, eps)
 
         return self
 
@@ -1380,9 +3637,7 @@ class MultiVector(object):
 
         other, mv = self._checkOther(other, coerce=1)
 
-        newValue = self.layout.lcmt_func(self.value,other.value)
-
-        return self._newMV(newValue)
+        return self._product('lcmt', self, other)
     
     @property
     def pseudoScalar(self):
@@ -1404,16 +3659,7 @@ class MultiVector(object):
         isScalar() --> Boolean
         """
 
-        indices = list(range(self.layout.gaDims))
-        indices.remove(self.layout.gradeList.index(0))
-
-        for i in indices:
-            if abs(self.value[i]) < _eps:
-                continue
-            else:
-                return False
-
-        return True
+        return grade_bitmask(self._value, self.layout._grade_array, _eps) <= 1
 
     def isBlade(self):
         """Returns true if multivector is a blade.
@@ -1428,7 +3674,7 @@ class MultiVector(object):
         grade = None
 
         for i in range(self.layout.gaDims):
-            if abs(self.value[i]) > _eps:
+            if abs(self._value[i]) > _eps:
                 if grade is None:
                     grade = self.layout.gradeList[i]
                 elif self.layout.gradeList[i] != grade:
@@ -1442,14 +3688,7 @@ class MultiVector(object):
         grades() --> [ PyInt, PyInt, ... ]
         """
 
-        grades = []
-
-        for i in range(self.layout.gaDims):
-            if abs(self.value[i]) > _eps and \
-               self.layout.gradeList[i] not in grades:
-                grades.append(self.layout.gradeList[i])
-
-        return grades
+        return self.layout._grades_of(self._value, _eps)
 
     @property
     def blades_list(self):
@@ -1457,11 +3696,18 @@ class MultiVector(object):
         ordered list of blades present in this MV
         '''
         blades_list = self.layout.blades_list
-        value = self.value
+        value = self._value
 
         b = [value[0]] + [value[k]*blades_list[k] for k in range(1, len(self))]
         return [k for k in b if k != 0]
 
+    def lazy(self):
+        """
+        Returns the multivector as an expression, so that the operators
+        record operations instead of evaluating them. See LazyMV.
+        """
+        return LazyMV(self.layout, 'input', param=self)
+
     def normal(self):
         """Return the (mostly) normalized multivector.
 
@@ -1487,16 +3733,10 @@ class MultiVector(object):
         identity = np.zeros((self.layout.gaDims,))
         identity[self.layout.gradeList.index(0)] = 1
 
-        intermed = np.zeros((self.layout.gaDims,self.layout.gaDims))
-
-        for i in range(self.layout.gaDims):
-            for j in range(self.layout.gaDims):
-                for k in range(self.layout.gaDims):
-                    ind = tuple([i, j, k])
-                    if ind in self.layout.gmt.keys():
-                        intermed[i, j] += self.layout.gmt[ind] * self.value[k]
-
-        intermed = np.transpose(intermed)
+        gmt = self.layout.gmt
+        intermed = right_mult_matrix_kernel(
+            np.asarray(self._value, dtype=np.float64),
+            gmt.k_list, gmt.l_list, gmt.m_list, gmt.mult_table_vals, self.layout.gaDims)
 
         if abs(linalg.det(intermed)) < _eps:
             raise ValueError("multivector has no left-inverse")
@@ -1512,264 +3752,1579 @@ class MultiVector(object):
         normalInv() --> MultiVector
         """
 
-        Madjoint = ~self
-        MadjointM = (Madjoint * self)
+        Madjoint = ~self
+        MadjointM = (Madjoint * self)
+
+        if MadjointM.isScalar() and abs(MadjointM[()]) > _eps:
+            # inverse exists
+            return Madjoint / MadjointM[()]
+        else:
+            raise ValueError("no inverse exists for this multivector")
+
+    def inv(self):
+        """Return the inverse.
+         -1         -1    -1
+        M    where M  * M  == M * M   == 1
+
+        Uses ~M / (~M * M) for versors and blades, the closed forms of Hitzer
+        and Sangwine in algebras of up to 5 dimensions, and otherwise the
+        linear algebra method of leftLaInv, all in jitted code.
+
+        inv() --> MultiVector
+        """
+
+        return self._newMV(self.layout.inv_func(self._value))
+
+    leftInv = leftLaInv
+    rightInv = inv
+
+    def dual(self, I=None):
+        """Returns the dual of the multivector against the given subspace I.
+        I defaults to the pseudoscalar.
+
+        ~        -1
+        M = M * I
+        dual(I=None) --> MultiVector
+        """
+
+        if I is None:
+            Iinv = self.invPS()
+        else:
+            Iinv = I.inv()
+
+        return self * Iinv
+
+    def commutator(self, other):
+        """Returns the commutator product of two multivectors.
+
+        [M, N] = M X N = (M*N - N*M)/2
+        commutator(other) --> MultiVector
+        """
+
+        other, mv = self._checkOther(other)
+        return self._newMV(self.layout.commutator_func(self._value, other._value))
+
+    x = commutator
+
+    def anticommutator(self, other):
+        """Returns the anti-commutator product of two multivectors.
+
+        (M*N + N*M)/2
+        anticommutator(other) --> MultiVector
+        """
+
+        other, mv = self._checkOther(other)
+        return self._newMV(self.layout.anticommutator_func(self._value, other._value))
+
+    def gradeInvol(self):
+        """Returns the grade involution of the multivector.
+         *                    i
+        M  = Sum[i, dims, (-1)  <M>  ]
+                                   i
+        gradeInvol() --> MultiVector
+        """
+
+        newValue = self.layout._involute_signs * self._value
+
+        return self._newMV(newValue, self._known_grades())
+
+    @property
+    def even(self):
+        '''
+        Even part of this mulivector
+
+        defined as
+        M + M.gradInvol()
+        '''
+        mask = self.layout._involute_signs > 0
+        return self._newMV(mask * self._value)
+
+    @property
+    def odd(self):
+        '''
+        Odd part of this mulivector
+
+        defined as
+        M +- M.gradInvol()
+        '''
+        mask = self.layout._involute_signs < 0
+        return self._newMV(mask * self._value)
+
+    def pack(self, grades=None):
+        """Returns the PackedMV storing the coefficients of grades, by default
+        those the multivector can contain.
+
+        pack([grades]) --> PackedMV
+        """
+
+        layout = self.layout
+        if grades is None:
+            return layout._packing_of_mask(self._grade_mask()).from_value(self._value)
+        return layout.packing(grades).from_value(self._value)
+
+    def conjugate(self):
+        """Returns the Clifford conjugate (reversion and grade involution).
+         *
+        M  --> (~M).gradeInvol()
+        conjugate() --> MultiVector
+        """
+
+        return self._newMV(self.layout._conjugate_signs * self._value, self._known_grades())
+
+    # Subspace operations
+    def project(self, other):
+        """Projects the multivector onto the subspace represented by this blade.
+                            -1
+        P (M) = (M _| A) * A
+         A
+        project(M) --> MultiVector
+        """
+
+        other, mv = self._checkOther(other, coerce=1)
+
+        if not self.isBlade():
+            raise ValueError("self is not a blade")
+
+        return other.lc(self) * self.inv()
+
+    def basis(self):
+        """Finds a vector basis of this subspace.
+
+        basis() --> [ MultiVector, MultiVector, ... ]
+        """
+
+        gr = self.grades()
+
+        if len(gr) != 1:
+            # FIXME: this is not a sufficient condition for a blade.
+            raise ValueError("self is not a blade")
+
+        selfInv = self.inv()
+
+        selfInv.clean()
+
+        wholeBasis = []  # vector basis of the whole space
+
+        for i in range(self.layout.gaDims):
+            if self.layout.gradeList[i] == 1:
+                v = np.zeros((self.layout.gaDims,), dtype=float)
+                v[i] = 1.
+                wholeBasis.append(self._newMV(v))
+
+        thisBasis = []  # vector basis of this subspace
+
+        J, mv = self._checkOther(1.)  # outer product of all of the vectors up
+        # to the point of iteration
+
+        for ei in wholeBasis:
+            Pei = ei.lc(self) * selfInv
+
+            J.clean()
+
+            J2 = J ^ Pei
+
+            if J2 != 0:
+                J = J2
+                thisBasis.append(Pei)
+                if len(thisBasis) == gr[0]:  # we have a complete set
+                    break
+
+        return thisBasis
+
+    def join(self, other):
+        """Returns the join of two blades.
+              .
+        J = A ^ B
+        join(other) --> MultiVector
+        """
+
+        other, mv = self._checkOther(other)
+
+        grSelf = self.grades()
+        grOther = other.grades()
+
+        if len(grSelf) == len(grOther) == 1:
+            # both blades
+
+            # try the outer product first
+            J = self ^ other
+
+            if J != 0:
+                return J.normal()
+
+            # try something else
+            M = (other * self.invPS()).lc(self)
+
+            if M != 0:
+                C = M.normal()
+                J = (self * C.rightInv()) ^ other
+                return J.normal()
+
+            if grSelf[0] >= grOther[0]:
+                A = self
+                B = other
+            else:
+                A = other
+                B = self
+
+            if (A * B) == (A | B):
+                # B is a subspace of A or the same if grades are equal
+                return A.normal()
+
+            # ugly, but general way
+            # watch out for residues
+
+            # A is still the larger-dimensional subspace
+
+            Bbasis = B.basis()
+
+            # add the basis vectors of B one by one to the larger
+            # subspace except for the ones that make the outer
+            # product vanish
+
+            J = A
+
+            for ei in Bbasis:
+                J.clean()
+                J2 = J ^ ei
+
+                if J2 != 0:
+                    J = J2
+
+            # for consistency's sake, we'll normalize the join
+            J = J.normal()
+
+            return J
+
+        else:
+            raise ValueError("not blades")
+
+    def meet(self, other, subspace=None):
+        """Returns the meet of two blades.
+
+        Computation is done with respect to a subspace that defaults to
+        the join if none is given.
+                     -1
+        M \/i N = (Mi  ) * N
+        meet(other, subspace=None) --> MultiVector
+        """
+
+        other, mv = self._checkOther(other)
+
+        r = self.grades()
+        s = other.grades()
+
+        if len(r) > 1 or len(s) > 1:
+            raise ValueError("not blades")
+
+        if subspace is None:
+            subspace = self.join(other)
+
+        return (self * subspace.inv()) | other
+
+
+class MVArray(np.ndarray):
+    '''
+    MultiVector Array
+    '''
+
+    def __new__(cls, input_array):
+        obj = np.empty(len(input_array), dtype=object)
+        obj[:] = input_array
+        obj = obj.view(cls)
+        return obj
+
+    def __array_finalize__(self, obj):
+        if obj is None:
+            return
+
+
+class MVBatch(object):
+    """An array of multivectors stored as one contiguous array of coefficients
+
+    Parameters
+    -------------
+    layout: instance of `clifford.Layout`
+        the layout of the algebra
+
+    value : array_like of shape (..., layout.gaDims)
+        the coefficients of the multivectors. A float64 array is used
+        without copying.
+
+    Notes
+    ------
+    The operators of MultiVector are supported and broadcast over the
+    leading dimensions like numpy arrays do. Either operand may be a
+    MultiVector, a scalar or an array of scalars. The products are evaluated
+    by the generalized ufuncs of the layout, such as layout.gmt_gufunc, or
+    for batches of at least PARALLEL_BATCH_SIZE multivectors by the
+    multithreaded functions such as layout.gmt_parallel. Products with a
+    single MultiVector, and apply_rotor, multiply the coefficients by the
+    matrix of the linear map, such as layout.left_mult_matrix.
+
+    Indexing that leaves no leading dimensions returns a MultiVector viewing
+    the same memory. Other indexing returns an MVBatch view, as basic numpy
+    indexing would.
+    """
+
+    # Keep numpy from treating a batch as a sequence in mixed arithmetic
+    __array_ufunc__ = None
+
+    def __init__(self, layout, value):
+        self.layout = layout
+        self.value = np.asarray(value, dtype=np.float64)
+        if self.value.ndim == 0 or self.value.shape[-1] != layout.gaDims:
+            raise ValueError(
+                "value must be an array of shape (..., %s)" % layout.gaDims)
+
+    @classmethod
+    def from_multivectors(cls, mvs):
+        """ Stacks a sequence of MultiVectors of the same layout into a batch """
+        mvs = list(mvs)
+        if not mvs:
+            raise ValueError("cannot infer the layout of an empty sequence")
+        layout = mvs[0].layout
+        for mv in mvs:
+            if mv.layout is not layout and mv.layout != layout:
+                raise ValueError(
+                    "cannot operate on MultiVectors with different Layouts")
+        return cls(layout, np.array([mv.value for mv in mvs], dtype=np.float64))
+
+    def to_mvarray(self):
+        """ Returns an MVArray of MultiVectors viewing the rows of a 1-d batch """
+        if self.ndim != 1:
+            raise ValueError("only 1-d batches can be converted to an MVArray")
+        return MVArray(list(self))
+
+    @property
+    def shape(self):
+        """ The shape of the batch, excluding the coefficient dimension """
+        return self.value.shape[:-1]
+
+    @property
+    def ndim(self):
+        return self.value.ndim - 1
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError("len() of unsized MVBatch")
+        return self.value.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _wrap(self, value):
+        """ Returns value as a MultiVector if it has no leading dimensions, otherwise as a batch """
+        if value.ndim == 1:
+            return MultiVector._from_value(self.layout, value)
+        return self.__class__(self.layout, value)
+
+    def _index(self, key):
+        # Never index into the coefficients
+        if not isinstance(key, tuple):
+            key = (key,)
+        return key + (slice(None),)
+
+    def __getitem__(self, key):
+        return self._wrap(self.value[self._index(key)])
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (MultiVector, MVBatch)):
+            self._check_layout(value)
+            value = value.value
+        self.value[self._index(key)] = value
+
+    def copy(self):
+        return self.__class__(self.layout, self.value.copy())
+
+    def __repr__(self):
+        return "MVBatch(%r, shape=%r)" % (self.layout, self.shape)
+
+    # arithmetic
+
+    def _check_layout(self, other):
+        if other.layout is not self.layout and other.layout != self.layout:
+            raise ValueError(
+                "cannot operate on MultiVectors with different Layouts")
+
+    def _operand(self, other):
+        """ Returns the coefficients of other, or None if it is not a multivector """
+        if isinstance(other, (MultiVector, MVBatch)):
+            self._check_layout(other)
+            return other.value
+        return None
+
+    def _scalars(self, other):
+        """ Returns other as an array of scalars that broadcasts against the coefficients """
+        other = np.asarray(other)
+        if other.ndim:
+            other = other[..., np.newaxis]
+        return other
+
+    def _product(self, product, value, other_value):
+        # Products of a batch with a single multivector are a matrix product
+        if value.ndim == 1 and other_value.ndim > 1:
+            matrix = self.layout.left_mult_matrix(value, product)
+            return self._wrap(self.layout.apply_matrix(matrix, other_value))
+        if other_value.ndim == 1 and value.ndim > 1:
+            matrix = self.layout.right_mult_matrix(other_value, product)
+            return self._wrap(self.layout.apply_matrix(matrix, value))
+        # Large batches are split between threads
+        n_dims = self.layout.gaDims
+        if max(value.size, other_value.size) >= PARALLEL_BATCH_SIZE*n_dims:
+            func = getattr(self.layout, product + '_parallel')
+        else:
+            func = getattr(self.layout, product + '_gufunc')
+        return self._wrap(func(value, other_value))
+
+    def __mul__(self, other):
+        """ Geometric product, or scaling by scalars """
+        other_value = self._operand(other)
+        if other_value is None:
+            return self._wrap(self.value * self._scalars(other))
+        return self._product('gmt', self.value, other_value)
+
+    def __rmul__(self, other):
+        other_value = self._operand(other)
+        if other_value is None:
+            return self._wrap(self._scalars(other) * self.value)
+        return self._product('gmt', other_value, self.value)
+
+    def __xor__(self, other):
+        """ Outer product """
+        other_value = self._operand(other)
+        if other_value is None:
+            return self * other
+        return self._product('omt', self.value, other_value)
+
+    def __rxor__(self, other):
+        other_value = self._operand(other)
+        if other_value is None:
+            return other * self
+        return self._product('omt', other_value, self.value)
+
+    def __or__(self, other):
+        """ Inner product """
+        other_value = self._operand(other)
+        if other_value is None:
+            # l . M = M . l = 0 for scalar l
+            return self._wrap(np.zeros_like(self.value * self._scalars(other)))
+        return self._product('imt', self.value, other_value)
+
+    def __ror__(self, other):
+        other_value = self._operand(other)
+        if other_value is None:
+            return self | other
+        return self._product('imt', other_value, self.value)
+
+    def lc(self, other):
+        """ Left-contraction """
+        other_value = self._operand(other)
+        if other_value is None:
+            other_value = MultiVector(self.layout) + other
+            other_value = other_value.value
+        return self._product('lcmt', self.value, other_value)
+
+    def _scalar_value(self, other):
+        """ Returns the coefficients of other, treating scalars as scalar multivectors """
+        other_value = self._operand(other)
+        if other_value is None:
+            other_value = np.zeros(np.shape(other) + (self.layout.gaDims,))
+            other_value[..., self.layout.gradeList.index(0)] = other
+        return other_value
+
+    def __add__(self, other):
+        return self._wrap(self.value + self._scalar_value(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._wrap(self.value - self._scalar_value(other))
+
+    def __rsub__(self, other):
+        return self._wrap(self._scalar_value(other) - self.value)
+
+    def __truediv__(self, other):
+        if isinstance(other, (MultiVector, MVBatch)):
+            return self * other.inv()
+        return self._wrap(self.value / self._scalars(other))
+
+    def __rtruediv__(self, other):
+        return other * self.inv()
+
+    if sys.version_info[0] < 3:
+        __div__ = __truediv__
+        __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        return self._wrap(-self.value)
+
+    def __pos__(self):
+        return self._wrap(self.value.copy())
+
+    def adjoint(self):
+        """ Reversion of every multivector """
+        return self._wrap(self.layout.adjoint_gufunc(self.value))
+
+    __invert__ = adjoint
+
+    def inv(self):
+        """ Inverse of every multivector """
+        return self._wrap(self.layout.inv_func(self.value))
+
+    def exp(self):
+        """ Exponential of every multivector """
+        return self._wrap(self.layout.exp_func(self.value))
+
+    def log(self):
+        """ Principal logarithm of every multivector """
+        return self._wrap(self.layout.log_func(self.value))
+
+    def gradeInvol(self):
+        """ Grade involution of every multivector """
+        return self._wrap(self.layout.gradeInvol_gufunc(self.value))
+
+    def conjugate(self):
+        """ Clifford conjugate of every multivector """
+        return self._wrap(self.layout.conjugate_gufunc(self.value))
+
+    def grades(self):
+        """ The sorted grades present in any of the multivectors """
+        value = self.value.reshape(-1, self.layout.gaDims)
+        mask = batch_grade_bitmask(value, self.layout._grade_array, _eps)
+        return [g for g in range(self.layout.dims + 1) if mask >> g & 1]
+
+    def __call__(self, grade, *grades):
+        """ Projection of every multivector onto one or more grades """
+        return self._wrap(self.layout.project_gufunc(self.value, (grade,) + grades))
+
+    def apply_rotor(self, R):
+        """ Applies the rotor R to every multivector, as R*X*~R """
+        self._check_layout(R)
+        return self._wrap(self.layout.apply_rotor_parallel(R.value, self.value))
+
+    def normal(self):
+        """ Normalises every multivector, as MultiVector.normal does """
+        return self._wrap(self.layout.normalise_parallel(self.value))
+
+    def mag2(self):
+        """ The array of <~X X>_0 for every multivector X """
+        return self.layout.mag2_gufunc(self.value)
+
+    def scalar_product(self, other):
+        """ The array of <X N>_0 for every multivector X, broadcasting against other """
+        self._check_layout(other)
+        return self.layout.scalar_product_gufunc(self.value, other.value)
+
+    def commutator(self, other):
+        """ The commutator product of every multivector, broadcasting against other """
+        self._check_layout(other)
+        return self._wrap(self.layout.commutator_gufunc(self.value, other.value))
+
+    def anticommutator(self, other):
+        """ The anticommutator product of every multivector, broadcasting against other """
+        self._check_layout(other)
+        return self._wrap(self.layout.anticommutator_gufunc(self.value, other.value))
+
+    # reductions
+
+    def sum(self, axis=None):
+        """ Sum over the leading dimensions given by axis, all of them by default """
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        return self._wrap(np.sum(self.value, axis=self._axes(axis)))
+
+    def mean(self, axis=None):
+        """ Mean over the leading dimensions given by axis, all of them by default """
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        return self._wrap(np.mean(self.value, axis=self._axes(axis)))
+
+    def _axes(self, axis):
+        # Negative axes count from the last leading dimension
+        if isinstance(axis, tuple):
+            return tuple(self._axes(a) for a in axis)
+        if axis < 0:
+            axis += self.ndim
+        if not 0 <= axis < self.ndim:
+            raise ValueError("axis %s is out of bounds for a batch of dimension %s"
+                             % (axis, self.ndim))
+        return axis
+
+
+class GradePacking(object):
+    """The coefficients of a fixed set of grades of a layout, stored contiguously
+
+    Obtained with Layout.packing, which returns the same GradePacking for
+    the same grades, so packings can be compared with `is`.
+
+    Attributes
+    -----------
+    layout : the Layout the coefficients belong to
+    grades : the sorted tuple of grades
+    mask : bitmask with bit g set for each grade g
+    indices : the indices of the packed coefficients in the full value
+    size : the number of packed coefficients
+
+    Notes
+    ------
+    The products between two packings are evaluated by kernels built from
+    the entries of the product tables that connect them, with the indices
+    renumbered to the packed coefficients, so structurally zero terms are
+    never visited. The kernels, and the packing of the result, are built on
+    first use and kept on the packing.
+    """
+
+    def __init__(self, layout, mask):
+        self.layout = layout
+        self.mask = mask
+        self.grades = tuple(g for g in range(layout.dims + 1) if mask >> g & 1)
+        self.indices = np.flatnonzero(layout._projection_mask(mask))
+        self.size = len(self.indices)
+        self._reverse_signs = layout._reverse_signs[self.indices]
+        self._involute_signs = layout._involute_signs[self.indices]
+        self._products = {}
+
+    def __repr__(self):
+        return "GradePacking(%r, grades=%r)" % (self.layout, self.grades)
+
+    def from_value(self, value):
+        """ Returns the PackedMV of the values of shape (..., gaDims), dropping other grades """
+        return PackedMV(self, self.pack(value))
+
+    def from_mv(self, mv):
+        """ Returns the PackedMV of a MultiVector or MVBatch, dropping other grades """
+        if mv.layout is not self.layout and mv.layout != self.layout:
+            raise ValueError(
+                "cannot operate on MultiVectors with different Layouts")
+        return self.from_value(mv.value)
+
+    def pack(self, value):
+        """ Returns the packed coefficients of the values of shape (..., gaDims), dropping other grades """
+        return np.asarray(value, dtype=np.float64)[..., self.indices]
+
+    def unpack(self, value):
+        """ Returns the full values of shape (..., gaDims) of the packed coefficients value """
+        value = np.asarray(value, dtype=np.float64)
+        output = np.zeros(value.shape[:-1] + (self.layout.gaDims,))
+        output[..., self.indices] = value
+        return output
+
+    def _product(self, product, other):
+        """
+        Returns the packing of product, one of 'gmt', 'imt', 'omt' or
+        'lcmt', of coefficients packed by self and other, and functions
+        evaluating it for single values and for arrays of them
+        """
+        key = (product, other.mask)
+        try:
+            return self._products[key]
+        except KeyError:
+            pass
+        layout = self.layout
+        table = getattr(layout, product)
+        position_a = np.full(layout.gaDims, -1, dtype=np.int32)
+        position_a[self.indices] = np.arange(self.size)
+        position_b = np.full(layout.gaDims, -1, dtype=np.int32)
+        position_b[other.indices] = np.arange(other.size)
+        table = table.filter((position_a[table.k_list] >= 0) & (position_b[table.m_list] >= 0))
+        out = layout.packing(np.unique(layout._grade_array[table.l_list]).tolist())
+        position_out = np.full(layout.gaDims, -1, dtype=np.int32)
+        position_out[out.indices] = np.arange(out.size)
+        table = SparseMultTable(position_a[table.k_list], position_out[table.l_list],
+                                position_b[table.m_list], table.mult_table_vals, out.size)
+
+        # Packed coefficients are dense, so the kernels do not test them for zero
+        if layout.gaDims <= MAX_UNROLLED_GADIMS:
+            mult = get_unrolled_mult_function(table, out.size, skip_zeros=False)
+        else:
+            mult = get_mult_function(table, out.size, None, skip_zeros=False)
+
+        k_list = table.k_list
+        l_list = table.l_list
+        m_list = table.m_list
+        mult_table_vals = table.mult_table_vals
+        size_a = self.size
+        size_b = other.size
+
+        def mult_rows(value, other_value):
+            shape = np.broadcast(value[..., 0], other_value[..., 0]).shape
+            output = parallel_sparse_mult_kernel(_as_rows(value, shape, size_a),
+                                                 _as_rows(other_value, shape, size_b),
+                                                 k_list, l_list, m_list, mult_table_vals, out.size)
+            return output.reshape(shape + (out.size,))
+
+        return self._products.setdefault(key, (out, mult, mult_rows))
+
+
+class PackedMV(object):
+    """A multivector, or an array of them, storing only the coefficients of some grades
+
+    Parameters
+    -------------
+    packing: instance of `clifford.GradePacking`
+        the grades that are stored, from Layout.packing
+
+    value : array_like of shape (..., packing.size)
+        the packed coefficients. A float64 array is used without copying.
+
+    Notes
+    ------
+    A CGA rotor only has 16 coefficients and a line 10, against 32 for a
+    MultiVector. The products, sums and differences of packed multivectors
+    are packed multivectors of the grades the result can contain. Scalars
+    broadcast as for MVBatch.
+
+    >>> even = layout.packing([0, 2, 4])
+    >>> R = even.from_mv(R)
+    >>> L = layout.packing(2).from_mv(L)
+    >>> (R*L*~R)(2).unpack()
+    """
+
+    # Keep numpy from treating a batch as a sequence in mixed arithmetic
+    __array_ufunc__ = None
+
+    def __init__(self, packing, value):
+        self.packing = packing
+        self.layout = packing.layout
+        self.value = np.asarray(value, dtype=np.float64)
+        if self.value.ndim == 0 or self.value.shape[-1] != packing.size:
+            raise ValueError(
+                "value must be an array of shape (..., %s)" % packing.size)
+
+    @classmethod
+    def _from_value(cls, packing, value):
+        """ Wraps value, a float64 array of shape (..., packing.size), without checking it """
+        obj = object.__new__(cls)
+        obj.packing = packing
+        obj.layout = packing.layout
+        obj.value = value
+        return obj
+
+    @property
+    def shape(self):
+        """ The shape of the array of multivectors, excluding the coefficient dimension """
+        return self.value.shape[:-1]
+
+    @property
+    def ndim(self):
+        return self.value.ndim - 1
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError("len() of unsized PackedMV")
+        return self.value.shape[0]
+
+    def __getitem__(self, key):
+        # Never index into the coefficients
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.__class__(self.packing, self.value[key + (slice(None),)])
+
+    def copy(self):
+        return self.__class__(self.packing, self.value.copy())
+
+    def __repr__(self):
+        return "PackedMV(%r, shape=%r)" % (self.packing, self.shape)
+
+    def unpack(self):
+        """ Returns the MultiVector, or MVBatch for arrays, with these coefficients """
+        value = self.packing.unpack(self.value)
+        if value.ndim == 1:
+            return MultiVector._from_value(self.layout, value)
+        return MVBatch(self.layout, value)
+
+    def repack(self, packing):
+        """ Returns these multivectors stored with packing, dropping the grades it does not have """
+        if packing is self.packing:
+            return self
+        return packing.from_value(self.packing.unpack(self.value))
+
+    # arithmetic
+
+    def _check_other(self, other):
+        if not isinstance(other, PackedMV):
+            return False
+        if other.layout is not self.layout and other.layout != self.layout:
+            raise ValueError(
+                "cannot operate on MultiVectors with different Layouts")
+        return True
+
+    def _product(self, product, other):
+        if not self._check_other(other):
+            if isinstance(other, (MultiVector, MVBatch)):
+                return NotImplemented
+            return self.__class__(self.packing, self.value * self._scalars(other))
+        out, mult, mult_rows = self.packing._product(product, other.packing)
+        value = self.value
+        other_value = other.value
+        if value.ndim == 1 and other_value.ndim == 1:
+            return self._from_value(out, mult(value, other_value))
+        return self._from_value(out, mult_rows(value, other_value))
+
+    def _scalars(self, other):
+        """ Returns other as an array of scalars that broadcasts against the coefficients """
+        other = np.asarray(other)
+        if other.ndim:
+            other = other[..., np.newaxis]
+        return other
+
+    def _sum(self, other, sign):
+        if not self._check_other(other):
+            if isinstance(other, (MultiVector, MVBatch)):
+                return NotImplemented
+            other = PackedMV(self.layout.packing(0),
+                             np.asarray(other, dtype=np.float64)[..., np.newaxis])
+        if other.packing is self.packing:
+            return self.__class__(self.packing, self.value + sign*other.value)
+        packing = self.layout._packing_of_mask(self.packing.mask | other.packing.mask)
+        return self.__class__(packing, self.repack(packing).value + sign*other.repack(packing).value)
+
+    def __mul__(self, other):
+        """ Geometric product, or scaling by scalars """
+        return self._product('gmt', other)
+
+    def __rmul__(self, other):
+        if isinstance(other, (MultiVector, MVBatch)):
+            return NotImplemented
+        return self.__class__(self.packing, self.value * self._scalars(other))
+
+    def __xor__(self, other):
+        """ Outer product """
+        return self._product('omt', other)
+
+    def __or__(self, other):
+        """ Inner product """
+        return self._product('imt', other)
+
+    def lc(self, other):
+        """ Left contraction """
+        return self._product('lcmt', other)
+
+    def __add__(self, other):
+        return self._sum(other, 1)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._sum(other, -1)
+
+    def __rsub__(self, other):
+        return (-self)._sum(other, 1)
+
+    def __truediv__(self, other):
+        """ Division by scalars """
+        if isinstance(other, (MultiVector, MVBatch)):
+            return NotImplemented
+        return self.__class__(self.packing, self.value / self._scalars(other))
+
+    if sys.version_info[0] < 3:
+        __div__ = __truediv__
+
+    def __neg__(self):
+        return self.__class__(self.packing, -self.value)
+
+    def adjoint(self):
+        """ Reversion """
+        return self._from_value(self.packing, self.value * self.packing._reverse_signs)
+
+    __invert__ = adjoint
+
+    def gradeInvol(self):
+        """ Grade involution """
+        return self.__class__(self.packing, self.value * self.packing._involute_signs)
+
+    def __call__(self, grade, *grades):
+        """ Projection onto one or more grades, keeping only their coefficients """
+        mask = self.layout._grades_bitmask((grade,) + grades)
+        return self.repack(self.layout._packing_of_mask(self.packing.mask & mask))
+
+
+class BitmapLayout(object):
+    """The layout of an algebra whose products are computed without tables
+
+    Parameters
+    -------------
+    sig : sequence of 1 and -1
+        the squares of the basis vectors
+    firstIdx : int
+        the index of the first basis vector in blade names
+
+    Notes
+    ------
+    A Layout stores 2**n blades and builds tables of up to 4**n entries,
+    which is out of reach beyond about n = 11. A BitmapLayout stores
+    neither: its multivectors, BitmapMV, store the bitmaps of their non-zero
+    blades with the coefficients, and bitmap_mult_kernel computes the terms
+    of a product pair by pair. The cost of a product grows with the product
+    of the numbers of terms, so it suits sparse multivectors such as
+    vectors, bivectors and versors of algebras of up to 62 dimensions.
+
+    The table-free engine can be selected for an existing Layout with
+    Layout.bitmap_layout, and multivectors converted with BitmapMV.from_mv
+    and BitmapMV.to_mv.
+    """
+
+    def __init__(self, sig, firstIdx=1):
+        sig = np.asarray(sig)
+        if len(sig) > 62:
+            raise ValueError("bitmaps are limited to 62 basis vectors")
+        self.dims = len(sig)
+        self.sig = np.divide(sig, np.absolute(sig)).astype(int)
+        self.firstIdx = firstIdx
+        self._metric = self.sig.astype(np.float64)
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, BitmapLayout):
+            return NotImplemented
+        return np.array_equal(self.sig, other.sig) and self.firstIdx == other.firstIdx
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return "BitmapLayout(%r, firstIdx=%r)" % (list(self.sig), self.firstIdx)
+
+    @property
+    def scalar(self):
+        """ The unit scalar """
+        return BitmapMV(self, [0], [1.0])
+
+    def blade(self, *indices):
+        """
+        Returns the product of the basis vectors with the given indices, as
+        numbered from firstIdx
+        """
+        result = self.scalar
+        for index in indices:
+            if not self.firstIdx <= index < self.firstIdx + self.dims:
+                raise ValueError("algebra has no basis vector %s" % index)
+            result = result * BitmapMV(self, [1 << (index - self.firstIdx)], [1.0])
+        return result
+
+    def basis_vectors(self):
+        """ Returns a dictionary of the basis vectors, keyed by name """
+        return {'e%i' % (i + self.firstIdx): BitmapMV(self, [1 << i], [1.0])
+                for i in range(self.dims)}
+
+    def randomMV(self, grades, min=-2.0, max=2.0, n_terms=None, uniform=None):
+        """
+        Returns a multivector with random coefficients between min and max on
+        n_terms random blades of each of the given grades, or on all of
+        them if n_terms is None
+        """
+        if uniform is None:
+            uniform = np.random.uniform
+        if isinstance(grades, int):
+            grades = [grades]
+        bitmaps = []
+        for grade in grades:
+            if n_terms is None:
+                blades = itertools.combinations(range(self.dims), grade)
+            else:
+                blades = [np.random.choice(self.dims, grade, replace=False) for i in range(n_terms)]
+            bitmaps += [sum(1 << int(i) for i in blade) for blade in blades]
+        return BitmapMV(self, bitmaps, uniform(min, max, len(bitmaps)))
+
+
+class BitmapMV(object):
+    """A sparse multivector of a BitmapLayout
+
+    Parameters
+    -------------
+    layout: instance of `clifford.BitmapLayout`
+        the layout of the algebra
+
+    bitmaps : sequence of int
+        the bitmaps of the blades, with bit i set for basis vector
+        i + layout.firstIdx
+
+    coefs : sequence of float
+        the coefficients of the blades. The terms are sorted by bitmap, and
+        repeated blades are added up.
+
+    Notes
+    ------
+    The products, sums, reversion, grade projection and inverse of versors
+    of MultiVector are supported, with scalars where they make sense.
+    """
+
+    # Keep numpy from treating a multivector as a sequence in mixed arithmetic
+    __array_ufunc__ = None
+
+    def __init__(self, layout, bitmaps=(), coefs=()):
+        self.layout = layout
+        bitmaps = np.asarray(bitmaps, dtype=np.int64).reshape(-1)
+        coefs = np.asarray(coefs, dtype=np.float64).reshape(-1)
+        if bitmaps.shape != coefs.shape:
+            raise ValueError("bitmaps and coefs must have the same length")
+        self.bitmaps, self.coefs = bitmap_merge_kernel(bitmaps, coefs)
+
+    @classmethod
+    def _from_terms(cls, layout, bitmaps, coefs):
+        """ Wraps sorted, merged terms without checking them """
+        obj = object.__new__(cls)
+        obj.layout = layout
+        obj.bitmaps = bitmaps
+        obj.coefs = coefs
+        return obj
+
+    @classmethod
+    def from_mv(cls, mv):
+        """ Returns the BitmapMV of the MultiVector mv """
+        layout = mv.layout
+        nonzero = np.flatnonzero(mv.value)
+        return cls(layout.bitmap_layout, np.asarray(layout.linear_map_to_bitmap)[nonzero],
+                   mv.value[nonzero])
+
+    def to_mv(self, layout):
+        """ Returns the MultiVector of layout with these terms """
+        if layout.bitmap_layout != self.layout:
+            raise ValueError("layout has a different signature")
+        value = np.zeros(layout.gaDims)
+        value[np.asarray(layout.bitmap_to_linear_map)[self.bitmaps]] = self.coefs
+        return layout.MultiVector(value=value)
+
+    def __repr__(self):
+        return "BitmapMV(%r, %r, %r)" % (self.layout, self.bitmaps.tolist(), self.coefs.tolist())
+
+    def __str__(self):
+        terms = []
+        for bitmap, coef in zip(self.bitmaps.tolist(), self.coefs.tolist()):
+            if bitmap == 0:
+                terms.append(repr(round(coef, _print_precision)))
+            else:
+                name = 'e' + ''.join(str(i) for i in compute_blade_representation(bitmap, self.layout.firstIdx))
+                terms.append('(%r^%s)' % (round(coef, _print_precision), name))
+        return ' + '.join(terms) if terms else '0'
+
+    def __len__(self):
+        """ The number of non-zero terms """
+        return len(self.bitmaps)
+
+    def __eq__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        difference = self - other
+        return bool(np.all(np.abs(difference.coefs) < _eps))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    # arithmetic
+
+    def _operand(self, other):
+        """ Returns other as a BitmapMV, or NotImplemented """
+        if isinstance(other, BitmapMV):
+            if other.layout is not self.layout and other.layout != self.layout:
+                raise ValueError(
+                    "cannot operate on MultiVectors with different Layouts")
+            return other
+        if isinstance(other, numbers.Number):
+            return BitmapMV(self.layout, [0], [other])
+        return NotImplemented
+
+    def _product(self, product, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        bitmaps, coefs = bitmap_mult_kernel(self.bitmaps, self.coefs, other.bitmaps, other.coefs,
+                                            self.layout._metric, _bitmap_products[product], _eps)
+        return self._from_terms(self.layout, bitmaps, coefs)
+
+    def __mul__(self, other):
+        """ Geometric product """
+        if isinstance(other, numbers.Number):
+            return self._from_terms(self.layout, self.bitmaps, self.coefs * other)
+        return self._product('gmt', other)
+
+    def __rmul__(self, other):
+        if isinstance(other, numbers.Number):
+            return self._from_terms(self.layout, self.bitmaps, other * self.coefs)
+        return NotImplemented
+
+    def __xor__(self, other):
+        """ Outer product """
+        return self._product('omt', other)
+
+    def __rxor__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return other._product('omt', self)
 
-        if MadjointM.isScalar() and abs(MadjointM[()]) > _eps:
-            # inverse exists
-            return Madjoint / MadjointM[()]
-        else:
-            raise ValueError("no inverse exists for this multivector")
+    def __or__(self, other):
+        """ Inner product """
+        return self._product('imt', other)
 
-    leftInv = leftLaInv
-    inv = rightInv = leftLaInv
-    # inv= normalInv
+    def __ror__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return other._product('imt', self)
 
-    def dual(self, I=None):
-        """Returns the dual of the multivector against the given subspace I.
-        I defaults to the pseudoscalar.
+    def lc(self, other):
+        """ Left contraction """
+        return self._product('lcmt', other)
 
-        ~        -1
-        M = M * I
-        dual(I=None) --> MultiVector
-        """
+    def __add__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return BitmapMV(self.layout, np.concatenate((self.bitmaps, other.bitmaps)),
+                        np.concatenate((self.coefs, other.coefs)))
 
-        if I is None:
-            Iinv = self.invPS()
-        else:
-            Iinv = I.inv()
+    __radd__ = __add__
 
-        return self * Iinv
+    def __sub__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return self + (-other)
 
-    def commutator(self, other):
-        """Returns the commutator product of two multivectors.
+    def __rsub__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return (-self) + other
 
-        [M, N] = M X N = (M*N - N*M)/2
-        commutator(other) --> MultiVector
-        """
+    def __neg__(self):
+        return self._from_terms(self.layout, self.bitmaps, -self.coefs)
 
-        return ((self * other) - (other * self)) / 2
+    def __truediv__(self, other):
+        """ Division by a scalar, or multiplication by the inverse of a versor """
+        if isinstance(other, numbers.Number):
+            return self._from_terms(self.layout, self.bitmaps, self.coefs / other)
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return self * other.inv()
 
-    x = commutator
+    def __rtruediv__(self, other):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return other
+        return other * self.inv()
 
-    def anticommutator(self, other):
-        """Returns the anti-commutator product of two multivectors.
+    if sys.version_info[0] < 3:
+        __div__ = __truediv__
+        __rdiv__ = __rtruediv__
 
-        (M*N + N*M)/2
-        anticommutator(other) --> MultiVector
-        """
+    def _grade_array(self):
+        return np.array([count_set_bits(bitmap) for bitmap in self.bitmaps.tolist()], dtype=np.int64)
+
+    def _scale_by_grade(self, signs):
+        grades = self._grade_array()
+        return self._from_terms(self.layout, self.bitmaps, self.coefs * signs(grades))
+
+    def adjoint(self):
+        """ Reversion """
+        return self._scale_by_grade(lambda grades: np.power(-1.0, grades*(grades - 1)//2))
 
-        return ((self * other) + (other * self)) / 2
+    __invert__ = adjoint
 
     def gradeInvol(self):
-        """Returns the grade involution of the multivector.
-         *                    i
-        M  = Sum[i, dims, (-1)  <M>  ]
-                                   i
-        gradeInvol() --> MultiVector
-        """
+        """ Grade involution """
+        return self._scale_by_grade(lambda grades: np.power(-1.0, grades))
 
-        signs = np.power(-1, self.layout.gradeList)
+    def conjugate(self):
+        """ Clifford conjugate """
+        return self._scale_by_grade(lambda grades: np.power(-1.0, grades*(grades + 1)//2))
 
-        newValue = signs * self.value
+    def __call__(self, grade, *grades):
+        """ Projection onto one or more grades """
+        keep = np.isin(self._grade_array(), (grade,) + grades)
+        return self._from_terms(self.layout, self.bitmaps[keep], self.coefs[keep])
 
-        return self._newMV(newValue)
+    def grades(self):
+        """ The sorted grades with coefficients larger than eps """
+        return sorted(set(self._grade_array()[np.abs(self.coefs) > _eps].tolist()))
 
-    @property
-    def even(self):
-        '''
-        Even part of this mulivector
+    def __float__(self):
+        if self.grades() not in ([], [0]):
+            raise ValueError("non-scalar coefficients are non-zero")
+        if len(self.bitmaps) and self.bitmaps[0] == 0:
+            return float(self.coefs[0])
+        return 0.0
 
-        defined as
-        M + M.gradInvol()
-        '''
-        return .5*(self + self.gradeInvol())
+    def mag2(self):
+        """ The scalar part of ~M * M """
+        return float((~self * self)(0))
 
-    @property
-    def odd(self):
-        '''
-        Odd part of this mulivector
+    def __abs__(self):
+        return np.sqrt(abs(self.mag2()))
 
-        defined as
-        M +- M.gradInvol()
-        '''
-        return .5*(self - self.gradeInvol())
+    def normal(self):
+        """ The multivector divided by its magnitude """
+        return self / abs(self)
 
-    def conjugate(self):
-        """Returns the Clifford conjugate (reversion and grade involution).
-         *
-        M  --> (~M).gradeInvol()
-        conjugate() --> MultiVector
+    def inv(self):
         """
+        Inverse of a versor, ~M / (M * ~M). Raises ValueError if M * ~M is
+        not a non-zero scalar, as computing general inverses needs the full
+        algebra.
+        """
+        reverse = ~self
+        norm = self * reverse
+        scalar = float(norm(0))
+        if abs(scalar) < _eps or np.any(np.abs(norm(*range(1, self.layout.dims + 1)).coefs) > _eps*abs(scalar)):
+            raise ValueError("multivector is not an invertible versor")
+        return reverse / scalar
 
-        return (~self).gradeInvol()
 
-    # Subspace operations
-    def project(self, other):
-        """Projects the multivector onto the subspace represented by this blade.
-                            -1
-        P (M) = (M _| A) * A
-         A
-        project(M) --> MultiVector
-        """
+class LazyMV(object):
+    """An unevaluated expression of multivectors of a layout
 
-        other, mv = self._checkOther(other, coerce=1)
+    Returned by MultiVector.lazy. The operators of a LazyMV record the
+    operation instead of evaluating it, taking MultiVectors and scalars as
+    inputs of the expression, and eval evaluates the whole expression at
+    once:
 
-        if not self.isBlade():
-            raise ValueError("self is not a blade")
+    >>> (R.lazy()*X*~R).normal().eval()
 
-        return other.lc(self) * self.inv()
+    eval merges the subexpressions that are equal, finds the grades of
+    every subexpression from the grades of the inputs, and evaluates the
+    coefficients the result depends on with a single kernel generated by
+    generate_expression_source, without making any intermediate
+    MultiVector. The kernels are kept on the layout by the shape of the
+    expression and the grades of the inputs, and written to the on-disk
+    cache like the unrolled products, so evaluating an expression of the
+    same shape again only has to walk it.
 
-    def basis(self):
-        """Finds a vector basis of this subspace.
+    Parameters
+    -------------
+    layout: instance of `clifford.Layout`
+        the layout of the algebra
 
-        basis() --> [ MultiVector, MultiVector, ... ]
-        """
+    op : str
+        the operation, 'input' for a MultiVector
 
-        gr = self.grades()
+    args : tuple of LazyMV
+        the operands
 
-        if len(gr) != 1:
-            # FIXME: this is not a sufficient condition for a blade.
-            raise ValueError("self is not a blade")
+    param :
+        the MultiVector of an input, the sign of the second operand of a
+        sum, or the bitmask of the grades of a projection
+    """
 
-        selfInv = self.inv()
+    __slots__ = ('layout', 'op', 'args', 'param', '_shape')
 
-        selfInv.clean()
+    # Keep numpy from treating an expression as a sequence in mixed arithmetic
+    __array_ufunc__ = None
 
-        wholeBasis = []  # vector basis of the whole space
+    def __init__(self, layout, op, args=(), param=None):
+        self.layout = layout
+        self.op = op
+        self.args = args
+        self.param = param
+        self._shape = None
 
-        for i in range(self.layout.gaDims):
-            if self.layout.gradeList[i] == 1:
-                v = np.zeros((self.layout.gaDims,), dtype=float)
-                v[i] = 1.
-                wholeBasis.append(self._newMV(v))
+    def __repr__(self):
+        return "LazyMV(%r, %r)" % (self.layout, self.op)
 
-        thisBasis = []  # vector basis of this subspace
+    def lazy(self):
+        return self
 
-        J, mv = self._checkOther(1.)  # outer product of all of the vectors up
-        # to the point of iteration
+    def _linearize(self):
+        """
+        Returns the distinct subexpressions in evaluation order and the
+        MultiVectors of the inputs.
 
-        for ei in wholeBasis:
-            Pei = ei.lc(self) * selfInv
+        Each subexpression is (op, args, param), with args the positions of
+        the operands. For inputs args is the number of the input. The
+        expression itself comes last. The tuple identifies the shape of the
+        expression.
+        """
+        positions = {}
+        keys = {}
+        nodes = []
+        numbers = {}
+        inputs = []
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in positions:
+                continue
+            if node.op == 'input':
+                mv = node.param
+                number = numbers.get(id(mv))
+                if number is None:
+                    number = numbers[id(mv)] = len(inputs)
+                    inputs.append(mv)
+                key = ('input', number, None)
+            elif not expanded:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in node.args)
+                continue
+            else:
+                key = (node.op, tuple(positions[id(arg)] for arg in node.args), node.param)
+            position = keys.get(key)
+            if position is None:
+                position = keys[key] = len(nodes)
+                nodes.append(key)
+            positions[id(node)] = position
+        return tuple(nodes), inputs
+
+    def eval(self):
+        """ Evaluates the expression, returning a MultiVector """
+        if self._shape is None:
+            self._shape = self._linearize()
+        nodes, inputs = self._shape
+        # The kernel depends on the grades the inputs have now
+        masks = tuple([mv._grade_mask() for mv in inputs])
+        kernel, grades = self.layout._get_expression_kernel(nodes, masks)
+        values = [np.asarray(mv._value, dtype=np.float64) for mv in inputs]
+        result = MultiVector._from_value(self.layout, kernel(*values))
+        result._set_grades(grades)
+        return result
+
+    # arithmetic
+
+    def _operand(self, other):
+        """ Returns other as a LazyMV, or NotImplemented """
+        if isinstance(other, (LazyMV, MultiVector)):
+            if other.layout is not self.layout and other.layout != self.layout:
+                raise ValueError(
+                    "cannot operate on MultiVectors with different Layouts")
+            return other.lazy()
+        if isinstance(other, numbers.Number):
+            return (self.layout.scalar*other).lazy()
+        return NotImplemented
 
-            J.clean()
+    def _binary(self, op, a, b, param=None):
+        a = self._operand(a)
+        b = self._operand(b)
+        if a is NotImplemented or b is NotImplemented:
+            return NotImplemented
+        return LazyMV(self.layout, op, (a, b), param)
 
-            J2 = J ^ Pei
+    def __mul__(self, other):
+        """ Geometric product """
+        return self._binary('gmt', self, other)
 
-            if J2 != 0:
-                J = J2
-                thisBasis.append(Pei)
-                if len(thisBasis) == gr[0]:  # we have a complete set
-                    break
+    def __rmul__(self, other):
+        return self._binary('gmt', other, self)
 
-        return thisBasis
+    def __xor__(self, other):
+        """ Outer product """
+        return self._binary('omt', self, other)
 
-    def join(self, other):
-        """Returns the join of two blades.
-              .
-        J = A ^ B
-        join(other) --> MultiVector
-        """
+    def __rxor__(self, other):
+        return self._binary('omt', other, self)
 
-        other, mv = self._checkOther(other)
+    def __or__(self, other):
+        """ Inner product """
+        return self._binary('imt', self, other)
 
-        grSelf = self.grades()
-        grOther = other.grades()
+    def __ror__(self, other):
+        return self._binary('imt', other, self)
 
-        if len(grSelf) == len(grOther) == 1:
-            # both blades
+    def lc(self, other):
+        """ Left contraction """
+        return self._binary('lcmt', self, other)
 
-            # try the outer product first
-            J = self ^ other
+    def __add__(self, other):
+        return self._binary('add', self, other, 1)
 
-            if J != 0:
-                return J.normal()
+    def __radd__(self, other):
+        return self._binary('add', other, self, 1)
 
-            # try something else
-            M = (other * self.invPS()).lc(self)
+    def __sub__(self, other):
+        return self._binary('add', self, other, -1)
 
-            if M != 0:
-                C = M.normal()
-                J = (self * C.rightInv()) ^ other
-                return J.normal()
+    def __rsub__(self, other):
+        return self._binary('add', other, self, -1)
 
-            if grSelf[0] >= grOther[0]:
-                A = self
-                B = other
-            else:
-                A = other
-                B = self
+    def __truediv__(self, other):
+        """ Division by a scalar, or multiplication by the inverse of a MultiVector """
+        if isinstance(other, numbers.Number):
+            return self*(1.0/other)
+        if isinstance(other, MultiVector):
+            return self*other.inv()
+        return NotImplemented
 
-            if (A * B) == (A | B):
-                # B is a subspace of A or the same if grades are equal
-                return A.normal()
+    if sys.version_info[0] < 3:
+        __div__ = __truediv__
 
-            # ugly, but general way
-            # watch out for residues
+    def __neg__(self):
+        return LazyMV(self.layout, 'negate', (self,))
 
-            # A is still the larger-dimensional subspace
+    def __pos__(self):
+        return self
 
-            Bbasis = B.basis()
+    def adjoint(self):
+        """ Reversion """
+        return LazyMV(self.layout, 'reverse', (self,))
 
-            # add the basis vectors of B one by one to the larger
-            # subspace except for the ones that make the outer
-            # product vanish
+    __invert__ = adjoint
 
-            J = A
+    def gradeInvol(self):
+        """ Grade involution """
+        return LazyMV(self.layout, 'involute', (self,))
 
-            for ei in Bbasis:
-                J.clean()
-                J2 = J ^ ei
+    def conjugate(self):
+        """ Clifford conjugate """
+        return LazyMV(self.layout, 'conjugate', (self,))
 
-                if J2 != 0:
-                    J = J2
+    def __call__(self, grade, *grades):
+        """ Projection onto one or more grades """
+        return LazyMV(self.layout, 'project', (self,), self.layout._grades_bitmask((grade,) + grades))
 
-            # for consistency's sake, we'll normalize the join
-            J = J.normal()
+    def normal(self):
+        """ The expression divided by sqrt(abs(<~X X>)), as MultiVector.normal """
+        return LazyMV(self.layout, 'normal', (self,))
 
-            return J
 
-        else:
-            raise ValueError("not blades")
+# Multivector containers that MultiVector leaves mixed arithmetic to, or
+# that must be converted explicitly before being combined with it
+_foreign_mv_types = (MVBatch, LazyMV, PackedMV, BitmapMV)
 
-    def meet(self, other, subspace=None):
-        """Returns the meet of two blades.
 
-        Computation is done with respect to a subspace that defaults to
-        the join if none is given.
-                     -1
-        M \/i N = (Mi  ) * N
-        meet(other, subspace=None) --> MultiVector
-        """
+class TracedFunction(object):
+    """A function of multivectors compiled to kernels over their coefficients
 
-        other, mv = self._checkOther(other)
+    Made by trace_mv, which calls the function once with the arguments as
+    LazyMV expressions. The expression it returns is compiled as by
+    LazyMV.eval, with the MultiVectors it refers to other than the
+    arguments, such as constants, built into the kernels.
 
-        r = self.grades()
-        s = other.grades()
+    Attributes
+    -----------
+    val_func : jitted function of the coefficient arrays of the arguments,
+        returning the coefficients of the result. It can be called from
+        other jitted functions.
+    batch_func : function of arrays of coefficients of shape
+        (..., gaDims), whose leading dimensions broadcast as for MVBatch,
+        returning the array of the results. The rows are split between
+        numba's threads.
+    grades : the bitmask of the grades of the result
 
-        if len(r) > 1 or len(s) > 1:
-            raise ValueError("not blades")
+    Notes
+    ------
+    The kernels assume that each argument only has the grades it was
+    traced with, and ignore its other coefficients. Calling a
+    TracedFunction with MultiVectors, or MVBatches, returns a MultiVector,
+    or MVBatch.
+    """
 
-        if subspace is None:
-            subspace = self.join(other)
+    def __init__(self, func, layout, grades=None):
+        self.func = func
+        self.layout = layout
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        n_args = func.__code__.co_argcount
+        if grades is None:
+            grades = [None]*n_args
+        if len(grades) != n_args:
+            raise ValueError("grades needs an entry for each of the %i arguments" % n_args)
+
+        # Trace the function with placeholders recording the grades of the arguments
+        arguments = []
+        for arg_grades in grades:
+            placeholder = MultiVector._from_value(layout, np.zeros(layout.gaDims))
+            if arg_grades is None:
+                placeholder._set_grades((1 << (layout.dims + 1)) - 1)
+            else:
+                placeholder._set_grades(layout._grades_bitmask(arg_grades))
+            arguments.append(placeholder)
+        result = func(*[arg.lazy() for arg in arguments])
+        if not isinstance(result, (LazyMV, MultiVector)):
+            raise TypeError("a traced function must return a multivector")
+        nodes, inputs = result.lazy()._linearize()
+        kernel, self.grades = layout._get_expression_kernel(
+            nodes, tuple([mv._grade_mask() for mv in inputs]))
+
+        # Each input of the kernel is an argument, or a constant
+        namespace = {'np': np, 'numba': numba, 'kernel': kernel}
+        kernel_args = []
+        row_args = []
+        for number, mv in enumerate(inputs):
+            position = next((i for i, arg in enumerate(arguments) if arg is mv), None)
+            if position is None:
+                namespace['c%i' % number] = np.asarray(mv.value, dtype=np.float64).copy()
+                kernel_args.append('c%i' % number)
+                row_args.append('c%i' % number)
+            else:
+                kernel_args.append('np.asarray(a%i, dtype=np.float64)' % position)
+                row_args.append('(r%i[0] if r%i.shape[0] == 1 else r%i[row])' % (position, position, position))
+        args = ', '.join('a%i' % i for i in range(n_args))
+        rows = ', '.join('r%i' % i for i in range(n_args))
+        source = '\n'.join([
+            'def val_func(%s):' % args,
+            '    return kernel(%s)' % ', '.join(kernel_args),
+            '',
+            '',
+            'def batch_kernel(n_rows%s):' % ''.join(', r%i' % i for i in range(n_args)),
+            '    output = np.empty((n_rows, %i))' % layout.gaDims,
+            '    for row in numba.prange(n_rows):',
+            '        output[row, :] = kernel(%s)' % ', '.join(row_args),
+            '    return output',
+        ]) + '\n'
+        exec(source, namespace)
+        namespace['val_func'].__doc__ = func.__doc__
+        self.val_func = numba.njit(nogil=True)(namespace['val_func'])
+        self._batch_kernel = numba.njit(parallel=True, nogil=True)(namespace['batch_kernel'])
+        self._n_args = n_args
+
+    def batch_func(self, *values):
+        """ Evaluates the function for arrays of coefficients of shape (..., gaDims) """
+        n_dims = self.layout.gaDims
+        values = [np.asarray(value, dtype=np.float64) for value in values]
+        if len(values) != self._n_args:
+            raise TypeError("%s takes %i arguments" % (self.__name__, self._n_args))
+        if not values:
+            return self.val_func()
+        shape = np.broadcast(*[value[..., 0] for value in values]).shape
+        rows = [_as_rows(value, shape, n_dims) for value in values]
+        output = self._batch_kernel(int(np.prod(shape)), *rows)
+        return output.reshape(shape + (n_dims,))
+
+    def __call__(self, *args):
+        for arg in args:
+            if arg.layout is not self.layout and arg.layout != self.layout:
+                raise ValueError(
+                    "cannot operate on MultiVectors with different Layouts")
+        if any(isinstance(arg, MVBatch) for arg in args):
+            return MVBatch(self.layout, self.batch_func(*[arg.value for arg in args]))
+        result = MultiVector._from_value(self.layout, self.val_func(*[arg.value for arg in args]))
+        result._set_grades(self.grades)
+        return result
 
-        return (self * subspace.inv()) | other
+    def __repr__(self):
+        return "TracedFunction(%s)" % self.__name__
 
 
-class MVArray(np.ndarray):
-    '''
-    MultiVector Array
-    '''
+def trace_mv(layout, grades=None):
+    """
+    Returns a decorator that compiles a function of multivectors of layout,
+    written with the MultiVector operators, into a TracedFunction.
 
-    def __new__(cls, input_array):
-        obj = np.empty(len(input_array), dtype=object)
-        obj[:] = input_array
-        obj = obj.view(cls)
-        return obj
+    grades has an entry for each argument, a grade or a sequence of the
+    grades it can have, or None for any grade. Knowing the grades lets the
+    kernels skip the terms that are structurally zero.
 
-    def __array_finalize__(self, obj):
-        if obj is None:
-            return
+    >>> @trace_mv(layout, grades=[[0, 2, 4], 1])
+    ... def apply_rotor(R, X):
+    ...     return R*X*~R
+    >>> apply_rotor.val_func(R.value, X.value)
+    """
+    def decorator(func):
+        return TracedFunction(func, layout, grades)
+    return decorator
 
 
 class Frame(MVArray):
@@ -1985,12 +5540,15 @@ def Cl(p=0, q=0, sig=None, names=None, firstIdx=1, mvClass=MultiVector):
     negative.
 
     Cl(p, q=0, names=None, firstIdx=0) --> Layout, {'name': basisElement, ...}
+
+    Repeated calls with the same arguments return the same Layout object,
+    see Layout.interned.
     """
     if sig is None:
         sig = [+1]*p + [-1]*q
     bladeTupList = elements(len(sig), firstIdx)
 
-    layout = Layout(sig, bladeTupList, firstIdx=firstIdx, names=names)
+    layout = Layout.interned(sig, bladeTupList, firstIdx=firstIdx, names=names)
     blades = bases(layout, mvClass)
 
     return layout, blades
@@ -2270,13 +5828,3 @@ def conformalize(layout, added_sig=[1,-1]):
         'up': up, 'down': down, 'homo': homo,'I_base':I_base})
 
     return layout_c, blades_c, stuff
-
-
-## TODO: fix caching to work
-## generate pre-defined algebras and cache them
-
-#sigs = [(1,1,0),(2,0,0),(3,1,0),(3,0,0),(3,2,0),(4,0,0)]
-#current_module = sys.modules[__name__]
-#caching.build_or_read_cache_and_attach_submods(current_module,sigs=sigs)
-
-
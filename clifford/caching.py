@@ -1,112 +1,297 @@
 """
-caching  
+caching
 
-generates and caches algebras to a temp dir using pickle
-"""
+Caches the multiplication tables of layouts on disk, so that algebras which
+are expensive to construct only have to be built once per machine.
+
+Each layout is stored in its own directory, named by a hash of its
+signature, blade ordering, firstIdx and the library version, with one
+sub-directory per product table. The tables are written as .npy files
+which are memory-mapped when they are read back, and are only read when
+the layout first needs them. Each table is first written to a temporary
+directory and then renamed into place, so parallel worker processes can
+safely share the same cache.
 
-# delayed import to solve circularity
-# from . import Cl
+Generated kernel modules are stored under the kernels sub-directory, named
+by a hash of their source, so that numba can cache their compiled code.
+
+The cache lives in a per-user directory, clifford under $XDG_CACHE_HOME
+or ~/.cache, created with mode 0o700. Its location can be set with the
+CLIFFORD_CACHE_DIR environment variable, and setting it to an empty string
+disables the cache. The cache is only used if its directory is owned by
+the current user and cannot be written to by others. Cached tables and
+generated modules must pass the same check, and generated modules must
+also match their source, or they are written again.
+"""
 
-import pickle
+import hashlib
+import json
 import os
-from os.path import join
-from types import ModuleType
+import shutil
+import stat
+import sys
 import tempfile
+from os.path import join
 
-def get_temp_dir():
-    return join(tempfile.gettempdir(),'clifford/')
-
-def clear_cache():
-    tmp_dir = get_temp_dir()
-    filelist = [ f for f in os.listdir(tmp_dir) ]
-    for f in filelist:
-        os.remove(os.path.join(tmp_dir, f))
-    
-def generate_all_layout_combos(p_max=3, q_max=3, r_max=0,**kw):
-    from . import Cl # delayed import 
-    layouts = {}
-
-    for p in range(p_max+1):
-        for q in range(q_max+1):
-            for r in range(r_max+1):
-                if p+q<=1:
-                    continue
-
-                key = 'g%i%i%i'%(p,q,r)
-                layouts[key],blades = Cl(p=p, q=q, **kw)
-    return layouts 
-    
-def sigs_2_layouts(sigs):
-    from . import Cl # delayed import 
-    layouts ={}
-    for p,q,r in sigs:
-        layouts['g%i%i%i'%(p,q,r)] = Cl(p=p,q=q)[0]
-    return layouts
-    
-def write_layouts(layouts, tmp_dir=None):
-    if tmp_dir is None:
-        tmp_dir = get_temp_dir()
-    
-    try:
-        os.mkdir(tmp_dir)
-    except(FileExistsError):
-        pass
-    
-    for key in layouts:
-        with open(join(tmp_dir, key+'.p'),'wb') as f:
-            pickle.dump(layouts[key],f)
-            print('caching %s'%key)
-            
-def read_layouts(tmp_dir=None):            
-    if tmp_dir is None:
-        tmp_dir = get_temp_dir()
-    
-    layouts = {}
-    for fname in os.listdir(tmp_dir):
-        
-        with open(join(tmp_dir, fname),'rb') as f:
-            key = os.path.splitext(fname)[0]
-            layouts[key] = pickle.load(f)
-           
-    return layouts 
-
-def generate_layout_submodules(layouts):
-    #TODO: putting the whole cache into memory is dumb. need dynamic loading.
-    submods = {}
-    for key in layouts:
-        # create layout submodule
-        this_layout = layouts[key]
-        mod = ModuleType(key)
-        mod.__dict__.update({'layout':this_layout,
-                            'blades':this_layout.blades})
-        mod.__dict__.update(this_layout.blades)
-        submods[key]=mod
-    return submods
-    
-def build_or_read_cache_and_attach_submods(clif_mod,sigs=None):
-    tmp_dir = get_temp_dir()
-    cache_exists=False
+import numpy as np
+
+# Bumped whenever the layout of the files in a cache entry changes
+CACHE_FORMAT_VERSION = 2
+
+# Layouts with fewer vectors than this are cheaper to build than to read
+MIN_CACHED_DIMS = 6
+
+TABLE_NAMES = ('gmt', 'imt', 'omt', 'lcmt')
+ARRAY_NAMES = ('k_list', 'l_list', 'm_list', 'mult_table_vals')
+_metadata_file = 'layout.json'
+
+
+def get_cache_dir():
+    """ Returns the cache directory, or None if caching is disabled """
+    cache_dir = os.environ.get('CLIFFORD_CACHE_DIR')
+    if cache_dir is None:
+        base = os.environ.get('XDG_CACHE_HOME')
+        if not base:
+            home = os.path.expanduser('~')
+            if home == '~':
+                # No home directory to keep a private cache in
+                return None
+            base = join(home, '.cache')
+        return join(base, 'clifford')
+    if cache_dir == '':
+        return None
+    return cache_dir
+
+
+def _is_private(path, kind=stat.S_ISDIR):
+    """
+    Returns whether path, which kind tells the type of, is owned by the
+    current user and cannot be written to by other users
+    """
     try:
-        if len(os.listdir(tmp_dir))>0:
-            cache_exists=True # cache exists
-        else:
-            pass # cache dir is empty
-    except(FileNotFoundError):
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not kind(st.st_mode):
+        return False
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _private_dir(path):
+    """
+    Creates the directory path with mode 0o700 if it does not exist, and
+    returns whether it is private to the current user
+    """
+    if not os.path.lexists(path):
         try:
-            os.mkdir(tmp_dir)
-        except(FileExistsError):
+            os.makedirs(path, 0o700)
+        except OSError:
             pass
-    
-    if cache_exists is False:
-        if sigs is None:
-            layouts = generate_all_layout_combos() 
+    return _is_private(path)
+
+
+def clear_cache(cache_dir=None):
+    """ Removes every cached layout """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return
+    for f in os.listdir(cache_dir):
+        path = join(cache_dir, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
         else:
-            layouts = sigs_2_layouts(sigs)
-        write_layouts(layouts)
+            os.remove(path)
+
+
+def layout_key(sig, bladeTupList, firstIdx):
+    """
+    Returns the key identifying the tables of a layout, which depend on the
+    signature, the blade ordering, firstIdx and the library version
+    """
+    from . import __version__  # delayed import
+    description = json.dumps({
+        'sig': [int(s) for s in sig],
+        'bladeTupList': [list(b) for b in bladeTupList],
+        'firstIdx': int(firstIdx),
+        'version': __version__,
+        'format': CACHE_FORMAT_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def _entry_dir(key, cache_dir):
+    return join(cache_dir, key)
+
+
+def read_table(key, table, cache_dir=None, mmap_mode='c'):
+    """
+    Reads one cached table of the layout identified by key.
 
-    # submods should be attached as requested, or all at once. 
-    layouts = read_layouts()
-    submods = generate_layout_submodules(layouts)
+    Returns a dictionary of the table arrays, or None if there is no usable
+    cache entry. The arrays are memory mapped with mmap_mode, which defaults
+    to copy-on-write.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None or not _is_private(cache_dir):
+        return None
+    entry = _entry_dir(key, cache_dir)
+    if not _is_private(entry):
+        return None
+    return _load_table_dir(join(entry, table), mmap_mode)
 
-    # attach all algebra instances to clifford ,
-    clif_mod.__dict__.update(submods)
+
+def _load_table_dir(table_dir, mmap_mode='c'):
+    # Entries that other users could have written are skipped
+    if not _is_private(table_dir):
+        return None
+    files = [_metadata_file] + [name + '.npy' for name in ARRAY_NAMES]
+    if not all(_is_private(join(table_dir, f), stat.S_ISREG) for f in files):
+        return None
+    try:
+        return {name: np.load(join(table_dir, name + '.npy'), mmap_mode=mmap_mode)
+                for name in ARRAY_NAMES}
+    except (IOError, OSError, ValueError):
+        # A damaged entry is treated as a cache miss
+        return None
+
+
+def write_table(key, table, sparse_table, cache_dir=None):
+    """
+    Writes sparse_table, a SparseMultTable, to the cache entry of the table
+    named table of the layout identified by key.
+
+    The table is written to a temporary directory and then renamed into
+    place. If another process wins the race, its entry is kept. A damaged
+    entry, which read_table treats as a miss, is moved aside and replaced.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return
+    entry = _entry_dir(key, cache_dir)
+    table_dir = join(entry, table)
+    if not (_private_dir(cache_dir) and _private_dir(entry)):
+        # Read-only or shared cache location, just skip caching
+        return
+    if os.path.isdir(table_dir) and _load_table_dir(table_dir) is not None:
+        return
+    try:
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp_' + table, dir=entry)
+    except OSError:
+        return
+    try:
+        for name in ARRAY_NAMES:
+            np.save(join(tmp_dir, name + '.npy'), getattr(sparse_table, name))
+        # The metadata file is written last and marks the table as complete
+        with open(join(tmp_dir, _metadata_file), 'w') as f:
+            json.dump({'key': key, 'table': table, 'format': CACHE_FORMAT_VERSION}, f)
+        # Whatever the umask, only the current user may write the files
+        for f in os.listdir(tmp_dir):
+            os.chmod(join(tmp_dir, f), 0o600)
+        if os.path.isdir(table_dir):
+            _discard_table_dir(table_dir, entry, table)
+        os.rename(tmp_dir, table_dir)
+    except OSError:
+        # Either the table already exists or the write failed
+        pass
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _discard_table_dir(table_dir, entry, table):
+    """
+    Moves the damaged table directory aside and deletes it. Renaming it
+    first leaves the name free for the new table, so concurrent readers see
+    either the damaged entry, which they treat as a miss, or the new one.
+    """
+    old_dir = tempfile.mkdtemp(prefix='.old_' + table, dir=entry)
+    try:
+        # Renaming onto the new empty directory replaces it
+        os.rename(table_dir, old_dir)
+    except OSError:
+        # Another process has already moved it
+        pass
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def source_key(source):
+    """ Returns the key identifying a generated source file """
+    from . import __version__  # delayed import
+    description = '%s\n%i\n%s' % (__version__, CACHE_FORMAT_VERSION, source)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def _is_generated_module(path, source):
+    """
+    Returns whether path is a private file of the current user holding
+    exactly source, so that it is safe to import
+    """
+    if not _is_private(path, stat.S_ISREG):
+        return False
+    try:
+        with open(path) as f:
+            return f.read() == source
+    except (IOError, OSError, UnicodeDecodeError):
+        return False
+
+
+def load_generated_module(source, cache_dir=None):
+    """
+    Writes the generated python source to the kernels directory of the
+    cache, unless it is already there, and imports it.
+
+    Returns the module, or None if caching is disabled or the cache location
+    cannot be written to or is not private to the current user. An existing
+    file is only imported if it is private too and holds exactly source,
+    otherwise it is written again.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    module_name = 'clifford_generated_' + source_key(source)
+    kernel_dir = join(cache_dir, 'kernels')
+    path = join(kernel_dir, module_name + '.py')
+    module = sys.modules.get(module_name)
+    if module is not None and module.__file__ == path:
+        return module
+
+    if not (_private_dir(cache_dir) and _private_dir(kernel_dir)):
+        return None
+    if not _is_generated_module(path, source):
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.py', dir=kernel_dir)
+        except OSError:
+            return None
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(source)
+            # Renaming over an identical file written by another process is
+            # harmless, and replaces a file that failed the checks
+            os.rename(tmp_path, path)
+        except OSError:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            if not _is_generated_module(path, source):
+                return None
+
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        return None
+    spec = spec_from_file_location(module_name, path)
+    module = module_from_spec(spec)
+    # numba records the module of the kernels it caches by name, so it must
+    # be importable while the kernels are compiled
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
@@ -58,7 +58,7 @@ Meta-Class
 '''
 
 from functools import reduce
-from . import conformalize, op,gp, MultiVector,Cl
+from . import conformalize, op,gp, MultiVector,MVBatch,Cl
 from numpy import zeros,e,log
 from numpy.random import rand
 import math
@@ -70,15 +70,27 @@ class CGAThing(object):
     
     maps versor product to `__call__`. 
     '''
+    def _sandwich_matrix(self):
+        # The matrix of X -> mv*X*~mv, kept until mv is replaced
+        cached = self.__dict__.get('_sandwich')
+        if cached is None or cached[0] is not self.mv:
+            cached = (self.mv, self.mv.layout.sandwich_matrix(self.mv.value))
+            self._sandwich = cached
+        return cached[1]
+
     def __call__(self, other):
+        layout = self.mv.layout
+        if isinstance(other, MVBatch):
+            # every multivector of the batch is transformed by one matrix product
+            return MVBatch(layout, layout.apply_matrix(self._sandwich_matrix(), other.value))
         if isinstance(other, MultiVector):
             if other.grades() ==[1]:
-                null= self.cga.null_vector(other)
-                return self.mv*null*~self.mv
-            return self.mv*other*~self.mv
+                other = self.cga.null_vector(other)
+            return layout.MultiVector(value=self._sandwich_matrix().dot(other.value))
         else:
             klass = other.__class__
-            return klass(self.cga, self.mv*other.mv*~self.mv)
+            value = self._sandwich_matrix().dot(other.mv.value)
+            return klass(self.cga, layout.MultiVector(value=value))
     
     def inverted(self):
         '''
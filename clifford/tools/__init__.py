@@ -400,6 +400,8 @@ def orthoMat2Verser(A, eps=None, layout=None, is_complex=None):
     orthonormal frame by an orthogonal transform. Given this relation,
     this function will find the verser which enacts this transform.
 
+    To apply a real linear map, orthogonal or not, to multivectors without
+    finding a verser, use the matrix from `Layout.outermorphism_matrix`.
 
     Parameters
     ------------
@@ -454,13 +456,6 @@ def sinc(x):
 
 def log_rotor(V):
     '''
-    Logarithm of a simple rotor
+    Logarithm of a rotor, the bivector part of V.log()
     '''
-    if (V(2)**2).grades() !=[0]:
-        print(V)
-        #raise ValueError('Bivector is not a Blade.')
-    if abs(V(2))<global_eps():
-        return log(float(V(0)))
-    # numpy's trig correctly chooses hyperbolic or not with Complex args
-    theta = arccos(complex(V(0)))
-    return V(2)/sinc(theta).real
+    return V.log()(2)
@@ -201,7 +201,7 @@ def rotor_vector_to_vector(v1, v2):
         return generate_rotation_rotor(theta, v1, v2)
     else:
         mv = cf.MultiVector(layout)
-        mv.value[0] = 1.0
+        mv.mutable_value[0] = 1.0
         return mv
 
 
@@ -133,7 +133,6 @@ from clifford.tools.g3 import quaternion_to_rotor, random_euc_mv, \
     random_rotation_rotor, generate_rotation_rotor
 from clifford.g3c import *
 import clifford as cf
-from clifford import get_mult_function
 import warnings
 
 # Allow sytactic alternatives to the standard included in the clifford package
@@ -158,6 +157,7 @@ adjoint_func = layout.adjoint_func
 gmt_func = layout.gmt_func
 omt_func = layout.omt_func
 imt_func = layout.imt_func
+mag2_k_list, mag2_m_list, mag2_factors = layout._mag2_table
 
 
 def get_circle_in_euc(circle):
@@ -637,8 +637,7 @@ def rotor_between_objects(C1, C2):
         return (1 - cf.MultiVector(layout,gmt_func(C2.value, C1.value))).normal()
 
 
-sparse_line_gmt = get_mult_function(
-    layout.gmt, layout.gaDims, layout.gradeList, grades_a=[3], grades_b=[3])
+sparse_line_gmt = layout.get_grade_restricted_func('gmt', grades_a=[3], grades_b=[3])
 
 
 
@@ -646,7 +645,7 @@ sparse_line_gmt = get_mult_function(
 @numba.njit
 def val_norm(mv_val):
     """ Returns sqrt(abs(~A*A)) """
-    return np.sqrt(np.abs(gmt_func(adjoint_func(mv_val), mv_val)[0]))
+    return np.sqrt(np.abs(cf.scalar_part_kernel(mv_val, mv_val, mag2_k_list, mag2_m_list, mag2_factors)))
 
 
 def norm(mv):
@@ -826,32 +825,32 @@ def random_plane():
     return line_a
 
 
-@numba.njit
-def val_apply_rotor(mv_val, rotor_val):
-    """ Applies rotor to multivector in a fast way - JITTED """
-    return gmt_func(rotor_val, gmt_func(mv_val, adjoint_func(rotor_val)))
-
-
+@cf.trace_mv(layout, grades=[None, [0, 2, 4]])
 def apply_rotor(mv_in, rotor):
-    """ Applies rotor to multivector in a fast way """
-    return cf.MultiVector(layout, val_apply_rotor(mv_in.value, rotor.value))
+    """ Applies rotor to multivector in a fast way, the rotor being even """
+    return rotor*mv_in*~rotor
 
 
-@numba.njit
-def val_apply_rotor_inv(mv_val, rotor_val, rotor_val_inv):
-    """ Applies rotor to multivector in a fast way takes pre computed adjoint"""
-    return gmt_func(rotor_val, gmt_func(mv_val, rotor_val_inv))
+val_apply_rotor = apply_rotor.val_func
 
 
+@cf.trace_mv(layout, grades=[None, [0, 2, 4], [0, 2, 4]])
 def apply_rotor_inv(mv_in, rotor, rotor_inv):
-    """ Applies rotor to multivector in a fast way takes pre computed adjoint"""
-    return cf.MultiVector(layout, val_apply_rotor_inv(mv_in.value, rotor.value, rotor_inv.value))
+    """ Applies rotor to multivector in a fast way takes pre computed adjoint, the rotor being even """
+    return rotor*mv_in*rotor_inv
+
+
+val_apply_rotor_inv = apply_rotor_inv.val_func
+
+
+# The matrix of X -> X*ninf
+ninf_right_matrix = layout.right_mult_matrix(ninf_val)
 
 
 @numba.njit
 def mult_with_ninf(mv):
     """ Convenience function for multiplication with ninf """
-    return gmt_func(mv, ninf_val)
+    return np.dot(ninf_right_matrix, mv.astype(np.float64))
 
 
 #@numba.njit
@@ -894,9 +893,8 @@ def fast_up(mv):
 @numba.njit
 def val_normalInv(mv_val):
     """ A fast, jitted version of normalInv """
-    Madjoint_val = adjoint_func(mv_val)
-    MadjointM = gmt_func(Madjoint_val,mv_val)[0]
-    return Madjoint_val / MadjointM
+    MadjointM = cf.scalar_part_kernel(mv_val, mv_val, mag2_k_list, mag2_m_list, mag2_factors)
+    return adjoint_func(mv_val) / MadjointM
 
 
 @numba.njit
@@ -944,8 +942,10 @@ def distance_polar_line_to_euc_point_2d(rho, theta, x, y):
     return val_distance_point_to_line(point, line)
 
 
-dual_gmt_func = get_mult_function(layout.gmt, layout.gaDims, layout.gradeList, grades_a=[
-                                  5], grades_b=[0, 1, 2, 3, 4, 5])
+dual_gmt_func = layout.get_grade_restricted_func('gmt', grades_a=[5], grades_b=[0, 1, 2, 3, 4, 5])
+
+# The matrix of X -> I5*X, for arrays of values
+I5_left_matrix = layout.left_mult_matrix(I5_val)
 
 @numba.njit
 def dual_func(a_val):
@@ -962,6 +962,15 @@ def fast_dual(a):
     return cf.MultiVector(layout, dual_func(a.value))
 
 
+def _mv_values(mvs):
+    """
+    Returns the value of a MultiVector, or the stacked values of an array of them
+    """
+    if isinstance(mvs, cf.MultiVector):
+        return mvs.value
+    return np.array([mv.value for mv in mvs])
+
+
 class ConformalMVArray(cf.MVArray):
     """
     This class is for storing arrays of conformal multivectors
@@ -982,20 +991,29 @@ class ConformalMVArray(cf.MVArray):
         """
         Dualisation
         """
-        return v_dual(self)
+        return ConformalMVArray.from_value_array(layout.apply_matrix(I5_left_matrix, self.value))
 
     def apply_rotor(self, R):
         """
         Application of a rotor
         """
+        if isinstance(R, cf.MultiVector):
+            # A single rotor is applied to the rows in parallel
+            value = layout.apply_rotor_parallel(R.value, self.value)
+            return ConformalMVArray.from_value_array(value)
         R_inv = ~R
-        return v_apply_rotor_inv(self, R, R_inv)
+        return self.apply_rotor_inv(R, R_inv)
 
     def apply_rotor_inv(self, R, R_inv):
         """
         Application of a rotor with precomputed inverse
         """
-        return v_apply_rotor_inv(self, R, R_inv)
+        if isinstance(R, cf.MultiVector) and isinstance(R_inv, cf.MultiVector):
+            matrix = layout.sandwich_matrix(R.value, R_inv.value)
+            return ConformalMVArray.from_value_array(layout.apply_matrix(matrix, self.value))
+        value = layout.gmt_gufunc(_mv_values(R),
+                                  layout.gmt_gufunc(self.value, _mv_values(R_inv)))
+        return ConformalMVArray.from_value_array(value)
 
     @property
     def value(self):
@@ -85,9 +85,11 @@ def ga_log(R):
 
 
     WARNING: DOES NOT COMMUTE log(A * B) != log(A) + log(B)
+
+    This is the bivector part of R.log(), which unlike
+    extractRotorComponents also handles pure translations
     """
-    phiP, t_normal_n, t_perpendicular_n = extractRotorComponents(R)
-    return phiP + t_normal_n + t_perpendicular_n
+    return R.log()(2)
 
 
 @numba.njit
@@ -3,11 +3,18 @@ from __future__ import print_function, unicode_literals
 from past.builtins import range
 
 from clifford import Cl, randomMV, Frame, get_mult_function, conformalize, grade_obj
+from clifford import caching, bind_mult_kernel, dense_mult_kernel, sparse_mult_kernel
+from clifford import generate_mult_source, get_unrolled_mult_function
+from clifford import Layout, elements
 
+import numpy as np
 from numpy import exp, float64, testing
 import unittest
 import itertools
 import time
+import os
+import shutil
+import tempfile
 
 from nose.plugins.skip import SkipTest
 
@@ -15,7 +22,7 @@ from nose.plugins.skip import SkipTest
 class InitialisationSpeedTests(unittest.TestCase):
 
     def test_speed(self):
-        algebras = range(2,9)
+        algebras = range(2,11)
         print()  # So that the first number is on a new line
         for i in algebras:
             t_start = time.time()
@@ -23,6 +30,100 @@ class InitialisationSpeedTests(unittest.TestCase):
             t_end = time.time()
             print(i, t_end - t_start)
 
+    def test_tables_match_elementwise(self):
+        algebras = [Cl(3), Cl(2, 2), Cl(1, 3, firstIdx=0), conformalize(Cl(3)[0])]
+        for alg in algebras:
+            layout = alg[0]
+            for i, blade_a in enumerate(layout.bladeTupList):
+                for j, blade_b in enumerate(layout.bladeTupList):
+                    v, mul = layout._gmtElement(blade_a, blade_b)
+                    self.assertEqual(layout.gmt[i, v, j], mul)
+
+    def test_lazy_tables(self):
+        layout = Cl(5)[0]
+        for name in ['gmt', 'imt', 'omt', 'lcmt', 'gmt_func', 'imt_func', 'omt_func', 'lcmt_func']:
+            self.assertNotIn(name, layout.__dict__)
+        a = layout.randomMV()
+        b = layout.randomMV()
+        a ^ b
+        self.assertIn('omt', layout.__dict__)
+        # Small algebras use the unrolled function in the operators
+        self.assertIs(layout._omt_kernel, layout.omt_func)
+        self.assertNotIn('imt', layout.__dict__)
+        self.assertNotIn('lcmt_func', layout.__dict__)
+
+    def test_sparse_table_dict_view(self):
+        layout = Cl(3)[0]
+        gmt_dict = dict(layout.gmt)
+        self.assertEqual(len(gmt_dict), layout.gaDims**2)
+        a = layout.randomMV()
+        b = layout.randomMV()
+        gp_from_dict = get_mult_function(gmt_dict, layout.gaDims, layout.gradeList)
+        testing.assert_almost_equal(gp_from_dict(a.value, b.value), (a*b).value)
+
+    def test_generic_kernels(self):
+        # The generic kernels are compiled once, for a single signature
+        self.assertEqual(len(dense_mult_kernel.signatures), 1)
+        self.assertEqual(len(sparse_mult_kernel.signatures), 1)
+        for layout in [Cl(3)[0], Cl(2, 2)[0], conformalize(Cl(3)[0])[0]]:
+            a = layout.randomMV()
+            b = layout.randomMV()
+            for table, func in [(layout.gmt, layout.gmt_func), (layout.omt, layout.omt_func),
+                                (layout.imt, layout.imt_func), (layout.lcmt, layout.lcmt_func)]:
+                bound = bind_mult_kernel(table, layout.gaDims)
+                testing.assert_almost_equal(bound(a.value, b.value), func(a.value, b.value))
+                # The zero tests only skip work
+                dense = get_mult_function(table, layout.gaDims, layout.gradeList, skip_zeros=False)
+                testing.assert_almost_equal(dense(a.value, b.value), func(a.value, b.value))
+                # The result can be written to an existing array
+                out = np.empty(layout.gaDims)
+                self.assertIs(func(a.value, b.value, out=out), out)
+                testing.assert_almost_equal(out, bound(a.value, b.value))
+                c = a.value.copy()
+                self.assertIs(bound(c, b.value, out=c), c)
+                testing.assert_almost_equal(c, out)
+            # Integer valued multivectors are accepted too
+            e1 = layout.blades['e1']
+            testing.assert_almost_equal((e1*e1).value, layout.scalar.value)
+
+    def test_unrolled_kernels(self):
+        layout = Cl(3)[0]
+        a = layout.randomMV()
+        b = layout.randomMV()
+        grades = np.array(layout.gradeList)
+        mask = np.isin(grades[layout.gmt.k_list], [0, 2]) & (grades[layout.gmt.m_list] == 1)
+        source = generate_mult_source(layout.gmt.filter(mask), layout.gaDims)
+        # Only the coefficients that can contribute are read
+        self.assertNotIn('a1 = a[1]', source)
+        self.assertNotIn('b0 = b[0]', source)
+        self.assertIn('if a0 != 0.0:', source)
+        dense_source = generate_mult_source(layout.gmt.filter(mask), layout.gaDims, skip_zeros=False)
+        self.assertNotIn('!= 0.0', dense_source)
+        dense = get_unrolled_mult_function(layout.gmt, layout.gaDims, filter_mask=mask, skip_zeros=False)
+        unrolled = get_unrolled_mult_function(layout.gmt, layout.gaDims, layout.gradeList,
+                                              grades_a=[0, 2], grades_b=[1])
+        table = get_mult_function(layout.gmt, layout.gaDims, layout.gradeList,
+                                  grades_a=[0, 2], grades_b=[1])
+        a = a(0) + a(2)
+        b = b(1)
+        testing.assert_almost_equal(unrolled(a.value, b.value), table(a.value, b.value))
+        testing.assert_almost_equal(unrolled(a.value, b.value), (a*b).value)
+        testing.assert_almost_equal(dense(a.value, b.value), (a*b).value)
+
+    def test_grade_restricted_funcs(self):
+        layout = Cl(3)[0]
+        a = layout.randomMV()(2)
+        b = layout.randomMV()(1)
+        func = layout.get_grade_restricted_func('gmt', grades_a=[2], grades_b=[1])
+        self.assertIs(layout.get_grade_restricted_func('gmt', grades_a=(2,), grades_b=[1, 1]), func)
+        testing.assert_almost_equal(func(a.value, b.value), (a*b).value)
+        # Only the requested output grades are computed
+        vector_part = layout.get_grade_restricted_func('gmt', grades_a=[2], grades_b=[1], grades_out=[1])
+        self.assertIsNot(vector_part, func)
+        testing.assert_almost_equal(vector_part(a.value, b.value), (a*b)(1).value)
+        with self.assertRaises(ValueError):
+            layout.get_grade_restricted_func('xmt')
+
     def test_sparse_multiply(self):
         algebras = [Cl(i) for i in [3, 4]] + [conformalize(Cl(3)[0])]
         # For all the algebras we are interested in
@@ -49,5 +150,142 @@ class InitialisationSpeedTests(unittest.TestCase):
                     print(j+i*len(grades_possibilities),len(grades_possibilities)**2)
 
 
+class LayoutCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get('CLIFFORD_CACHE_DIR')
+        os.environ['CLIFFORD_CACHE_DIR'] = self.cache_dir
+
+    def tearDown(self):
+        if self.old_cache_dir is None:
+            del os.environ['CLIFFORD_CACHE_DIR']
+        else:
+            os.environ['CLIFFORD_CACHE_DIR'] = self.old_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def new_layout(self, sig):
+        # Cl would return the interned layout, with its tables already built
+        return Layout(sig, elements(len(sig), 1), firstIdx=1)
+
+    def test_tables_round_trip(self):
+        layout = self.new_layout([1]*4 + [-1]*2)
+        # Tables are only built, and cached, when they are first used
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        for table in caching.TABLE_NAMES:
+            getattr(layout, table)
+        entry = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        self.assertEqual(sorted(os.listdir(entry)), sorted(caching.TABLE_NAMES))
+        cached_layout = self.new_layout([1]*4 + [-1]*2)
+        self.assertIsNot(cached_layout, layout)
+        for table in caching.TABLE_NAMES:
+            # The arrays are views of the memory-mapped files
+            self.assertIsInstance(getattr(cached_layout, table).k_list.base, np.memmap)
+            for name in caching.ARRAY_NAMES:
+                testing.assert_array_equal(getattr(getattr(layout, table), name),
+                                           getattr(getattr(cached_layout, table), name))
+        a = cached_layout.randomMV()
+        b = cached_layout.randomMV()
+        testing.assert_almost_equal(bind_mult_kernel(cached_layout.gmt, layout.gaDims)(a.value, b.value),
+                                    get_mult_function(layout.gmt, layout.gaDims, layout.gradeList)(a.value, b.value))
+
+    def test_key(self):
+        sig = [1]*6
+        blades = list(Cl(6)[0].bladeTupList)
+        key = caching.layout_key(sig, blades, 1)
+        self.assertEqual(key, caching.layout_key(sig, blades, 1))
+        self.assertNotEqual(key, caching.layout_key(sig, blades, 0))
+        self.assertNotEqual(key, caching.layout_key([1]*5 + [-1], blades, 1))
+        self.assertNotEqual(key, caching.layout_key(sig, blades[::-1], 1))
+
+    def test_damaged_entry_is_rebuilt(self):
+        layout = self.new_layout([1]*6)
+        layout.gmt
+        entry = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        os.remove(os.path.join(entry, 'gmt', 'k_list.npy'))
+        self.assertIsNone(caching.read_table(layout._cache_key, 'gmt'))
+        rebuilt_layout = self.new_layout([1]*6)
+        self.assertEqual(dict(layout.gmt), dict(rebuilt_layout.gmt))
+        # The damaged entry is replaced, so later layouts read it again
+        self.assertIsNotNone(caching.read_table(layout._cache_key, 'gmt'))
+        self.assertEqual(os.listdir(entry), ['gmt'])
+
+    def test_shared_entry_is_skipped(self):
+        layout = self.new_layout([1]*6)
+        layout.gmt
+        key = layout._cache_key
+        table_dir = os.path.join(self.cache_dir, key, 'gmt')
+        self.assertIsNotNone(caching.read_table(key, 'gmt'))
+        # Tables that others could have written are not used, and replaced
+        os.chmod(os.path.join(table_dir, 'm_list.npy'), 0o666)
+        self.assertIsNone(caching.read_table(key, 'gmt'))
+        self.new_layout([1]*6).gmt
+        self.assertIsNotNone(caching.read_table(key, 'gmt'))
+        os.chmod(os.path.join(self.cache_dir, key), 0o777)
+        self.assertIsNone(caching.read_table(key, 'gmt'))
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            # Entries owned by another user
+            os.chmod(os.path.join(self.cache_dir, key), 0o700)
+            os.chown(table_dir, os.getuid() + 1, -1)
+            self.assertIsNone(caching.read_table(key, 'gmt'))
+
+    def test_generated_kernels(self):
+        layout = Cl(3)[0]
+        mult = get_unrolled_mult_function(layout.gmt, layout.gaDims)
+        kernel_dir = os.path.join(self.cache_dir, 'kernels')
+        sources = [f for f in os.listdir(kernel_dir) if f.endswith('.py')]
+        self.assertEqual(len(sources), 1)
+        a = layout.randomMV()
+        b = layout.randomMV()
+        testing.assert_almost_equal(mult(a.value, b.value), (a*b).value)
+        # The generated module is reused
+        self.assertIs(get_unrolled_mult_function(layout.gmt, layout.gaDims), mult)
+
+    def test_generated_kernels_are_checked(self):
+        layout = Cl(3)[0]
+        source = generate_mult_source(layout.lcmt, layout.gaDims)
+        kernel_dir = os.path.join(self.cache_dir, 'kernels')
+        path = os.path.join(kernel_dir, 'clifford_generated_%s.py' % caching.source_key(source))
+        os.makedirs(kernel_dir, 0o700)
+        # A file that does not hold the source is replaced before importing it
+        with open(path, 'w') as f:
+            f.write('raise RuntimeError("planted")\n')
+        caching.load_generated_module(source)
+        with open(path) as f:
+            self.assertEqual(f.read(), source)
+        # As is one that others could write to
+        os.chmod(path, 0o666)
+        self.assertFalse(caching._is_generated_module(path, source))
+        os.chmod(path, 0o600)
+        self.assertTrue(caching._is_generated_module(path, source))
+        # A cache directory others can write to is not used
+        os.chmod(self.cache_dir, 0o777)
+        try:
+            self.assertIsNone(caching.load_generated_module(source + '\n'))
+        finally:
+            os.chmod(self.cache_dir, 0o700)
+
+    def test_default_cache_dir(self):
+        old_xdg = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.cache_dir, 'xdg')
+        del os.environ['CLIFFORD_CACHE_DIR']
+        try:
+            self.assertEqual(caching.get_cache_dir(), os.path.join(self.cache_dir, 'xdg', 'clifford'))
+        finally:
+            os.environ['CLIFFORD_CACHE_DIR'] = self.cache_dir
+            if old_xdg is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = old_xdg
+
+    def test_generated_kernels_without_cache(self):
+        os.environ['CLIFFORD_CACHE_DIR'] = ''
+        layout = Cl(3)[0]
+        mult = get_unrolled_mult_function(layout.omt, layout.gaDims)
+        a = layout.randomMV()
+        b = layout.randomMV()
+        testing.assert_almost_equal(mult(a.value, b.value), (a^b).value)
+
+
 if __name__ == '__main__':
     unittest.main()
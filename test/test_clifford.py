@@ -3,11 +3,15 @@ from __future__ import print_function, unicode_literals
 from past.builtins import range
 
 from clifford import Cl, randomMV, Frame, get_mult_function, conformalize, grade_obj
+from clifford import Layout, MVBatch, PackedMV, BitmapLayout, BitmapMV, LazyMV, PARALLEL_BATCH_SIZE
+from clifford import trace_mv
 
 
 import numpy as np
+import numba
 from numpy import exp, float64, testing
 import unittest
+import gc
 
 
 from nose.plugins.skip import SkipTest
@@ -138,6 +142,627 @@ class BasicAlgebraTests(unittest.TestCase):
                 mv = layout.randomMV()(i)
                 assert i == grade_obj(mv)
 
+
+class GradeOperationTests(unittest.TestCase):
+
+    def test_grade_operations(self):
+        # The second layout's blades are not ordered by grade
+        layouts = [conformalize(Cl(3)[0])[0],
+                   Layout([1, 1, 1], [(), (1, 2), (1,), (1, 2, 3), (2,), (1, 3), (3,), (2, 3)], firstIdx=1)]
+        for layout in layouts:
+            X = layout.randomMV()
+            grades = np.array(layout.gradeList)
+            reverse = X.value * (-1.0)**(grades*(grades - 1)//2)
+            for g in range(layout.dims + 1):
+                np.testing.assert_almost_equal(X(g).value, X.value*(grades == g))
+            np.testing.assert_almost_equal(X(1, 3).value, (X(1) + X(3)).value)
+            self.assertEqual((X(1) + X(3)).grades(), [1, 3])
+            self.assertEqual(X(2).grades(), [2])
+            self.assertTrue(X(0).isScalar())
+            self.assertFalse((X(0) + X(2)).isScalar())
+            np.testing.assert_almost_equal((~X).value, reverse)
+            np.testing.assert_almost_equal(X.gradeInvol().value, X.value * (-1.0)**grades)
+            np.testing.assert_almost_equal(X.conjugate().value, (~X).gradeInvol().value)
+            np.testing.assert_almost_equal(X.even.value, (X + X.gradeInvol()).value/2)
+            np.testing.assert_almost_equal((X.even + X.odd).value, X.value)
+            with self.assertRaises(ValueError):
+                X(layout.dims + 1)
+            with self.assertRaises(ValueError):
+                X(1.5)
+
+            batch = MVBatch.from_multivectors([X, X(2)])
+            np.testing.assert_almost_equal(batch.conjugate()[0].value, X.conjugate().value)
+            np.testing.assert_almost_equal(batch(0, 2)[0].value, X(0, 2).value)
+            self.assertEqual(batch(1, 2).grades(), [1, 2])
+
+
+class GradeDispatchTests(unittest.TestCase):
+
+    def test_grades_propagate(self):
+        layout = Cl(4)[0]
+        R = layout.randomMV()(0) + layout.randomMV()(2)
+        X = layout.randomMV()(1)
+        self.assertEqual(R._known_grades(), 0b101)
+        self.assertEqual((~R)._known_grades(), 0b101)
+        self.assertEqual((R*X)._known_grades(), 0b1010)
+        self.assertEqual((R*X*~R)._known_grades(), 0b1010)
+        self.assertEqual((X ^ X)._known_grades(), 0b100)
+        self.assertEqual((2*X + 1)._known_grades(), 0b11)
+        # Values built directly have their grades computed when needed
+        self.assertIsNone(layout.MultiVector(value=X.value)._known_grades())
+
+    def test_products_match_full_tables(self):
+        for layout in [Cl(3)[0], conformalize(Cl(3)[0])[0], Cl(7)[0]]:
+            R = sum(layout.randomMV()(g) for g in range(0, layout.dims + 1, 2))
+            X = layout.randomMV()(1)
+            A = R*X*~R
+            for product, table in [('__mul__', layout.gmt), ('__xor__', layout.omt),
+                                   ('__or__', layout.imt), ('lc', layout.lcmt)]:
+                mult = get_mult_function(table, layout.gaDims, layout.gradeList)
+                for a, b in [(R, X), (X, R), (A, R), (X, X)]:
+                    np.testing.assert_almost_equal(getattr(a, product)(b).value,
+                                                   mult(a.value, b.value))
+
+    def test_mutation(self):
+        layout = Cl(3)[0]
+        X = layout.randomMV()(1)
+        Y = X*1
+        Y[()] = 3
+        Y.value = Y.value + layout.randomMV()(2).value
+        np.testing.assert_almost_equal((Y*X).value, layout.gmt_func(Y.value, X.value))
+        # Writing to the value array in place
+        for layout in [Cl(4)[0], Cl(7)[0]]:
+            X = layout.randomMV()(1)
+            R = layout.randomMV()(0, 2)
+            Y = X*1
+            with self.assertRaises(ValueError):
+                Y.value[0] = 5.0
+            Y.mutable_value[0] = 5.0
+            np.testing.assert_almost_equal((Y*R).value, layout.gmt_func(Y.value, R.value))
+            Y = X*R
+            value = Y.mutable_value
+            Y *= R
+            value[0] = 5.0
+            np.testing.assert_almost_equal((Y*R).value, layout.gmt_func(value, R.value))
+            # Reading the value keeps the grades
+            Y = X*1
+            np.testing.assert_almost_equal(Y.value, X.value)
+            self.assertEqual(Y._known_grades(), 0b10)
+            Y.forget_grades()
+            self.assertIsNone(Y._known_grades())
+
+
+class InverseTests(unittest.TestCase):
+
+    def test_inverse_methods(self):
+        # Closed forms for up to 5 dimensions, the linear system otherwise
+        for layout in [Cl(2)[0], Cl(2, 1)[0], Cl(1, 3)[0], conformalize(Cl(3)[0])[0], Cl(3, 3)[0]]:
+            for i in range(5):
+                M = layout.randomMV()
+                M_inv = M.inv()
+                np.testing.assert_almost_equal((M_inv*M).value, layout.scalar.value)
+                np.testing.assert_almost_equal((M*M_inv).value, layout.scalar.value)
+                np.testing.assert_almost_equal(M_inv.value, M.leftLaInv().value)
+            V = layout.randomMV()(1)*layout.randomMV()(1)*layout.randomMV()(1)
+            np.testing.assert_almost_equal((V.inv()*V).value, layout.scalar.value)
+
+    def test_no_inverse(self):
+        layout, blades = Cl(3)
+        for M in [1 + blades['e1'], layout.MultiVector()]:
+            with self.assertRaises(ValueError):
+                M.inv()
+
+    def test_scaled_inverse(self):
+        # Whether a multivector has an inverse does not depend on its size
+        for layout in [Cl(3)[0], conformalize(Cl(3)[0])[0]]:
+            M = layout.randomMV()
+            for scale in [1e-3, 1e-6, 1e6]:
+                M_inv = (scale*M).inv()
+                np.testing.assert_almost_equal((M_inv*M).value, layout.scalar.value/scale)
+            V = 1e-4*layout.randomMV()(1)*layout.randomMV()(1)
+            np.testing.assert_almost_equal((V.inv()*V).value, layout.scalar.value)
+
+    def test_batch_inverse(self):
+        layout = conformalize(Cl(3)[0])[0]
+        mvs = [layout.randomMV() for i in range(4)]
+        batch = MVBatch.from_multivectors(mvs)
+        inverses = layout.inv_func(batch.value.reshape(2, 2, -1))
+        np.testing.assert_almost_equal(inverses[1, 0], mvs[2].inv().value)
+        np.testing.assert_almost_equal((batch/batch).value, np.tile(layout.scalar.value, (4, 1)))
+        np.testing.assert_almost_equal((mvs[0]/batch)[3].value, (mvs[0]/mvs[3]).value)
+
+
+class ExpTests(unittest.TestCase):
+
+    def test_closed_forms(self):
+        layout, blades = Cl(2, 1)
+        for B, s, c in [(0.3*blades['e12'], np.sin(0.3), np.cos(0.3)),
+                        (0.3*blades['e13'], np.sinh(0.3), np.cosh(0.3))]:
+            np.testing.assert_almost_equal(B.exp().value, (c + s*B/0.3).value)
+        N = blades['e1'] + blades['e3']  # squares to zero
+        np.testing.assert_almost_equal(N.exp().value, (1 + N).value)
+        np.testing.assert_almost_equal((2 + N).exp().value, (np.exp(2)*(1 + N)).value)
+        np.testing.assert_almost_equal(layout.MultiVector().exp().value, layout.scalar.value)
+
+    def test_general(self):
+        # Bivectors of conformal space are not simple in general
+        layout = conformalize(Cl(3)[0])[0]
+        for i in range(5):
+            B = 2*layout.randomMV()(2)
+            R = B.exp()
+            np.testing.assert_almost_equal((R*(-B).exp()).value, layout.scalar.value)
+            np.testing.assert_almost_equal((R*~R).value, layout.scalar.value)
+            np.testing.assert_almost_equal((np.e**B).value, R.value)
+            # exp(B) = exp(B/2)**2
+            np.testing.assert_almost_equal(((B/2).exp()**2).value, R.value)
+
+    def test_batch(self):
+        layout = conformalize(Cl(3)[0])[0]
+        bivectors = MVBatch.from_multivectors([layout.randomMV()(2) for i in range(4)])
+        rotors = bivectors.exp()
+        for i in range(4):
+            np.testing.assert_almost_equal(rotors[i].value, bivectors[i].exp().value)
+
+
+class LogTests(unittest.TestCase):
+
+    def test_closed_forms(self):
+        layout, blades = Cl(2, 1)
+        for B in [0.3*blades['e12'], 0.3*blades['e13'], blades['e1'] + blades['e3']]:
+            np.testing.assert_almost_equal(B.exp().log().value, B.value)
+            np.testing.assert_almost_equal((2*B.exp()).log().value, (np.log(2) + B).value)
+        # The principal logarithm of a half turn
+        np.testing.assert_almost_equal((-1 + 1e-20*blades['e12']).log().value,
+                                       (np.pi*blades['e12']).value)
+        for M in [-layout.scalar, 1 + 2*blades['e13']]:
+            with self.assertRaises(ValueError):
+                M.log()
+
+    def test_general(self):
+        from clifford.tools.g3c import random_rotation_translation_rotor
+        from clifford.tools.g3c.rotor_parameterisation import extractRotorComponents, ga_log
+        for i in range(5):
+            R = random_rotation_translation_rotor()
+            B = R.log()
+            self.assertEqual(B.grades(), [2])
+            np.testing.assert_almost_equal(B.exp().value, R.value)
+            np.testing.assert_almost_equal(ga_log(R).value, sum(extractRotorComponents(R)).value)
+        for layout in [Cl(3, 3)[0], Cl(6)[0]]:
+            # Small enough for the rotation angles to stay below pi
+            B = 0.1*layout.randomMV()(2)
+            np.testing.assert_almost_equal(B.exp().log().value, B.value)
+
+    def test_batch(self):
+        from clifford.tools.g3c import random_rotation_translation_rotor
+        layout = conformalize(Cl(3)[0])[0]
+        rotors = MVBatch.from_multivectors([random_rotation_translation_rotor() for i in range(4)])
+        bivectors = rotors.log()
+        for i in range(4):
+            np.testing.assert_almost_equal(bivectors[i].value, rotors[i].log().value)
+        np.testing.assert_almost_equal(bivectors.exp().value, rotors.value)
+
+
+class InPlaceOperatorTests(unittest.TestCase):
+
+    def test_inplace_operators(self):
+        for layout in [Cl(3)[0], conformalize(Cl(3)[0])[0], Cl(7)[0]]:
+            R = layout.randomMV()(0) + layout.randomMV()(2)
+            X = layout.randomMV()(1)
+            Y = X*1
+            value = Y.value
+            Y *= R
+            Y += 2
+            Y -= X
+            Y ^= X
+            Y /= 2
+            Y <<= R
+            Y << X
+            self.assertTrue(np.shares_memory(Y.value, value))
+            expected = ((X*R + 2 - X) ^ X)/2 + R + X
+            np.testing.assert_almost_equal(Y.value, expected.value)
+            # The result may be written over either operand
+            Z = R*1
+            Z *= Z
+            np.testing.assert_almost_equal(Z.value, (R*R).value)
+            Z /= R
+            np.testing.assert_almost_equal(Z.value, R.value)
+
+    def test_views_and_integer_values(self):
+        layout = Cl(3)[0]
+        e1 = layout.blades['e1']
+        batch = MVBatch(layout, np.zeros((2, layout.gaDims)))
+        mv = batch[1]
+        mv += e1
+        np.testing.assert_almost_equal(batch.value[1], e1.value)
+        integer = layout.MultiVector(value=np.arange(layout.gaDims))
+        integer *= 0.5
+        np.testing.assert_almost_equal(integer.value, np.arange(layout.gaDims)/2)
+
+
+class MVBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = conformalize(Cl(3)[0])[0]
+        self.mvs = [self.layout.randomMV() for i in range(6)]
+        self.batch = MVBatch.from_multivectors(self.mvs)
+
+    def test_products_broadcast(self):
+        R = self.layout.randomRotor()
+        other = MVBatch(self.layout, self.batch.value.reshape(2, 3, -1))
+        for op in [lambda a, b: a*b, lambda a, b: a ^ b, lambda a, b: a | b,
+                   lambda a, b: a.lc(b), lambda a, b: a + b, lambda a, b: a - b]:
+            result = op(self.batch, R)
+            for i, mv in enumerate(self.mvs):
+                np.testing.assert_almost_equal(result[i].value, op(mv, R).value)
+            result = op(other, self.batch[:3])
+            self.assertEqual(result.shape, (2, 3))
+            np.testing.assert_almost_equal(result[1, 2].value, op(self.mvs[5], self.mvs[2]).value)
+        sandwich = R*self.batch*~R
+        np.testing.assert_almost_equal(sandwich[4].value, (R*self.mvs[4]*~R).value)
+
+    def test_unary_and_scalars(self):
+        np.testing.assert_almost_equal((~self.batch)[1].value, (~self.mvs[1]).value)
+        np.testing.assert_almost_equal(self.batch(0, 2)[1].value, (self.mvs[1](0) + self.mvs[1](2)).value)
+        np.testing.assert_almost_equal((1 - 2*self.batch/4)[3].value, (1 - self.mvs[3]/2).value)
+        weights = np.arange(6.0)
+        np.testing.assert_almost_equal((self.batch*weights).sum().value,
+                                       sum(w*mv for w, mv in zip(weights, self.mvs)).value)
+        np.testing.assert_almost_equal(self.batch.mean().value, (sum(self.mvs)/6).value)
+
+    def test_gufuncs(self):
+        layout = self.layout
+        values = self.batch.value.reshape(3, 1, 2, -1)
+        for gufunc, func in [(layout.gmt_gufunc, layout.gmt_func), (layout.omt_gufunc, layout.omt_func),
+                             (layout.imt_gufunc, layout.imt_func), (layout.lcmt_gufunc, layout.lcmt_func)]:
+            result = gufunc(values, self.batch.value[:2].reshape(2, 1, -1))
+            self.assertEqual(result.shape, (3, 2, 2, layout.gaDims))
+            np.testing.assert_almost_equal(result[2, 1, 0], func(self.mvs[4].value, self.mvs[1].value))
+            out = np.empty((6, layout.gaDims))
+            self.assertIs(gufunc(self.batch.value, self.mvs[0].value, out=out), out)
+        np.testing.assert_almost_equal(layout.adjoint_gufunc(values)[1, 0, 1], (~self.mvs[3]).value)
+        np.testing.assert_almost_equal(layout.gradeInvol_gufunc(values)[1, 0, 1], self.mvs[3].gradeInvol().value)
+        np.testing.assert_almost_equal(layout.project_gufunc(values, [1, 3])[1, 0, 1],
+                                       (self.mvs[3](1) + self.mvs[3](3)).value)
+
+    def test_parallel(self):
+        layout = self.layout
+        R = layout.randomRotor()
+        values = self.batch.value.reshape(3, 1, 2, -1)
+        for parallel, gufunc in [(layout.gmt_parallel, layout.gmt_gufunc), (layout.omt_parallel, layout.omt_gufunc),
+                                 (layout.imt_parallel, layout.imt_gufunc), (layout.lcmt_parallel, layout.lcmt_gufunc)]:
+            other = self.batch.value[:2].reshape(2, 1, -1)
+            np.testing.assert_almost_equal(parallel(values, other), gufunc(values, other))
+            np.testing.assert_almost_equal(parallel(R.value, values), gufunc(R.value, values))
+        np.testing.assert_almost_equal(self.batch.apply_rotor(R).value, (R*self.batch*~R).value)
+        normal = self.batch.normal()
+        for i, mv in enumerate(self.mvs):
+            np.testing.assert_almost_equal(normal[i].value, mv.normal().value)
+        # Large batches use the parallel kernels in the operators
+        large = MVBatch(layout, np.repeat(self.batch.value, PARALLEL_BATCH_SIZE, axis=0))
+        np.testing.assert_almost_equal((large*large)[-1].value, (self.mvs[-1]*self.mvs[-1]).value)
+
+    def test_matrices(self):
+        layout = self.layout
+        R = layout.randomRotor()
+        X = self.mvs[0]
+        for product, op in [('gmt', lambda a, b: a*b), ('omt', lambda a, b: a ^ b),
+                            ('imt', lambda a, b: a | b), ('lcmt', lambda a, b: a.lc(b))]:
+            np.testing.assert_almost_equal(layout.left_mult_matrix(R.value, product).dot(X.value),
+                                           op(R, X).value)
+            np.testing.assert_almost_equal(layout.right_mult_matrix(R.value, product).dot(X.value),
+                                           op(X, R).value)
+        np.testing.assert_almost_equal(layout.sandwich_matrix(R.value).dot(X.value), (R*X*~R).value)
+        np.testing.assert_almost_equal(layout.sandwich_matrix(R.value, R.inv().value).dot(X.value),
+                                       (R*X*R.inv()).value)
+        values = self.batch.value.reshape(3, 2, -1)
+        result = layout.apply_matrix(layout.sandwich_matrix(R.value), values)
+        np.testing.assert_almost_equal(result[1, 1], (R*self.mvs[3]*~R).value)
+        with self.assertRaises(ValueError):
+            layout.left_mult_matrix(R.value, 'xmt')
+
+    def test_scalar_and_commutator_products(self):
+        A, B = self.mvs[:2]
+        self.assertAlmostEqual(A.scalar_product(B), (A*B)[()])
+        self.assertAlmostEqual(A.mag2(), (~A*A)[()])
+        np.testing.assert_almost_equal(A.commutator(B).value, ((A*B - B*A)/2).value)
+        np.testing.assert_almost_equal(A.anticommutator(B).value, ((A*B + B*A)/2).value)
+        np.testing.assert_almost_equal(A.commutator(3).value, 0)
+        np.testing.assert_almost_equal(self.batch.mag2(), [mv.mag2() for mv in self.mvs])
+        np.testing.assert_almost_equal(self.batch.scalar_product(B), [mv.scalar_product(B) for mv in self.mvs])
+        np.testing.assert_almost_equal(self.batch.commutator(self.batch).value, 0)
+        anticommutator = self.batch.anticommutator(B)
+        for i, mv in enumerate(self.mvs):
+            np.testing.assert_almost_equal(anticommutator[i].value, mv.anticommutator(B).value)
+        # Algebras too large to unroll use the table kernels
+        layout = Cl(7)[0]
+        A, B = layout.randomMV(), layout.randomMV()
+        np.testing.assert_almost_equal(A.commutator(B).value, ((A*B - B*A)/2).value)
+
+    def test_views(self):
+        mv = self.batch[2]
+        self.assertIs(mv.layout, self.layout)
+        mv.mutable_value[0] = 7.0
+        self.assertEqual(self.batch.value[2, 0], 7.0)
+        self.batch[3] = self.mvs[0]
+        np.testing.assert_almost_equal(self.batch[3].value, self.mvs[0].value)
+        wrapped = MVBatch(self.layout, self.batch.value)
+        self.assertIs(wrapped.value, self.batch.value)
+        self.assertEqual(len(self.batch.to_mvarray()), 6)
+        with self.assertRaises(ValueError):
+            MVBatch(self.layout, np.zeros((3, 8)))
+        with self.assertRaises(ValueError):
+            self.batch * Cl(3)[0].randomMV()
+
+
+class OutermorphismTests(unittest.TestCase):
+
+    def test_general_map(self):
+        for layout in [Cl(3)[0], Cl(2, 2)[0], conformalize(Cl(3)[0])[0]]:
+            matrix = np.random.randn(layout.dims, layout.dims)
+            outermorphism = layout.outermorphism_matrix(matrix)
+            basis = [layout.blades['e%i' % (i + layout.firstIdx)] for i in range(layout.dims)]
+            vectors = [layout.randomMV()(1) for i in range(3)]
+            images = []
+            for v in vectors:
+                coefs = [float(v | e) * float(e*e) for e in basis]
+                images.append(sum(c*e for c, e in zip(matrix.dot(coefs), basis)))
+            np.testing.assert_almost_equal(outermorphism.dot(vectors[0].value), images[0].value)
+            np.testing.assert_almost_equal(outermorphism.dot((vectors[0] ^ vectors[1] ^ vectors[2]).value),
+                                           (images[0] ^ images[1] ^ images[2]).value)
+            np.testing.assert_almost_equal(outermorphism.dot(layout.pseudoScalar.value),
+                                           np.linalg.det(matrix) * layout.pseudoScalar.value)
+
+    def test_rotation(self):
+        layout, blades = Cl(3)
+        R = layout.randomRotor()
+        basis = [blades['e1'], blades['e2'], blades['e3']]
+        matrix = np.array([[float((R*b*~R) | e) for b in basis] for e in basis])
+        np.testing.assert_almost_equal(layout.outermorphism_matrix(matrix), layout.sandwich_matrix(R.value))
+        with self.assertRaises(ValueError):
+            layout.outermorphism_matrix(np.eye(4))
+
+
+class PackedMVTests(unittest.TestCase):
+
+    def test_products(self):
+        for layout in [conformalize(Cl(3)[0])[0], Cl(7)[0]]:
+            even = layout.packing(range(0, layout.dims + 1, 2))
+            self.assertIs(layout.packing([2, 0] + list(even.grades)), even)
+            R = layout.randomMV()(*even.grades)
+            X = layout.randomMV()(1) + layout.randomMV()(3)
+            Rp = R.pack()
+            Xp = X.pack()
+            self.assertIs(Rp.packing, even)
+            self.assertEqual(Xp.packing.grades, (1, 3))
+            self.assertEqual(Xp.value.shape, (Xp.packing.size,))
+            for product in ['__mul__', '__xor__', '__or__', 'lc']:
+                for a, b, ap, bp in [(R, X, Rp, Xp), (X, R, Xp, Rp), (X, X, Xp, Xp)]:
+                    np.testing.assert_almost_equal(getattr(ap, product)(bp).unpack().value,
+                                                   getattr(a, product)(b).value)
+            np.testing.assert_almost_equal((Rp*Xp*~Rp)(1).unpack().value, (R*X*~R)(1).value)
+
+    def test_arithmetic(self):
+        layout = conformalize(Cl(3)[0])[0]
+        X = layout.randomMV()(1)
+        B = layout.randomMV()(2)
+        Xp = X.pack()
+        Bp = B.pack()
+        for packed, full in [(Xp + Bp, X + B), (Xp - Bp, X - B), (2 - Xp, 2 - X),
+                             (Xp*2 + 1, X*2 + 1), (-Bp/2, -B/2), (Bp.gradeInvol(), B.gradeInvol())]:
+            np.testing.assert_almost_equal(packed.unpack().value, full.value)
+        self.assertEqual((Xp + Bp).packing.grades, (1, 2))
+        # Products that cannot be non-zero have no coefficients
+        self.assertEqual((Xp ^ layout.pseudoScalar.pack()).value.shape, (0,))
+
+    def test_mixing_with_multivectors(self):
+        layout = conformalize(Cl(3)[0])[0]
+        X = layout.randomMV()
+        Rp = layout.randomRotor().pack()
+        for op in [lambda a, b: a*b, lambda a, b: a ^ b, lambda a, b: a | b,
+                   lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a/b]:
+            with self.assertRaises(TypeError):
+                op(X, Rp)
+            with self.assertRaises(TypeError):
+                op(Rp, X)
+        with self.assertRaises(TypeError):
+            X.lc(Rp)
+        self.assertFalse(X == Rp)
+        # Converting explicitly gives the product
+        np.testing.assert_almost_equal((X*Rp.unpack()).value, (X.pack()*Rp).unpack().value)
+
+    def test_batch(self):
+        layout = conformalize(Cl(3)[0])[0]
+        R = layout.randomMV()(0, 2, 4)
+        Xs = MVBatch.from_multivectors([layout.randomMV()(1) for i in range(4)])
+        Xsp = layout.packing(1).from_mv(Xs)
+        self.assertIsInstance(Xsp, PackedMV)
+        self.assertEqual(Xsp.shape, (4,))
+        result = R.pack()*Xsp*~R.pack()
+        np.testing.assert_almost_equal(result.unpack().value, (R*Xs*~R).value)
+        np.testing.assert_almost_equal(result[2].unpack().value, (R*Xs[2]*~R).value)
+
+
+class BitmapMVTests(unittest.TestCase):
+
+    def test_matches_tables(self):
+        for layout in [Cl(4)[0], Cl(3, 2)[0]]:
+            A = layout.randomMV()
+            B = layout.randomMV()
+            a = BitmapMV.from_mv(A)
+            b = BitmapMV.from_mv(B)
+            self.assertIs(a.layout, layout.bitmap_layout)
+            np.testing.assert_almost_equal(a.to_mv(layout).value, A.value)
+            for product in ['__mul__', '__xor__', '__or__', 'lc']:
+                np.testing.assert_almost_equal(getattr(a, product)(b).to_mv(layout).value,
+                                               getattr(A, product)(B).value)
+            for bitmap_mv, mv in [(a + 2 - b, A + 2 - B), (~a, ~A), (a.gradeInvol(), A.gradeInvol()),
+                                  (a.conjugate(), A.conjugate()), (a(1, 2), A(1, 2)), (3*a/2, 3*A/2)]:
+                np.testing.assert_almost_equal(bitmap_mv.to_mv(layout).value, mv.value)
+
+    def test_large_algebra(self):
+        layout = BitmapLayout([1]*20 + [-1]*4)
+        e = layout.basis_vectors()
+        self.assertEqual(str(e['e3']*e['e1'] + 2), '2.0 + (-1.0^e13)')
+        self.assertEqual(layout.blade(3, 1), -layout.blade(1, 3))
+        self.assertEqual(len(e['e1'] ^ e['e1']), 0)
+        self.assertEqual(float(e['e24']*e['e24']), -1)
+        a = layout.randomMV(1)
+        b = layout.randomMV(1)
+        R = (a*b).normal()
+        self.assertEqual(R*~R, 1)
+        self.assertEqual(R.inv(), ~R)
+        # Sandwiching keeps the result sparse
+        B = layout.randomMV(2, n_terms=10)
+        RBR = R*B*~R
+        self.assertEqual(RBR.grades(), [2])
+        self.assertLessEqual(len(RBR), 24*23//2)
+        np.testing.assert_almost_equal(abs(RBR), abs(B))
+        with self.assertRaises(ValueError):
+            (1 + e['e1']).inv()
+
+    def test_mixing_with_multivectors(self):
+        layout = Cl(4)[0]
+        A = layout.randomMV()
+        b = BitmapMV.from_mv(layout.randomMV())
+        for op in [lambda a, b: a*b, lambda a, b: a ^ b, lambda a, b: a | b,
+                   lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a/b]:
+            with self.assertRaises(TypeError):
+                op(A, b)
+            with self.assertRaises(TypeError):
+                op(b, A)
+        with self.assertRaises(TypeError):
+            A.commutator(b)
+        np.testing.assert_almost_equal((A*b.to_mv(layout)).value, (BitmapMV.from_mv(A)*b).to_mv(layout).value)
+
+
+class LazyMVTests(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = conformalize(Cl(3)[0])[0]
+
+    def test_matches_eager(self):
+        R = self.layout.randomRotor()
+        X = self.layout.randomMV()(2)
+        Y = self.layout.randomMV()
+        for lazy, eager in [((R.lazy()*X*~R).normal(), (R*X*~R).normal()),
+                            (((X.lazy()*Y) - (Y*X))/2, ((X*Y) - (Y*X))/2),
+                            (3 + (X.lazy()*Y)(2) - (X.lazy()*Y)(0), 3 + (X*Y)(2) - (X*Y)(0)),
+                            (-(X.lazy() ^ Y) | R, -(X ^ Y) | R),
+                            ((2*Y.lazy()).lc(X).gradeInvol().conjugate(), (2*Y).lc(X).gradeInvol().conjugate()),
+                            (R.lazy()/R, R/R)]:
+            self.assertIsInstance(lazy, LazyMV)
+            result = lazy.eval()
+            np.testing.assert_almost_equal(result.value, eager.value)
+
+    def test_common_subexpressions(self):
+        X = self.layout.randomMV()
+        Y = self.layout.randomMV()
+        expression = (X.lazy()*Y)(2) + (X.lazy()*Y)(0)
+        nodes, inputs = expression._linearize()
+        # Both products are the same subexpression of the same two inputs
+        self.assertEqual([node[0] for node in nodes].count('gmt'), 1)
+        self.assertEqual(len(inputs), 2)
+
+    def test_kernels_are_reused(self):
+        R = self.layout.randomRotor()
+        X = self.layout.randomMV()(1)
+        expression = R.lazy()*X*~R
+        expression.eval()
+        n_kernels = len(self.layout._expression_kernels)
+        # The inputs are read when the expression is evaluated
+        X.mutable_value[:] = self.layout.randomMV()(1).value
+        np.testing.assert_almost_equal(expression.eval().value, (R*X*~R).value)
+        other = self.layout.randomMV()(1)
+        np.testing.assert_almost_equal((R.lazy()*other*~R).eval().value, (R*other*~R).value)
+        self.assertEqual(len(self.layout._expression_kernels), n_kernels)
+        with self.assertRaises(ValueError):
+            R.lazy()*Cl(3)[0].randomMV()
+
+
+class TracedFunctionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = conformalize(Cl(3)[0])[0]
+
+    def test_traced_function(self):
+        layout = self.layout
+        ninf = layout.blades['e4'] + layout.blades['e5']
+
+        @trace_mv(layout, grades=[[0, 2, 4], 1])
+        def apply_rotor(R, X):
+            """ Applies R to X """
+            return (R*X*~R)(1) + (X*ninf)(0)/2
+
+        self.assertEqual(apply_rotor.__doc__, " Applies R to X ")
+        R = layout.randomRotor()
+        X = layout.randomMV()(1)
+        expected = (R*X*~R)(1) + (X*ninf)(0)/2
+        np.testing.assert_almost_equal(apply_rotor(R, X).value, expected.value)
+        np.testing.assert_almost_equal(apply_rotor.val_func(R.value, X.value), expected.value)
+        # The jitted function can be called from other jitted functions
+        val_func = apply_rotor.val_func
+
+        @numba.njit
+        def twice(r, x):
+            return val_func(r, val_func(r, x))
+        np.testing.assert_almost_equal(twice(R.value, X.value), apply_rotor(R, apply_rotor(R, X)).value)
+
+    def test_batch(self):
+        layout = self.layout
+
+        @trace_mv(layout)
+        def commutator(A, B):
+            return (A*B - B*A)/2
+
+        A = layout.randomMV()
+        batch = MVBatch(layout, np.array([layout.randomMV().value for i in range(6)]).reshape(2, 3, -1))
+        result = commutator.batch_func(A.value, batch.value)
+        self.assertEqual(result.shape, (2, 3, layout.gaDims))
+        np.testing.assert_almost_equal(result[1, 2], A.commutator(batch[1, 2]).value)
+        self.assertIsInstance(commutator(A, batch), MVBatch)
+        with self.assertRaises(ValueError):
+            trace_mv(layout, grades=[1])(commutator.func)
+
+
+class SlotsTests(unittest.TestCase):
+
+    def test_slots(self):
+        layout = Cl(3)[0]
+        mv = layout.randomMV()
+        self.assertFalse(hasattr(mv, '__dict__'))
+        with self.assertRaises(AttributeError):
+            mv.foo = 1
+
+
+class LayoutRegistryTests(unittest.TestCase):
+
+    def test_shared_instance(self):
+        layout = Cl(3)[0]
+        self.assertIs(Cl(3)[0], layout)
+        self.assertIs(Cl(sig=[1, 1, 1])[0], layout)
+        self.assertIsNot(Cl(3, names='f')[0], layout)
+        self.assertIsNot(Cl(3, firstIdx=0)[0], layout)
+        self.assertIsNot(Cl(2, 1)[0], layout)
+        self.assertIs(conformalize(layout)[0], conformalize(layout)[0])
+
+    def test_operators_across_calls(self):
+        e1 = Cl(3)[1]['e1']
+        e2 = Cl(3)[1]['e2']
+        self.assertIs(e1.layout, e2.layout)
+        np.testing.assert_almost_equal((e1*e2).value, Cl(3)[1]['e12'].value)
+
+    def test_weak_eviction(self):
+        from clifford import _layout_registry
+        # Layouts of earlier tests may only be freed by the cycle collector
+        gc.collect()
+        n_layouts = len(_layout_registry)
+        layout = Cl(2, 3)[0]
+        self.assertEqual(len(_layout_registry), n_layouts + 1)
+        del layout
+        gc.collect()
+        self.assertEqual(len(_layout_registry), n_layouts)
+
+
 class FrameTests(unittest.TestCase):
 
     def check_inv(self, A):